@@ -1,19 +1,23 @@
-import dataclasses
+import asyncio
 import io
-import json
 import logging
 import mimetypes
 import os
+import re
+import tempfile
+import time
+from datetime import timedelta
 from pathlib import Path
-from typing import Any, AsyncGenerator, Dict, Union, cast
+from typing import Any, AsyncGenerator, Dict, Literal, Optional, Union, cast
 from prepdocslib.listfilestrategy import ADLSGen2ListFileStrategy
 
-from azure.core.exceptions import ResourceNotFoundError
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
 from azure.identity.aio import DefaultAzureCredential, get_bearer_token_provider
 from azure.monitor.opentelemetry import configure_azure_monitor
 from azure.search.documents.aio import SearchClient
 from azure.search.documents.indexes.aio import SearchIndexClient
-from azure.storage.blob.aio import ContainerClient
+from azure.storage.blob.aio import BlobServiceClient, ContainerClient
 from azure.storage.blob.aio import StorageStreamDownloader as BlobDownloader
 from azure.storage.filedatalake.aio import FileSystemClient
 from azure.storage.filedatalake.aio import StorageStreamDownloader as DatalakeDownloader
@@ -27,59 +31,73 @@ from opentelemetry.instrumentation.openai import OpenAIInstrumentor
 from quart import (
     Blueprint,
     Quart,
+    Response,
     abort,
     current_app,
     jsonify,
     make_response,
     request,
-    send_file,
     send_from_directory,
 )
 from quart_cors import cors
 
 from approaches.approach import Approach
+from approaches.chatapproach import ChatApproach
 from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
 from approaches.chatreadretrievereadvision import ChatReadRetrieveReadVisionApproach
 from approaches.retrievethenread import RetrieveThenReadApproach
 from approaches.retrievethenreadvision import RetrieveThenReadVisionApproach
 from config import (
+    CONFIG_ANSWER_CACHE,
     CONFIG_ASK_APPROACH,
     CONFIG_ASK_VISION_APPROACH,
     CONFIG_AUTH_CLIENT,
-    CONFIG_AUTH_CLIENT_T1,
-    CONFIG_AUTH_CLIENT_T2,
-    CONFIG_AUTH_CLIENT_T3,
-    CONFIG_AUTH_CLIENT_T4,
-    CONFIG_AUTH_CLIENT_T5,
-    CONFIG_AUTH_CLIENT_T6,
-    CONFIG_AUTH_CLIENT_T7,
     CONFIG_BLOB_CONTAINER_CLIENT,
-    CONFIG_CHAT_APPROACH,
-    CONFIG_CHAT_APPROACH_T1,
-    CONFIG_CHAT_APPROACH_T2,
-    CONFIG_CHAT_APPROACH_T3,
-    CONFIG_CHAT_APPROACH_T4,
-    CONFIG_CHAT_APPROACH_T5,
-    CONFIG_CHAT_APPROACH_T6,
-    CONFIG_CHAT_APPROACH_T7,
     CONFIG_CHAT_VISION_APPROACH,
+    CONFIG_CONTENT_CACHE,
+    CONFIG_CONTENT_SAS_URL_GENERATOR,
+    CONFIG_DOCUMENT_ACL_MAP,
     CONFIG_GPT4V_DEPLOYED,
     CONFIG_INGESTER,
     CONFIG_OPENAI_CLIENT,
+    CONFIG_REQUEST_COALESCER,
     CONFIG_SEARCH_CLIENT,
-    CONFIG_SEARCH_CLIENT_T1,
-    CONFIG_SEARCH_CLIENT_T2,
-    CONFIG_SEARCH_CLIENT_T3,
-    CONFIG_SEARCH_CLIENT_T4,
-    CONFIG_SEARCH_CLIENT_T5,
-    CONFIG_SEARCH_CLIENT_T6,
-    CONFIG_SEARCH_CLIENT_T7,
+    CONFIG_SEARCH_INDEX_CLIENT,
+    CONFIG_SEARCH_INDEX_NAME,
+    CONFIG_SEMANTIC_ANSWER_CACHE,
     CONFIG_SEMANTIC_RANKER_DEPLOYED,
+    CONFIG_TENANT_REGISTRY,
     CONFIG_USER_BLOB_CONTAINER_CLIENT,
     CONFIG_USER_UPLOAD_ENABLED,
     CONFIG_VECTOR_SEARCH_ENABLED,
 )
-from core.authentication import AuthenticationHelper
+from core.answercache import AnswerCache, is_complete_answer, record_stream, replay_stream
+from core.authentication import (
+    AuthenticationHelper,
+    GroupAliases,
+    GroupMembershipCache,
+)
+from core.blobsas import BlobSasUrlGenerator
+from core.contentcache import CachedContent, CachedFileBody, ContentCache, ContentCacheWriter
+from core.documentacl import DocumentAclMap
+from core.embeddingbatcher import EmbeddingBatcher
+from core.embeddingcache import EmbeddingCache
+from core.fastjson import OrjsonProvider, dumps_line
+from core.httprange import parse_range_header, total_size_from_content_range
+from core.pageimagecache import PageImageCache
+from core.pdfpages import PAGE_FORMATS, PageNotFoundError, extract_pdf_page
+from core.querycache import QueryRewriteCache
+from core.requestcoalescer import RequestCoalescer
+from core.retrievalcache import RetrievalCache
+from core.searchindexcache import SearchIndexSchemaCache
+from core.semanticcache import SemanticAnswerCache
+from core.tenantregistry import (
+    Tenant,
+    TenantRegistry,
+    index_name_for_tenant,
+    is_valid_tenant_name,
+)
+from core.thoughtsstore import ThoughtsStore
 from decorators import authenticated, authenticated_path
 from error import error_dict, error_response
 from prepdocs import (
@@ -90,13 +108,14 @@ from prepdocs import (
 )
 from prepdocslib.filestrategy import UploadUserFileStrategy
 from prepdocslib.listfilestrategy import File
-from quart import Quart, Blueprint
-from azure.core.credentials import AzureNamedKeyCredential
-import os
-import logging
+from prepdocslib.searchmanager import SearchManager
 
 
 bp = Blueprint("routes", __name__, static_folder="static")
+
+# Size of the first download request made for /content, the rest of the file is streamed in chunks
+CONTENT_FIRST_CHUNK_SIZE = 4 * 1024 * 1024
+
 # Fix Windows registry issue with mimetypes
 mimetypes.add_type("application/javascript", ".js")
 mimetypes.add_type("text/css", ".css")
@@ -124,6 +143,75 @@ async def assets(path):
     return await send_from_directory(Path(__file__).resolve().parent / "static" / "assets", path)
 
 
+async def download_content(
+    path: str,
+    auth_claims: Dict[str, Any],
+    offset: Optional[int] = None,
+    length: Optional[int] = None,
+    if_none_match: Optional[str] = None,
+) -> Union[BlobDownloader, DatalakeDownloader]:
+    """
+    Starts downloading a file from the content container, falling back to the user's upload directory.
+    Aborts with a 404 if the file is in neither.
+    Raises an HttpResponseError with status 304 if the blob in the content container still has the if_none_match ETag.
+    """
+    blob_container_client: ContainerClient = current_app.config[CONFIG_BLOB_CONTAINER_CLIENT]
+    conditions: Dict[str, Any] = {}
+    if if_none_match:
+        conditions = {"etag": if_none_match, "match_condition": MatchConditions.IfModified}
+    try:
+        return await blob_container_client.get_blob_client(path).download_blob(
+            offset=offset, length=length, **conditions
+        )
+    except ResourceNotFoundError:
+        logging.info("Path not found in general Blob container: %s", path)
+        if not current_app.config[CONFIG_USER_UPLOAD_ENABLED]:
+            abort(404)
+    try:
+        user_oid = auth_claims["oid"]
+        user_blob_container_client = current_app.config[CONFIG_USER_BLOB_CONTAINER_CLIENT]
+        user_directory_client: FileSystemClient = user_blob_container_client.get_directory_client(user_oid)
+        file_client = user_directory_client.get_file_client(path)
+        return await file_client.download_file(offset=offset, length=length)
+    except ResourceNotFoundError:
+        logging.exception("Path not found in DataLake: %s", path)
+        abort(404)
+
+
+async def stream_blob(
+    blob: Union[BlobDownloader, DatalakeDownloader], cache_writer: Optional[ContentCacheWriter] = None
+) -> AsyncGenerator[bytes, None]:
+    # The SDK chunk iterator also defines __iter__, which Quart would pick over __aiter__
+    try:
+        async for chunk in blob.chunks():
+            if cache_writer:
+                await asyncio.to_thread(cache_writer.write, chunk)
+            yield chunk
+        if cache_writer:
+            await asyncio.to_thread(cache_writer.commit)
+    finally:
+        if cache_writer:
+            await asyncio.to_thread(cache_writer.discard)
+
+
+async def send_cached_content(content_cache: ContentCache, cached: CachedContent) -> Optional[Response]:
+    """Serves a cached file, or returns None if another worker evicted it since, which makes it a cache miss."""
+    cached_file = await asyncio.to_thread(content_cache.open, cached)
+    if cached_file is None:
+        return None
+    body = CachedFileBody(cached_file, cached.size)
+    response = Response(body, mimetype=cached.content_type)
+    response.content_length = cached.size
+    response.last_modified = cached.last_modified
+    response.set_etag(cached.etag.strip('"'))
+    # Answers If-None-Match with a 304 and Range with a 206
+    await response.make_conditional(request, accept_ranges=True, complete_length=cached.size)
+    if response.response is not body:
+        # Replaced by an empty body, the file is never read
+        await body.close()
+    return response
+
+
 @bp.route("/content/<path>")
 @authenticated_path
 async def content_file(path: str, auth_claims: Dict[str, Any]):
@@ -132,7 +220,9 @@ async def content_file(path: str, auth_claims: Dict[str, Any]):
     *** NOTE *** if you are using app services authentication, this route will return unauthorized to all users that are not logged in
     if AZURE_ENFORCE_ACCESS_CONTROL is not set or false, logged in users can access all files regardless of access control
     if AZURE_ENFORCE_ACCESS_CONTROL is set to true, logged in users can only access files they have access to
-    This is also slow and memory hungry.
+    The file is streamed chunk by chunk, and a single byte range is honoured so PDF viewers can fetch only the pages they render.
+    Files from the content container are cached on local disk by ETag, and If-None-Match is answered with a 304.
+    With USE_CONTENT_SAS_REDIRECT, files from the content container are served by storage through a SAS URL redirect.
     """
     # Remove page number from path, filename-1.txt -> filename.txt
     # This shouldn't typically be necessary as browsers don't send hash fragments to servers
@@ -140,57 +230,139 @@ async def content_file(path: str, auth_claims: Dict[str, Any]):
         path_parts = path.rsplit("#page=", 1)
         path = path_parts[0]
     logging.info("Opening file %s", path)
-    blob_container_client: ContainerClient = current_app.config[CONFIG_BLOB_CONTAINER_CLIENT]
+    sas_url_generator: Optional[BlobSasUrlGenerator] = current_app.config.get(CONFIG_CONTENT_SAS_URL_GENERATOR)
+    if sas_url_generator:
+        # Access was checked by authenticated_path, so hand out a short-lived URL and let storage serve the bytes.
+        # User uploads live in DataLake instead, they are still proxied below.
+        in_content_container = True
+        if current_app.config[CONFIG_USER_UPLOAD_ENABLED]:
+            blob_container_client: ContainerClient = current_app.config[CONFIG_BLOB_CONTAINER_CLIENT]
+            in_content_container = await blob_container_client.get_blob_client(path).exists()
+        if in_content_container:
+            sas_url = await sas_url_generator.get_url(path)
+            return await make_response("", 302, {"Location": sas_url, "Cache-Control": "no-store"})
+    byte_range = parse_range_header(request.headers.get("Range"))
+    offset, length = byte_range if byte_range else (None, None)
+    content_cache: Optional[ContentCache] = current_app.config.get(CONFIG_CONTENT_CACHE)
+    cached = await asyncio.to_thread(content_cache.get, path) if content_cache else None
+    # Only download the file if it changed since the version cached here, or else in the browser
+    known_etag = cached.etag if cached else next((f'"{etag}"' for etag in request.if_none_match), None)
     blob: Union[BlobDownloader, DatalakeDownloader]
     try:
-        blob = await blob_container_client.get_blob_client(path).download_blob()
-    except ResourceNotFoundError:
-        logging.info("Path not found in general Blob container: %s", path)
-        if current_app.config[CONFIG_USER_UPLOAD_ENABLED]:
-            try:
-                user_oid = auth_claims["oid"]
-                user_blob_container_client = current_app.config[CONFIG_USER_BLOB_CONTAINER_CLIENT]
-                user_directory_client: FileSystemClient = user_blob_container_client.get_directory_client(user_oid)
-                file_client = user_directory_client.get_file_client(path)
-                blob = await file_client.download_file()
-            except ResourceNotFoundError:
-                logging.exception("Path not found in DataLake: %s", path)
-                abort(404)
+        blob = await download_content(path, auth_claims, offset=offset, length=length, if_none_match=known_etag)
+    except HttpResponseError as error:
+        # Storage answers If-None-Match with a bare 304, which the SDK doesn't map to ResourceNotModifiedError
+        if error.status_code == 304 and content_cache and cached:
+            response = await send_cached_content(content_cache, cached)
+            if response:
+                return response
+            # Evicted by another worker meanwhile
+            blob = await download_content(path, auth_claims, offset=offset, length=length)
+        elif error.status_code == 304:
+            return await make_response("", 304, {"ETag": known_etag})
+        # The requested range starts past the end of the file
+        elif error.status_code == 416:
+            return await make_response("", 416, {"Content-Range": "bytes */*"})
         else:
-            abort(404)
+            raise
     if not blob.properties or not blob.properties.has_key("content_settings"):
         abort(404)
     mime_type = blob.properties["content_settings"]["content_type"]
     if mime_type == "application/octet-stream":
         mime_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
-    blob_file = io.BytesIO()
-    await blob.readinto(blob_file)
-    blob_file.seek(0)
-    return await send_file(blob_file, mimetype=mime_type, as_attachment=False, attachment_filename=path)
-
-
-# @bp.route("/ask", methods=["POST"])
-# @authenticated
-# async def ask(auth_claims: Dict[str, Any]):
-#     if not request.is_json:
-#         return jsonify({"error": "request must be json"}), 415
-#     request_json = await request.get_json()
-#     context = request_json.get("context", {})
-#     context["auth_claims"] = auth_claims
-#     try:
-#         use_gpt4v = context.get("overrides", {}).get("use_gpt4v", False)
-#         approach: Approach
-#         if use_gpt4v and CONFIG_ASK_VISION_APPROACH in current_app.config:
-#             approach = cast(Approach, current_app.config[CONFIG_ASK_VISION_APPROACH])
-#         else:
-#             approach = cast(Approach, current_app.config[CONFIG_CHAT_APPROACH_T1])
-#         r = await approach.run(
-#             request_json["messages"], context=context, session_state=request_json.get("session_state")
-#         )
-#         return jsonify(r)
-#     except Exception as error:
-#         return error_response(error, "/ask")
-    
+    etag = blob.properties.etag
+    if etag and request.if_none_match.contains(etag.strip('"')):
+        return await make_response("", 304, {"ETag": etag})
+    headers = {"Accept-Ranges": "bytes", "Content-Length": str(blob.size)}
+    status = 200
+    if byte_range:
+        status = 206
+        total_size = total_size_from_content_range(getattr(blob.properties, "content_range", None))
+        headers["Content-Range"] = f"bytes {offset}-{offset + blob.size - 1}/{total_size}"
+    # User uploads are private to their owner, so only files from the shared content container are cached
+    cache_writer = None
+    if content_cache and etag and not byte_range and not isinstance(blob, DatalakeDownloader):
+        cache_writer = await asyncio.to_thread(
+            content_cache.writer, path, etag, mime_type, blob.size, blob.properties.last_modified
+        )
+    response = Response(stream_blob(blob, cache_writer), status=status, headers=headers, mimetype=mime_type)
+    if etag:
+        response.set_etag(etag.strip('"'))
+    response.last_modified = blob.properties.last_modified
+    return response
+
+
+@bp.route("/content/<path>/page/<int:page_number>")
+@authenticated_path
+async def content_page(path: str, auth_claims: Dict[str, Any], page_number: int):
+    """
+    Serve a single page of a PDF citation, numbered like the #page= fragment, as a one page PDF or with ?format=png
+    as an image, so that opening a citation in a long manual doesn't download the whole document.
+    Extracted pages and their source file are cached on local disk by the ETag of the source file.
+    """
+    page_format = request.args.get("format", "pdf")
+    if page_format not in PAGE_FORMATS:
+        return jsonify({"error": f"Unsupported page format {page_format}"}), 400
+    content_cache: Optional[ContentCache] = current_app.config.get(CONFIG_CONTENT_CACHE)
+    page_key = f"{path}#page={page_number}.{page_format}"
+    cached_page = await asyncio.to_thread(content_cache.get, page_key) if content_cache else None
+    cached_file = await asyncio.to_thread(content_cache.get, path) if content_cache else None
+    known_etag = cached_page.etag if cached_page else cached_file.etag if cached_file else None
+    pdf: Optional[bytes] = None
+    downloaded: Optional[tuple[str, bytes]] = None
+    blob: Optional[Union[BlobDownloader, DatalakeDownloader]] = None
+    try:
+        blob = await download_content(path, auth_claims, if_none_match=known_etag)
+    except HttpResponseError as error:
+        if error.status_code != 304:
+            raise
+        content_cache = cast(ContentCache, content_cache)
+        if cached_page:
+            response = await send_cached_content(content_cache, cached_page)
+            if response:
+                return response
+        if cached_file and cached_file.etag == known_etag:
+            # The cached file is current, extract the page from it
+            etag, last_modified, cacheable = cached_file.etag, cached_file.last_modified, True
+            pdf = await asyncio.to_thread(content_cache.read, cached_file)
+        if pdf is None:
+            # Evicted by another worker meanwhile
+            blob = await download_content(path, auth_claims)
+    if blob is not None:
+        etag, last_modified = blob.properties.etag, blob.properties.last_modified
+        pdf = await blob.readall()
+        # User uploads are private to their owner, so only files from the shared content container are cached
+        cacheable = bool(etag) and not isinstance(blob, DatalakeDownloader)
+        mime_type = blob.properties["content_settings"]["content_type"]
+        if mime_type == "application/octet-stream":
+            mime_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        downloaded = (mime_type, pdf)
+
+    try:
+        page = await asyncio.to_thread(extract_pdf_page, pdf, page_number, page_format)
+    except PageNotFoundError:
+        abort(404)
+    except ValueError:
+        return jsonify({"error": f"{path} is not a PDF"}), 400
+
+    if content_cache and cacheable:
+        # Only cached once it turned out to be a PDF, /content serves it from the cache with its own content type
+        if downloaded:
+            await asyncio.to_thread(content_cache.put, path, etag, downloaded[0], downloaded[1], last_modified)
+        cached_page = await asyncio.to_thread(
+            content_cache.put, page_key, etag, PAGE_FORMATS[page_format], page, last_modified
+        )
+        if cached_page:
+            response = await send_cached_content(content_cache, cached_page)
+            if response:
+                return response
+    response = Response(page, mimetype=PAGE_FORMATS[page_format])
+    if etag:
+        response.set_etag(etag.strip('"'))
+    response.last_modified = last_modified
+    return response
+
+
 @bp.route("/ask", methods=["POST"])
 @authenticated
 async def ask(auth_claims: Dict[str, Any]):
@@ -204,205 +376,174 @@ async def ask(auth_claims: Dict[str, Any]):
         approach: Approach
         if use_gpt4v and CONFIG_ASK_VISION_APPROACH in current_app.config:
             approach = cast(Approach, current_app.config[CONFIG_ASK_VISION_APPROACH])
+            index_name = current_app.config[CONFIG_SEARCH_INDEX_NAME]
         else:
-            approach = cast(Approach, current_app.config[CONFIG_CHAT_APPROACH_T1])
+            tenant_registry: TenantRegistry = current_app.config[CONFIG_TENANT_REGISTRY]
+            tenant = await tenant_registry.get("T1")
+            approach = tenant.chat_approach
+            index_name = tenant.index_name
 
-        result = await approach.run(
-            request_json["messages"],
-            stream=request_json.get("stream", False),
-            context=context,
-            session_state=request_json.get("session_state"),
-        )
-        if isinstance(result, dict):
-            return jsonify(result)
-        else:
-            response = await make_response(format_as_ndjson(result))
-            response.timeout = None  # type: ignore
-            response.mimetype = "application/json-lines"
-            return response
+        result = await run_approach(approach, index_name, request_json, context)
+        return await make_approach_response(result)
     except Exception as error:
         return error_response(error, "/ask")
 
 
-class JSONEncoder(json.JSONEncoder):
-    def default(self, o):
-        if dataclasses.is_dataclass(o):
-            return dataclasses.asdict(o)
-        return super().default(o)
+async def run_approach(approach: Approach, index_name: str, request_json: dict[str, Any], context: dict[str, Any]):
+    """
+    Runs an approach on a request, or answers it from the answer caches when enabled.
+    Identical requests that come in while one is running share its run when coalescing is enabled.
+    """
+    messages = request_json["messages"]
+    stream = request_json.get("stream", False)
+    session_state = request_json.get("session_state")
+    answer_cache: Optional[AnswerCache] = current_app.config.get(CONFIG_ANSWER_CACHE)
+    semantic_cache: Optional[SemanticAnswerCache] = current_app.config.get(CONFIG_SEMANTIC_ANSWER_CACHE)
+    coalescer: Optional[RequestCoalescer] = current_app.config.get(CONFIG_REQUEST_COALESCER)
+    if answer_cache is None and semantic_cache is None and coalescer is None:
+        return await approach.run(messages, stream=stream, context=context, session_state=session_state)
+
+    overrides = context.get("overrides", {})
+    filter = approach.build_filter(overrides, context.get("auth_claims", {}))
+    approach_name = type(approach).__name__
+    key = AnswerCache.key(index_name, approach_name, messages, filter, overrides)
+    # Only the chat approaches stream
+    stream = stream and isinstance(approach, ChatApproach)
+    cached = answer_cache.get(key, session_state) if answer_cache is not None else None
+    scope_key = None
+    question_vector: list[float] = []
+    if (
+        cached is None
+        and semantic_cache is not None
+        and len(messages) == 1
+        and isinstance(messages[0]["content"], str)
+        # Text retrieval doesn't embed the question, deployments that only use it may not have an embedding model
+        and overrides.get("retrieval_mode") != "text"
+    ):
+        try:
+            question_vector = (await approach.compute_text_embedding(messages[0]["content"])).vector
+        except Exception as error:
+            # The cache is an optimization, the request is answered without it
+            current_app.logger.warning("Skipping the semantic answer cache, could not embed the question: %s", error)
+        else:
+            scope_key = SemanticAnswerCache.scope(index_name, approach_name, filter, overrides)
+            cached = semantic_cache.get(scope_key, question_vector, session_state)
+    if cached is not None:
+        return replay_stream(cached) if stream else cached
+
+    def cache_answer(response: dict[str, Any]):
+        if not is_complete_answer(response):
+            return
+        if answer_cache is not None:
+            answer_cache.put(key, index_name, response)
+        if semantic_cache is not None and scope_key is not None:
+            semantic_cache.put(scope_key, index_name, question_vector, response)
+
+    async def run():
+        # Runs once for all the requests sharing it, so only the request that started it caches the answer
+        result = await approach.run(messages, stream=stream, context=context, session_state=session_state)
+        if isinstance(result, dict):
+            cache_answer(result)
+            return result
+        return record_stream(result, cache_answer)
 
+    if coalescer is not None:
+        return await coalescer.run(f"{key}:{stream}", run, stream, session_state)
+    return await run()
 
-async def format_as_ndjson(r: AsyncGenerator[dict, None]) -> AsyncGenerator[str, None]:
+
+async def format_as_ndjson(r: AsyncGenerator[dict, None]) -> AsyncGenerator[bytes, None]:
     try:
         async for event in r:
-            yield json.dumps(event, ensure_ascii=False, cls=JSONEncoder) + "\n"
+            yield dumps_line(event)
     except Exception as error:
         logging.exception("Exception while generating response stream: %s", error)
-        yield json.dumps(error_dict(error))
+        yield dumps_line(error_dict(error))
 
 
-@bp.route("/chat", methods=["POST"])
-@authenticated
-async def chat(auth_claims: Dict[str, Any]):
+async def make_approach_response(result: Union[dict[str, Any], AsyncGenerator[dict[str, Any], None]]):
+    if isinstance(result, dict):
+        return jsonify(result)
+    else:
+        response = await make_response(format_as_ndjson(result))
+        response.timeout = None  # type: ignore
+        response.mimetype = "application/json-lines"
+        return response
+
+
+async def chat_with_tenant(tenant_name: str, auth_claims: Dict[str, Any], route: str):
     if not request.is_json:
         return jsonify({"error": "request must be json"}), 415
+    if not is_valid_tenant_name(tenant_name):
+        return jsonify({"error": f"Unknown tenant {tenant_name}"}), 404
     request_json = await request.get_json()
     context = request_json.get("context", {})
     context["auth_claims"] = auth_claims
     try:
+        tenant_registry: TenantRegistry = current_app.config[CONFIG_TENANT_REGISTRY]
+        try:
+            tenant = await tenant_registry.get(tenant_name)
+        except ResourceNotFoundError:
+            logging.warning("No search index found for tenant %s", tenant_name)
+            return jsonify({"error": f"Unknown tenant {tenant_name}"}), 404
         use_gpt4v = context.get("overrides", {}).get("use_gpt4v", False)
         approach: Approach
-        if use_gpt4v and CONFIG_CHAT_VISION_APPROACH in current_app.config:
-            approach = cast(Approach, current_app.config[CONFIG_CHAT_VISION_APPROACH])
+        if use_gpt4v and tenant.chat_vision_approach is not None:
+            approach = tenant.chat_vision_approach
         else:
-            approach = cast(Approach, current_app.config[CONFIG_CHAT_APPROACH_T2])
+            approach = tenant.chat_approach
 
-        result = await approach.run(
-            request_json["messages"],
-            stream=request_json.get("stream", False),
-            context=context,
-            session_state=request_json.get("session_state"),
-        )
-        if isinstance(result, dict):
-            return jsonify(result)
-        else:
-            response = await make_response(format_as_ndjson(result))
-            response.timeout = None  # type: ignore
-            response.mimetype = "application/json-lines"
-            return response
+        result = await run_approach(approach, tenant.index_name, request_json, context)
+        return await make_approach_response(result)
     except Exception as error:
-        return error_response(error, "/chat")
+        return error_response(error, route)
+
+
+@bp.route("/chat/<tenant>", methods=["POST"])
+@authenticated
+async def chat_tenant(auth_claims: Dict[str, Any], tenant: str):
+    return await chat_with_tenant(tenant, auth_claims, "/chat/<tenant>")
+
+
+# The numbered routes predate folder-addressed tenants and map onto the legacy T2..T6 indexes
+@bp.route("/chat", methods=["POST"])
+@authenticated
+async def chat(auth_claims: Dict[str, Any]):
+    return await chat_with_tenant("T2", auth_claims, "/chat")
 
 
 @bp.route("/chat2", methods=["POST"])
 @authenticated
 async def chat2(auth_claims: Dict[str, Any]):
-    if not request.is_json:
-        return jsonify({"error": "request must be json"}), 415
-    request_json = await request.get_json()
-    context = request_json.get("context", {})
-    context["auth_claims"] = auth_claims
-    try:
-        use_gpt4v = context.get("overrides", {}).get("use_gpt4v", False)
-        approach: Approach
-        if use_gpt4v and CONFIG_CHAT_VISION_APPROACH in current_app.config:
-            approach = cast(Approach, current_app.config[CONFIG_CHAT_VISION_APPROACH])
-        else:
-            approach = cast(Approach, current_app.config[CONFIG_CHAT_APPROACH_T3])
-
-        result = await approach.run(
-            request_json["messages"],
-            stream=request_json.get("stream", False),
-            context=context,
-            session_state=request_json.get("session_state"),
-        )
-        if isinstance(result, dict):
-            return jsonify(result)
-        else:
-            response = await make_response(format_as_ndjson(result))
-            response.timeout = None  # type: ignore
-            response.mimetype = "application/json-lines"
-            return response
-    except Exception as error:
-        return error_response(error, "/chat2")   
+    return await chat_with_tenant("T3", auth_claims, "/chat2")
 
 
 @bp.route("/chat3", methods=["POST"])
 @authenticated
 async def chat3(auth_claims: Dict[str, Any]):
-    if not request.is_json:
-        return jsonify({"error": "request must be json"}), 415
-    request_json = await request.get_json()
-    context = request_json.get("context", {})
-    context["auth_claims"] = auth_claims
-    try:
-        use_gpt4v = context.get("overrides", {}).get("use_gpt4v", False)
-        approach: Approach
-        if use_gpt4v and CONFIG_CHAT_VISION_APPROACH in current_app.config:
-            approach = cast(Approach, current_app.config[CONFIG_CHAT_VISION_APPROACH])
-        else:
-            approach = cast(Approach, current_app.config[CONFIG_CHAT_APPROACH_T4])
+    return await chat_with_tenant("T4", auth_claims, "/chat3")
 
-        result = await approach.run(
-            request_json["messages"],
-            stream=request_json.get("stream", False),
-            context=context,
-            session_state=request_json.get("session_state"),
-        )
-        if isinstance(result, dict):
-            return jsonify(result)
-        else:
-            response = await make_response(format_as_ndjson(result))
-            response.timeout = None  # type: ignore
-            response.mimetype = "application/json-lines"
-            return response
-    except Exception as error:
-        return error_response(error, "/chat3")    
 
 @bp.route("/chat4", methods=["POST"])
 @authenticated
 async def chat4(auth_claims: Dict[str, Any]):
-    if not request.is_json:
-        return jsonify({"error": "request must be json"}), 415
-    request_json = await request.get_json()
-    context = request_json.get("context", {})
-    context["auth_claims"] = auth_claims
-    try:
-        use_gpt4v = context.get("overrides", {}).get("use_gpt4v", False)
-        approach: Approach
-        if use_gpt4v and CONFIG_CHAT_VISION_APPROACH in current_app.config:
-            approach = cast(Approach, current_app.config[CONFIG_CHAT_VISION_APPROACH])
-        else:
-            approach = cast(Approach, current_app.config[CONFIG_CHAT_APPROACH_T5])
-
-        result = await approach.run(
-            request_json["messages"],
-            stream=request_json.get("stream", False),
-            context=context,
-            session_state=request_json.get("session_state"),
-        )
-        if isinstance(result, dict):
-            return jsonify(result)
-        else:
-            response = await make_response(format_as_ndjson(result))
-            response.timeout = None  # type: ignore
-            response.mimetype = "application/json-lines"
-            return response
-    except Exception as error:
-        return error_response(error, "/chat4")
+    return await chat_with_tenant("T5", auth_claims, "/chat4")
 
 
 @bp.route("/chat5", methods=["POST"])
 @authenticated
 async def chat5(auth_claims: Dict[str, Any]):
-    if not request.is_json:
-        return jsonify({"error": "request must be json"}), 415
-    request_json = await request.get_json()
-    context = request_json.get("context", {})
-    context["auth_claims"] = auth_claims
-    try:
-        use_gpt4v = context.get("overrides", {}).get("use_gpt4v", False)
-        approach: Approach
-        if use_gpt4v and CONFIG_CHAT_VISION_APPROACH in current_app.config:
-            approach = cast(Approach, current_app.config[CONFIG_CHAT_VISION_APPROACH])
-        else:
-            approach = cast(Approach, current_app.config[CONFIG_CHAT_APPROACH_T6])
+    return await chat_with_tenant("T6", auth_claims, "/chat5")
 
-        result = await approach.run(
-            request_json["messages"],
-            stream=request_json.get("stream", False),
-            context=context,
-            session_state=request_json.get("session_state"),
-        )
-        if isinstance(result, dict):
-            return jsonify(result)
-        else:
-            response = await make_response(format_as_ndjson(result))
-            response.timeout = None  # type: ignore
-            response.mimetype = "application/json-lines"
-            return response
-    except Exception as error:
-        return error_response(error, "/chat5")
 
+# Thoughts of responses that were sent without them, see Approach.add_thoughts
+@bp.get("/thoughts/<thoughts_id>")
+@authenticated
+async def thoughts(auth_claims: Dict[str, Any], thoughts_id: str):
+    thoughts = await Approach.thoughts_store.fetch(thoughts_id, auth_claims.get("oid"))
+    if thoughts is None:
+        return jsonify({"error": "Thoughts not found or expired"}), 404
+    return jsonify({"thoughts": thoughts})
 
 
 @bp.get("/list_folders")
@@ -496,50 +637,33 @@ async def list_uploaded(auth_claims: dict[str, Any]):
             current_app.logger.exception("Error listing uploaded files", error)
     return jsonify(files), 200
 
-# @bp.get("/list_folders")
-# @authenticated
-# async def list_folders(auth_claims: Dict[str, Any]):
-#     if not request.is_json:
-#         return jsonify({"error": "request must be json"}), 415
-#     request_json = await request.get_json()
-#     context = request_json.get("context", {})
-#     context["auth_claims"] = auth_claims
-#     try:
-#         # Retrieve the folder listing strategy from the Flask config
-#         list_file_strategy = current_app.config['LIST_FILE_STRATEGY']
-        
-#         # List folders using the strategy
-#         folder_names = await list_file_strategy.list_folders()
-        
-#         # Log and return the folder names as JSON
-#         current_app.logger.info(f"Successfully listed folders: {folder_names}")
-#         return jsonify(folder_names)
-#     except Exception as error:
-#         # Log and return an error response if something goes wrong
-#         current_app.logger.error(f"Error listing folders: {error}")
-#         return error_response(error, "/list_folders")
-    
-# @bp.route("/list_folders", methods=["GET"])
-# def list_folders():
-#     try:
-#         # Retrieve the folder listing strategy from the Flask config
-#         list_file_strategy = current_app.config['LIST_FILE_STRATEGY']
-        
-#         # List folders using the strategy
-#         folder_names = list_file_strategy.list_folders()
-        
-#         # Log and return the folder names as JSON
-#         current_app.logger.info(f"Successfully listed folders: {folder_names}")
-#         return jsonify(folder_names)
-#     except Exception as error:
-#         # Log and return an error response if something goes wrong
-#         current_app.logger.error(f"Error listing folders: {error}")
-#         return error_response(error, "/list_folders")
 
+def log_startup_phase(phase: str, start: float) -> float:
+    """Logs the time spent in a startup phase so cold start regressions are visible, returns the current time."""
+    now = time.perf_counter()
+    current_app.logger.info("Startup phase '%s' took %.1f ms", phase, (now - start) * 1000)
+    return now
+
+
+async def acl_map_key_field(search_index_client: SearchIndexClient, index_name: str) -> Optional[str]:
+    """Returns the key field the document ACL map pages the index by, or None if it can't be used."""
+    try:
+        search_index = await search_index_client.get_index(index_name)
+    except Exception as error:
+        current_app.logger.warning("Not using the document ACL map, could not fetch index %s: %s", index_name, error)
+        return None
+    key_field = DocumentAclMap.key_field(search_index)
+    if key_field is None:
+        # Indexes created before the key was made sortable and filterable keep it that way, they need to be recreated
+        current_app.logger.warning(
+            "Not using the document ACL map, the key of index %s is not sortable and filterable", index_name
+        )
+    return key_field
 
 
 @bp.before_app_serving
 async def setup_clients():
+    startup_start = phase_start = time.perf_counter()
     # Replace these with your own values, either in environment variables or directly here
     AZURE_STORAGE_ACCOUNT = os.environ["AZURE_STORAGE_ACCOUNT"]
     AZURE_STORAGE_CONTAINER = os.environ["AZURE_STORAGE_CONTAINER"]
@@ -547,13 +671,21 @@ async def setup_clients():
     AZURE_USERSTORAGE_CONTAINER = os.environ.get("AZURE_USERSTORAGE_CONTAINER")
     AZURE_SEARCH_SERVICE = os.environ["AZURE_SEARCH_SERVICE"]
     AZURE_SEARCH_INDEX = os.environ["AZURE_SEARCH_INDEX"]
-    AZURE_SEARCH_INDEX_T1 = os.environ["AZURE_SEARCH_INDEX_T1"]
-    AZURE_SEARCH_INDEX_T2 = os.environ["AZURE_SEARCH_INDEX_T2"]
-    AZURE_SEARCH_INDEX_T3 = os.environ["AZURE_SEARCH_INDEX_T3"]
-    AZURE_SEARCH_INDEX_T4 = os.environ["AZURE_SEARCH_INDEX_T4"]
-    AZURE_SEARCH_INDEX_T5 = os.environ["AZURE_SEARCH_INDEX_T5"]
-    AZURE_SEARCH_INDEX_T6 = os.environ["AZURE_SEARCH_INDEX_T6"]
-    AZURE_SEARCH_INDEX_T7 = os.environ["AZURE_SEARCH_INDEX_T7"]
+    # Tenants are folders in ADLS, each with its own index named <prefix>-<folder>
+    AZURE_SEARCH_INDEX_PREFIX = os.getenv("AZURE_SEARCH_INDEX_PREFIX", AZURE_SEARCH_INDEX)
+    # The legacy tenants T1..T7 keep their explicitly configured indexes (AZURE_SEARCH_INDEX_T1...)
+    AZURE_SEARCH_TENANT_INDEXES = {
+        key[len("AZURE_SEARCH_INDEX_") :]: value
+        for key, value in os.environ.items()
+        if re.fullmatch(r"AZURE_SEARCH_INDEX_T\d+", key) and value
+    }
+    AZURE_SEARCH_MAX_TENANTS = int(os.getenv("AZURE_SEARCH_MAX_TENANTS", 32))
+    # Index schemas are snapshotted on disk so that recycled workers don't fetch them again, set the TTL to 0 to disable
+    AZURE_SEARCH_SCHEMA_CACHE_TTL = float(os.getenv("AZURE_SEARCH_SCHEMA_CACHE_TTL", 3600))
+    AZURE_SEARCH_SCHEMA_CACHE_PATH = os.getenv(
+        "AZURE_SEARCH_SCHEMA_CACHE_PATH",
+        os.path.join(tempfile.gettempdir(), f"search-index-schemas-{AZURE_SEARCH_SERVICE}.json"),
+    )
     # Shared by all OpenAI deployments
     OPENAI_HOST = os.getenv("OPENAI_HOST", "azure")
     OPENAI_CHATGPT_MODEL = os.environ["AZURE_OPENAI_CHATGPT_MODEL"]
@@ -582,6 +714,18 @@ async def setup_clients():
     AZURE_SERVER_APP_SECRET = os.getenv("AZURE_SERVER_APP_SECRET")
     AZURE_CLIENT_APP_ID = os.getenv("AZURE_CLIENT_APP_ID")
     AZURE_AUTH_TENANT_ID = os.getenv("AZURE_AUTH_TENANT_ID", AZURE_TENANT_ID)
+    # Groups listed from Microsoft Graph for users with a groups overage claim are cached that long per user
+    AZURE_AUTH_GROUPS_CACHE_TTL = float(os.getenv("AZURE_AUTH_GROUPS_CACHE_TTL", 7200))
+    # With access control enforced, the ACLs of the index are kept in memory and reloaded that often to authorize /content
+    AZURE_SEARCH_ACL_REFRESH_SECONDS = float(os.getenv("AZURE_SEARCH_ACL_REFRESH_SECONDS", 300))
+    # Only one worker of an instance rebuilds them, the others load its snapshot, set the path to empty to disable
+    AZURE_SEARCH_ACL_SNAPSHOT_PATH = os.getenv(
+        "AZURE_SEARCH_ACL_SNAPSHOT_PATH",
+        os.path.join(tempfile.gettempdir(), f"document-acls-{AZURE_SEARCH_SERVICE}-{AZURE_SEARCH_INDEX}.json"),
+    )
+    # JSON file mapping group aliases to their groups, used for the security filter of users in many groups
+    AZURE_AUTH_GROUP_ALIASES_PATH = os.getenv("AZURE_AUTH_GROUP_ALIASES_PATH")
+    AZURE_AUTH_GROUP_ALIASES_MIN_GROUPS = int(os.getenv("AZURE_AUTH_GROUP_ALIASES_MIN_GROUPS", 100))
 
     KB_FIELDS_CONTENT = os.getenv("KB_FIELDS_CONTENT", "content")
     KB_FIELDS_SOURCEPAGE = os.getenv("KB_FIELDS_SOURCEPAGE", "sourcepage")
@@ -594,6 +738,60 @@ async def setup_clients():
     AZURE_SPEECH_SERVICE_LOCATION = os.getenv("AZURE_SPEECH_SERVICE_LOCATION")
     AZURE_SPEECH_VOICE = os.getenv("AZURE_SPEECH_VOICE", "en-US-AndrewMultilingualNeural")
 
+    # Citations served by /content are cached on local disk, set the size to 0 to disable
+    CONTENT_CACHE_MAX_MB = int(os.getenv("CONTENT_CACHE_MAX_MB", 512))
+    CONTENT_CACHE_DIR = os.getenv("CONTENT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "content-cache"))
+    # Redirect /content to short-lived SAS URLs so that file downloads don't go through the app
+    USE_CONTENT_SAS_REDIRECT = os.getenv("USE_CONTENT_SAS_REDIRECT", "").lower() == "true"
+    CONTENT_SAS_EXPIRY_MINUTES = int(os.getenv("CONTENT_SAS_EXPIRY_MINUTES", 5))
+
+    # Query vectors are cached in memory, set the number of entries to 0 to disable
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 10000))
+    EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", 24 * 3600))
+    # Query texts of concurrent requests are embedded together, set the batch size to 1 to disable
+    EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", 16))
+    EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", 5))
+    # Search queries generated from conversations are cached in memory, set the number of entries to 0 to disable
+    QUERY_REWRITE_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_REWRITE_CACHE_MAX_ENTRIES", 10000))
+    # "always" generates a search query for every question, "history" only when there is history to resolve it against
+    QUERY_REWRITE_POLICY = os.getenv("QUERY_REWRITE_POLICY", "always").lower()
+    # Page images sent to GPT-4V are cached in memory, set the size to 0 to disable
+    PAGE_IMAGE_CACHE_MAX_MB = float(os.getenv("PAGE_IMAGE_CACHE_MAX_MB", 64))
+    PAGE_IMAGE_CACHE_TTL = float(os.getenv("PAGE_IMAGE_CACHE_TTL", 3600))
+    # Scale page images down to the size GPT-4V uses for the detail level and send them as JPEG
+    PAGE_IMAGE_RESIZE = os.getenv("PAGE_IMAGE_RESIZE", "").lower() == "true"
+    # Detail level the page images are sent with, "low" costs a fixed small number of tokens per image
+    GPT4V_IMAGE_DETAIL = os.getenv("GPT4V_IMAGE_DETAIL", "auto").lower()
+    # Streamed answers merge the content deltas of this many milliseconds into one event, 0 to send every delta
+    STREAM_FLUSH_INTERVAL_MS = float(os.getenv("STREAM_FLUSH_INTERVAL_MS", 0))
+    # Complete answers are cached in memory, off unless a number of entries is set. Uploads and deletions only
+    # invalidate the answers cached by the worker that handled them, the other workers and prepdocs ingestion runs
+    # don't, so answers can be up to ANSWER_CACHE_TTL seconds out of date
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 0))
+    ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 3600))
+    # Single-turn questions whose embeddings are this close to one answered before get the same answer, off if unset
+    SEMANTIC_ANSWER_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_ANSWER_CACHE_THRESHOLD", 0))
+    SEMANTIC_ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_ANSWER_CACHE_MAX_ENTRIES", 256))
+    # Every search filter, and so every user when access control is enforced, has its own scope of questions.
+    # The rows bound the memory, 4096 rows of 1536 dimensions take 24 MiB per worker
+    SEMANTIC_ANSWER_CACHE_MAX_SCOPES = int(os.getenv("SEMANTIC_ANSWER_CACHE_MAX_SCOPES", 1000))
+    SEMANTIC_ANSWER_CACHE_MAX_ROWS = int(os.getenv("SEMANTIC_ANSWER_CACHE_MAX_ROWS", 4096))
+    # Search results are cached in memory, set the number of entries to 0 to disable. Changes made by this app
+    # invalidate them right away, the ttl bounds how long changes made by other ingestion runs take to show up
+    RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", 1000))
+    RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", 60))
+    # Identical chat and ask requests that arrive while one of them is being answered share its answer
+    USE_REQUEST_COALESCING = os.getenv("USE_REQUEST_COALESCING", "").lower() == "true"
+    # Responses leave out the thoughts unless asked for with the include_thoughts override or INCLUDE_THOUGHTS,
+    # they can be fetched from /thoughts for THOUGHTS_TTL seconds instead, from the memory of the worker that answered.
+    # With THOUGHTS_DIR the workers of an instance share them, at the cost of building and writing them per response
+    INCLUDE_THOUGHTS = os.getenv("INCLUDE_THOUGHTS", "").lower() == "true"
+    THOUGHTS_TTL = float(os.getenv("THOUGHTS_TTL", 300))
+    THOUGHTS_DIR = os.getenv("THOUGHTS_DIR", "")
+    # Chat approaches start searching with the question as asked while generating the search query
+    USE_SPECULATIVE_RETRIEVAL = os.getenv("USE_SPECULATIVE_RETRIEVAL", "").lower() == "true"
+    SPECULATIVE_RETRIEVAL_MIN_SIMILARITY = float(os.getenv("SPECULATIVE_RETRIEVAL_MIN_SIMILARITY", 0.95))
+
     USE_GPT4V = os.getenv("USE_GPT4V", "").lower() == "true"
     USE_USER_UPLOAD = os.getenv("USE_USER_UPLOAD", "").lower() == "true"
     USE_SPEECH_INPUT_BROWSER = os.getenv("USE_SPEECH_INPUT_BROWSER", "").lower() == "true"
@@ -605,63 +803,41 @@ async def setup_clients():
     # keys for each service
     # If you encounter a blocking error during a DefaultAzureCredential resolution, you can exclude the problematic credential by using a parameter (ex. exclude_shared_token_cache_credential=True)
     azure_credential = DefaultAzureCredential(exclude_shared_token_cache_credential=True)
+    phase_start = log_startup_phase("configuration", phase_start)
 
     # Set up clients for AI Search and Storage
+    search_endpoint = f"https://{AZURE_SEARCH_SERVICE}.search.windows.net"
     search_client = SearchClient(
-        endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net",
+        endpoint=search_endpoint,
         index_name=AZURE_SEARCH_INDEX,
         credential=azure_credential,
     )
 
-    search_client_T1 = SearchClient(
-        endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net",
-        index_name=AZURE_SEARCH_INDEX_T1,
-        credential=azure_credential,
-    )
-    search_client_T2 = SearchClient(
-        endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net",
-        index_name=AZURE_SEARCH_INDEX_T2,
-        credential=azure_credential,
-    )
-    search_client_T3 = SearchClient(
-        endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net",
-        index_name=AZURE_SEARCH_INDEX_T3,
-        credential=azure_credential,
-    )
-    search_client_T4 = SearchClient(
-        endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net",
-        index_name=AZURE_SEARCH_INDEX_T4,
-        credential=azure_credential,
-    )
-    search_client_T5 = SearchClient(
-        endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net",
-        index_name=AZURE_SEARCH_INDEX_T5,
-        credential=azure_credential,
-    )
-    search_client_T6 = SearchClient(
-        endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net",
-        index_name=AZURE_SEARCH_INDEX_T6,
-        credential=azure_credential,
-    ) 
-    search_client_T7 = SearchClient(
-        endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net",
-        index_name=AZURE_SEARCH_INDEX_T7,
-        credential=azure_credential,
-    )
-
+    # /content streams files, so don't buffer the SDK default of 32 MiB before the first byte is sent
     blob_container_client = ContainerClient(
-        f"https://{AZURE_STORAGE_ACCOUNT}.blob.core.windows.net", AZURE_STORAGE_CONTAINER, credential=azure_credential
+        f"https://{AZURE_STORAGE_ACCOUNT}.blob.core.windows.net",
+        AZURE_STORAGE_CONTAINER,
+        credential=azure_credential,
+        max_single_get_size=CONTENT_FIRST_CHUNK_SIZE,
     )
 
     # Set up authentication helper
     search_index = None
+    search_index_client: Optional[SearchIndexClient] = None
+    search_index_schemas: Optional[SearchIndexSchemaCache] = None
     if AZURE_USE_AUTHENTICATION:
         search_index_client = SearchIndexClient(
-            endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net",
+            endpoint=search_endpoint,
             credential=azure_credential,
         )
-    #     search_index = await search_index_client.get_index(AZURE_SEARCH_INDEX)
-    #     await search_index_client.close()
+        search_index_schemas = SearchIndexSchemaCache(
+            search_index_client,
+            snapshot_path=AZURE_SEARCH_SCHEMA_CACHE_PATH,
+            ttl=AZURE_SEARCH_SCHEMA_CACHE_TTL,
+        )
+    group_aliases = None
+    if AZURE_USE_AUTHENTICATION and AZURE_AUTH_GROUP_ALIASES_PATH:
+        group_aliases = GroupAliases.from_file(AZURE_AUTH_GROUP_ALIASES_PATH, AZURE_AUTH_GROUP_ALIASES_MIN_GROUPS)
     auth_helper = AuthenticationHelper(
         search_index=search_index,
         use_authentication=AZURE_USE_AUTHENTICATION,
@@ -672,91 +848,22 @@ async def setup_clients():
         require_access_control=AZURE_ENFORCE_ACCESS_CONTROL,
         enable_global_documents=AZURE_ENABLE_GLOBAL_DOCUMENT_ACCESS,
         enable_unauthenticated_access=AZURE_ENABLE_UNAUTHENTICATED_ACCESS,
+        groups_cache_ttl=AZURE_AUTH_GROUPS_CACHE_TTL,
+        group_aliases=group_aliases,
     )
-    auth_helper_T1 = AuthenticationHelper(
-        search_index=(await search_index_client.get_index(AZURE_SEARCH_INDEX_T1)) if AZURE_USE_AUTHENTICATION else None,
-        # search_index= await search_index_client.get_index(AZURE_SEARCH_INDEX_T1),
-        use_authentication=AZURE_USE_AUTHENTICATION,
-        server_app_id=AZURE_SERVER_APP_ID,
-        server_app_secret=AZURE_SERVER_APP_SECRET,
-        client_app_id=AZURE_CLIENT_APP_ID,
-        tenant_id=AZURE_AUTH_TENANT_ID,
-        require_access_control=AZURE_ENFORCE_ACCESS_CONTROL,
-        enable_global_documents=AZURE_ENABLE_GLOBAL_DOCUMENT_ACCESS,
-        enable_unauthenticated_access=AZURE_ENABLE_UNAUTHENTICATED_ACCESS,
-    )
-    auth_helper_T2 = AuthenticationHelper(
-        search_index=(await search_index_client.get_index(AZURE_SEARCH_INDEX_T2)) if AZURE_USE_AUTHENTICATION else None,
-        # search_index= await search_index_client.get_index(AZURE_SEARCH_INDEX_T2),
-        use_authentication=AZURE_USE_AUTHENTICATION,
-        server_app_id=AZURE_SERVER_APP_ID,
-        server_app_secret=AZURE_SERVER_APP_SECRET,
-        client_app_id=AZURE_CLIENT_APP_ID,
-        tenant_id=AZURE_AUTH_TENANT_ID,
-        require_access_control=AZURE_ENFORCE_ACCESS_CONTROL,
-        enable_global_documents=AZURE_ENABLE_GLOBAL_DOCUMENT_ACCESS,
-        enable_unauthenticated_access=AZURE_ENABLE_UNAUTHENTICATED_ACCESS,
-    )
-    auth_helper_T3 = AuthenticationHelper(
-        search_index=(await search_index_client.get_index(AZURE_SEARCH_INDEX_T3)) if AZURE_USE_AUTHENTICATION else None,
-        # search_index= await search_index_client.get_index(AZURE_SEARCH_INDEX_T3),
-        use_authentication=AZURE_USE_AUTHENTICATION,
-        server_app_id=AZURE_SERVER_APP_ID,
-        server_app_secret=AZURE_SERVER_APP_SECRET,
-        client_app_id=AZURE_CLIENT_APP_ID,
-        tenant_id=AZURE_AUTH_TENANT_ID,
-        require_access_control=AZURE_ENFORCE_ACCESS_CONTROL,
-        enable_global_documents=AZURE_ENABLE_GLOBAL_DOCUMENT_ACCESS,
-        enable_unauthenticated_access=AZURE_ENABLE_UNAUTHENTICATED_ACCESS,
-    )
-    auth_helper_T4 = AuthenticationHelper(
-        search_index=(await search_index_client.get_index(AZURE_SEARCH_INDEX_T4)) if AZURE_USE_AUTHENTICATION else None,
-        # search_index= await search_index_client.get_index(AZURE_SEARCH_INDEX_T3),
-        use_authentication=AZURE_USE_AUTHENTICATION,
-        server_app_id=AZURE_SERVER_APP_ID,
-        server_app_secret=AZURE_SERVER_APP_SECRET,
-        client_app_id=AZURE_CLIENT_APP_ID,
-        tenant_id=AZURE_AUTH_TENANT_ID,
-        require_access_control=AZURE_ENFORCE_ACCESS_CONTROL,
-        enable_global_documents=AZURE_ENABLE_GLOBAL_DOCUMENT_ACCESS,
-        enable_unauthenticated_access=AZURE_ENABLE_UNAUTHENTICATED_ACCESS,
-    )
-    auth_helper_T5 = AuthenticationHelper(
-        search_index=(await search_index_client.get_index(AZURE_SEARCH_INDEX_T5)) if AZURE_USE_AUTHENTICATION else None,
-        # search_index= await search_index_client.get_index(AZURE_SEARCH_INDEX_T3),
-        use_authentication=AZURE_USE_AUTHENTICATION,
-        server_app_id=AZURE_SERVER_APP_ID,
-        server_app_secret=AZURE_SERVER_APP_SECRET,
-        client_app_id=AZURE_CLIENT_APP_ID,
-        tenant_id=AZURE_AUTH_TENANT_ID,
-        require_access_control=AZURE_ENFORCE_ACCESS_CONTROL,
-        enable_global_documents=AZURE_ENABLE_GLOBAL_DOCUMENT_ACCESS,
-        enable_unauthenticated_access=AZURE_ENABLE_UNAUTHENTICATED_ACCESS,
-    )
-    auth_helper_T6 = AuthenticationHelper(
-        search_index=(await search_index_client.get_index(AZURE_SEARCH_INDEX_T6)) if AZURE_USE_AUTHENTICATION else None,
-        # search_index= await search_index_client.get_index(AZURE_SEARCH_INDEX_T3),
-        use_authentication=AZURE_USE_AUTHENTICATION,
-        server_app_id=AZURE_SERVER_APP_ID,
-        server_app_secret=AZURE_SERVER_APP_SECRET,
-        client_app_id=AZURE_CLIENT_APP_ID,
-        tenant_id=AZURE_AUTH_TENANT_ID,
-        require_access_control=AZURE_ENFORCE_ACCESS_CONTROL,
-        enable_global_documents=AZURE_ENABLE_GLOBAL_DOCUMENT_ACCESS,
-        enable_unauthenticated_access=AZURE_ENABLE_UNAUTHENTICATED_ACCESS,
-    )
-    auth_helper_T7 = AuthenticationHelper(
-        search_index=(await search_index_client.get_index(AZURE_SEARCH_INDEX_T7)) if AZURE_USE_AUTHENTICATION else None,
-        # search_index= await search_index_client.get_index(AZURE_SEARCH_INDEX_T3),
-        use_authentication=AZURE_USE_AUTHENTICATION,
-        server_app_id=AZURE_SERVER_APP_ID,
-        server_app_secret=AZURE_SERVER_APP_SECRET,
-        client_app_id=AZURE_CLIENT_APP_ID,
-        tenant_id=AZURE_AUTH_TENANT_ID,
-        require_access_control=AZURE_ENFORCE_ACCESS_CONTROL,
-        enable_global_documents=AZURE_ENABLE_GLOBAL_DOCUMENT_ACCESS,
-        enable_unauthenticated_access=AZURE_ENABLE_UNAUTHENTICATED_ACCESS,
-    )
+
+    if USE_CONTENT_SAS_REDIRECT:
+        current_app.logger.info("USE_CONTENT_SAS_REDIRECT is true, redirecting /content to SAS URLs")
+        blob_service_client = BlobServiceClient(
+            f"https://{AZURE_STORAGE_ACCOUNT}.blob.core.windows.net", credential=azure_credential
+        )
+        current_app.config[CONFIG_CONTENT_SAS_URL_GENERATOR] = BlobSasUrlGenerator(
+            blob_service_client, AZURE_STORAGE_CONTAINER, sas_ttl=timedelta(minutes=CONTENT_SAS_EXPIRY_MINUTES)
+        )
+    # Also holds the pages extracted by /content/<path>/page/<n>, so it is set up in SAS redirect mode as well
+    if CONTENT_CACHE_MAX_MB > 0:
+        current_app.config[CONFIG_CONTENT_CACHE] = ContentCache(CONTENT_CACHE_DIR, CONTENT_CACHE_MAX_MB * 1024 * 1024)
+    phase_start = log_startup_phase("search and storage clients", phase_start)
 
     if USE_USER_UPLOAD:
         current_app.logger.info("USE_USER_UPLOAD is true, setting up user upload feature")
@@ -768,6 +875,7 @@ async def setup_clients():
             f"https://{AZURE_USERSTORAGE_ACCOUNT}.dfs.core.windows.net",
             AZURE_USERSTORAGE_CONTAINER,
             credential=azure_credential,
+            max_single_get_size=CONTENT_FIRST_CHUNK_SIZE,
         )
         current_app.config[CONFIG_USER_BLOB_CONTAINER_CLIENT] = user_blob_container_client
 
@@ -779,17 +887,10 @@ async def setup_clients():
             local_html_parser=os.getenv("USE_LOCAL_HTML_PARSER", "").lower() == "true",
             search_images=USE_GPT4V,
         )
-        # search_info = await setup_search_info(
-        #     search_service=AZURE_SEARCH_SERVICE, index_name=AZURE_SEARCH_INDEX, azure_credential=azure_credential
-        # )
-        # search_info = await setup_search_info(
-        #     search_service=AZURE_SEARCH_SERVICE, index_name_list=[AZURE_SEARCH_INDEX_T1, AZURE_SEARCH_INDEX_T2], azure_credential=azure_credential
-        # )
-        # search_info = await setup_search_info(
-        #     search_service=AZURE_SEARCH_SERVICE, index_name_list=[AZURE_SEARCH_INDEX_T1, AZURE_SEARCH_INDEX_T2, AZURE_SEARCH_INDEX_T3], azure_credential=azure_credential
-        # )
         search_info = await setup_search_info(
-            search_service=AZURE_SEARCH_SERVICE, index_name_list=[AZURE_SEARCH_INDEX_T1,AZURE_SEARCH_INDEX_T2,AZURE_SEARCH_INDEX_T3,AZURE_SEARCH_INDEX_T4,AZURE_SEARCH_INDEX_T5,AZURE_SEARCH_INDEX_T6,AZURE_SEARCH_INDEX_T7], azure_credential=azure_credential
+            search_service=AZURE_SEARCH_SERVICE,
+            index_name_list=list(AZURE_SEARCH_TENANT_INDEXES.values()) or [AZURE_SEARCH_INDEX],
+            azure_credential=azure_credential,
         )
         text_embeddings_service = setup_embeddings_service(
             azure_credential=azure_credential,
@@ -806,6 +907,7 @@ async def setup_clients():
             search_info=search_info, embeddings=text_embeddings_service, file_processors=file_processors
         )
         current_app.config[CONFIG_INGESTER] = ingester
+        phase_start = log_startup_phase("user upload ingester", phase_start)
 
     # Used by the OpenAI SDK
     openai_client: AsyncOpenAI
@@ -838,28 +940,84 @@ async def setup_clients():
 
     current_app.config[CONFIG_OPENAI_CLIENT] = openai_client
     current_app.config[CONFIG_SEARCH_CLIENT] = search_client
-    current_app.config[CONFIG_SEARCH_CLIENT_T1] = search_client_T1
-    current_app.config[CONFIG_SEARCH_CLIENT_T2] = search_client_T2
-    current_app.config[CONFIG_SEARCH_CLIENT_T3] = search_client_T3
-    current_app.config[CONFIG_SEARCH_CLIENT_T4] = search_client_T4
-    current_app.config[CONFIG_SEARCH_CLIENT_T5] = search_client_T5  
-    current_app.config[CONFIG_SEARCH_CLIENT_T6] = search_client_T6
-    current_app.config[CONFIG_SEARCH_CLIENT_T7] = search_client_T7
+    current_app.config[CONFIG_SEARCH_INDEX_NAME] = AZURE_SEARCH_INDEX
     current_app.config[CONFIG_BLOB_CONTAINER_CLIENT] = blob_container_client
     current_app.config[CONFIG_AUTH_CLIENT] = auth_helper
-    current_app.config[CONFIG_AUTH_CLIENT_T1] = auth_helper_T1
-    current_app.config[CONFIG_AUTH_CLIENT_T2] = auth_helper_T2
-    current_app.config[CONFIG_AUTH_CLIENT_T3] = auth_helper_T3
-    current_app.config[CONFIG_AUTH_CLIENT_T4] = auth_helper_T4
-    current_app.config[CONFIG_AUTH_CLIENT_T5] = auth_helper_T5
-    current_app.config[CONFIG_AUTH_CLIENT_T6] = auth_helper_T6
-    current_app.config[CONFIG_AUTH_CLIENT_T7] = auth_helper_T7
+    acl_key_field = (
+        await acl_map_key_field(search_index_client, AZURE_SEARCH_INDEX)
+        if search_index_client and AZURE_ENFORCE_ACCESS_CONTROL and AZURE_SEARCH_ACL_REFRESH_SECONDS > 0
+        else None
+    )
+    if acl_key_field:
+        document_acl_map = DocumentAclMap(
+            search_client,
+            key_field=acl_key_field,
+            refresh_interval=AZURE_SEARCH_ACL_REFRESH_SECONDS,
+            snapshot_path=AZURE_SEARCH_ACL_SNAPSHOT_PATH or None,
+        )
+        # Loaded in the background, /content falls back to live queries until it is ready
+        document_acl_map.start_refresh()
+        current_app.config[CONFIG_DOCUMENT_ACL_MAP] = document_acl_map
+    current_app.config[CONFIG_SEARCH_INDEX_CLIENT] = search_index_client
 
     current_app.config[CONFIG_GPT4V_DEPLOYED] = bool(USE_GPT4V)
     current_app.config[CONFIG_SEMANTIC_RANKER_DEPLOYED] = AZURE_SEARCH_SEMANTIC_RANKER != "disabled"
     current_app.config[CONFIG_VECTOR_SEARCH_ENABLED] = os.getenv("USE_VECTORS", "").lower() != "false"
     current_app.config[CONFIG_USER_UPLOAD_ENABLED] = bool(USE_USER_UPLOAD)
 
+    Approach.embedding_cache = EmbeddingCache(
+        max_entries=EMBEDDING_CACHE_MAX_ENTRIES, ttl=EMBEDDING_CACHE_TTL if EMBEDDING_CACHE_TTL > 0 else None
+    )
+    Approach.embedding_batcher = EmbeddingBatcher(
+        max_batch_size=EMBEDDING_BATCH_MAX_SIZE, max_wait=EMBEDDING_BATCH_WAIT_MS / 1000
+    )
+    Approach.page_image_cache = PageImageCache(
+        max_size=int(PAGE_IMAGE_CACHE_MAX_MB * 1024 * 1024),
+        ttl=PAGE_IMAGE_CACHE_TTL if PAGE_IMAGE_CACHE_TTL > 0 else None,
+        resize=PAGE_IMAGE_RESIZE,
+    )
+    if GPT4V_IMAGE_DETAIL not in ("auto", "low", "high"):
+        raise ValueError(f"GPT4V_IMAGE_DETAIL must be 'auto', 'low' or 'high', not '{GPT4V_IMAGE_DETAIL}'")
+    Approach.image_detail = cast(Literal["auto", "low", "high"], GPT4V_IMAGE_DETAIL)
+    Approach.include_thoughts_by_default = INCLUDE_THOUGHTS
+    current_app.config[CONFIG_ANSWER_CACHE] = (
+        AnswerCache(max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL if ANSWER_CACHE_TTL > 0 else None)
+        if ANSWER_CACHE_MAX_ENTRIES > 0
+        else None
+    )
+    current_app.config[CONFIG_SEMANTIC_ANSWER_CACHE] = (
+        SemanticAnswerCache(
+            threshold=SEMANTIC_ANSWER_CACHE_THRESHOLD,
+            max_entries=SEMANTIC_ANSWER_CACHE_MAX_ENTRIES,
+            max_scopes=SEMANTIC_ANSWER_CACHE_MAX_SCOPES,
+            max_rows=SEMANTIC_ANSWER_CACHE_MAX_ROWS,
+            ttl=ANSWER_CACHE_TTL if ANSWER_CACHE_TTL > 0 else None,
+        )
+        if SEMANTIC_ANSWER_CACHE_THRESHOLD > 0
+        else None
+    )
+    current_app.config[CONFIG_REQUEST_COALESCER] = RequestCoalescer() if USE_REQUEST_COALESCING else None
+    Approach.retrieval_cache = RetrievalCache(
+        max_entries=RETRIEVAL_CACHE_MAX_ENTRIES, ttl=RETRIEVAL_CACHE_TTL if RETRIEVAL_CACHE_TTL > 0 else None
+    )
+    answer_caches = [current_app.config[CONFIG_ANSWER_CACHE], current_app.config[CONFIG_SEMANTIC_ANSWER_CACHE]]
+
+    def invalidate_index(index_name: str):
+        Approach.retrieval_cache.invalidate(index_name)
+        for answer_cache in answer_caches:
+            if answer_cache is not None:
+                answer_cache.invalidate(index_name)
+
+    SearchManager.on_content_changed = invalidate_index
+    Approach.thoughts_store = ThoughtsStore(ttl=THOUGHTS_TTL, directory=THOUGHTS_DIR or None)
+    if QUERY_REWRITE_POLICY not in ("always", "history"):
+        raise ValueError(f"QUERY_REWRITE_POLICY must be 'always' or 'history', not '{QUERY_REWRITE_POLICY}'")
+    ChatReadRetrieveReadApproach.query_rewrite_cache = QueryRewriteCache(max_entries=QUERY_REWRITE_CACHE_MAX_ENTRIES)
+    ChatReadRetrieveReadApproach.skip_query_rewrite_without_history = QUERY_REWRITE_POLICY == "history"
+    ChatApproach.speculative_retrieval = USE_SPECULATIVE_RETRIEVAL
+    ChatApproach.speculative_min_similarity = SPECULATIVE_RETRIEVAL_MIN_SIMILARITY
+    ChatApproach.stream_flush_interval = STREAM_FLUSH_INTERVAL_MS / 1000
+
     # Various approaches to integrate GPT and external knowledge, most applications will use a single one of these patterns
     # or some derivative, here we include several for exploration purposes
     current_app.config[CONFIG_ASK_APPROACH] = RetrieveThenReadApproach(
@@ -876,12 +1034,15 @@ async def setup_clients():
         query_language=AZURE_SEARCH_QUERY_LANGUAGE,
         query_speller=AZURE_SEARCH_QUERY_SPELLER,
     )
-    
+
+    vision_token_provider = None
     if USE_GPT4V:
         current_app.logger.info("USE_GPT4V is true, setting up GPT4V approach")
         if not AZURE_OPENAI_GPT4V_MODEL:
             raise ValueError("AZURE_OPENAI_GPT4V_MODEL must be set when USE_GPT4V is true")
-        token_provider = get_bearer_token_provider(azure_credential, "https://cognitiveservices.azure.com/.default")
+        vision_token_provider = get_bearer_token_provider(
+            azure_credential, "https://cognitiveservices.azure.com/.default"
+        )
 
         current_app.config[CONFIG_ASK_VISION_APPROACH] = RetrieveThenReadVisionApproach(
             search_client=search_client,
@@ -889,7 +1050,7 @@ async def setup_clients():
             blob_container_client=blob_container_client,
             auth_helper=auth_helper,
             vision_endpoint=AZURE_VISION_ENDPOINT,
-            vision_token_provider=token_provider,
+            vision_token_provider=vision_token_provider,
             gpt4v_deployment=AZURE_OPENAI_GPT4V_DEPLOYMENT,
             gpt4v_model=AZURE_OPENAI_GPT4V_MODEL,
             embedding_model=OPENAI_EMB_MODEL,
@@ -907,7 +1068,7 @@ async def setup_clients():
             blob_container_client=blob_container_client,
             auth_helper=auth_helper,
             vision_endpoint=AZURE_VISION_ENDPOINT,
-            vision_token_provider=token_provider,
+            vision_token_provider=vision_token_provider,
             gpt4v_deployment=AZURE_OPENAI_GPT4V_DEPLOYMENT,
             gpt4v_model=AZURE_OPENAI_GPT4V_MODEL,
             embedding_model=OPENAI_EMB_MODEL,
@@ -918,407 +1079,126 @@ async def setup_clients():
             query_language=AZURE_SEARCH_QUERY_LANGUAGE,
             query_speller=AZURE_SEARCH_QUERY_SPELLER,
         )
-        
-    # current_app.config[CONFIG_CHAT_APPROACH] = ChatReadRetrieveReadApproach(
-    #     search_client=search_client,
-    #     openai_client=openai_client,
-    #     auth_helper=auth_helper,
-    #     chatgpt_model=OPENAI_CHATGPT_MODEL,
-    #     chatgpt_deployment=AZURE_OPENAI_CHATGPT_DEPLOYMENT,
-    #     embedding_model=OPENAI_EMB_MODEL,
-    #     embedding_deployment=AZURE_OPENAI_EMB_DEPLOYMENT,
-    #     embedding_dimensions=OPENAI_EMB_DIMENSIONS,
-    #     sourcepage_field=KB_FIELDS_SOURCEPAGE,
-    #     content_field=KB_FIELDS_CONTENT,
-    #     query_language=AZURE_SEARCH_QUERY_LANGUAGE,
-    #     query_speller=AZURE_SEARCH_QUERY_SPELLER,
-    # )
-    current_app.config[CONFIG_CHAT_APPROACH_T1] = ChatReadRetrieveReadApproach(
-        search_client=search_client_T1,
-        openai_client=openai_client,
-        auth_helper=auth_helper_T1,
-        chatgpt_model=OPENAI_CHATGPT_MODEL,
-        chatgpt_deployment=AZURE_OPENAI_CHATGPT_DEPLOYMENT,
-        embedding_model=OPENAI_EMB_MODEL,
-        embedding_deployment=AZURE_OPENAI_EMB_DEPLOYMENT,
-        embedding_dimensions=OPENAI_EMB_DIMENSIONS,
-        sourcepage_field=KB_FIELDS_SOURCEPAGE,
-        content_field=KB_FIELDS_CONTENT,
-        query_language=AZURE_SEARCH_QUERY_LANGUAGE,
-        query_speller=AZURE_SEARCH_QUERY_SPELLER,
-    )
-    current_app.config[CONFIG_CHAT_APPROACH_T2] = ChatReadRetrieveReadApproach(
-        search_client=search_client_T2,
-        openai_client=openai_client,
-        auth_helper=auth_helper_T2,
-        chatgpt_model=OPENAI_CHATGPT_MODEL,
-        chatgpt_deployment=AZURE_OPENAI_CHATGPT_DEPLOYMENT,
-        embedding_model=OPENAI_EMB_MODEL,
-        embedding_deployment=AZURE_OPENAI_EMB_DEPLOYMENT,
-        embedding_dimensions=OPENAI_EMB_DIMENSIONS,
-        sourcepage_field=KB_FIELDS_SOURCEPAGE,
-        content_field=KB_FIELDS_CONTENT,
-        query_language=AZURE_SEARCH_QUERY_LANGUAGE,
-        query_speller=AZURE_SEARCH_QUERY_SPELLER,
-    )
-    current_app.config[CONFIG_CHAT_APPROACH_T3] = ChatReadRetrieveReadApproach(
-        search_client=search_client_T3,
-        openai_client=openai_client,
-        auth_helper=auth_helper_T3,
-        chatgpt_model=OPENAI_CHATGPT_MODEL,
-        chatgpt_deployment=AZURE_OPENAI_CHATGPT_DEPLOYMENT,
-        embedding_model=OPENAI_EMB_MODEL,
-        embedding_deployment=AZURE_OPENAI_EMB_DEPLOYMENT,
-        embedding_dimensions=OPENAI_EMB_DIMENSIONS,
-        sourcepage_field=KB_FIELDS_SOURCEPAGE,
-        content_field=KB_FIELDS_CONTENT,
-        query_language=AZURE_SEARCH_QUERY_LANGUAGE,
-        query_speller=AZURE_SEARCH_QUERY_SPELLER,
-    )
-    current_app.config[CONFIG_CHAT_APPROACH_T4] = ChatReadRetrieveReadApproach(
-        search_client=search_client_T4,
-        openai_client=openai_client,
-        auth_helper=auth_helper_T4,
-        chatgpt_model=OPENAI_CHATGPT_MODEL,
-        chatgpt_deployment=AZURE_OPENAI_CHATGPT_DEPLOYMENT,
-        embedding_model=OPENAI_EMB_MODEL,
-        embedding_deployment=AZURE_OPENAI_EMB_DEPLOYMENT,
-        embedding_dimensions=OPENAI_EMB_DIMENSIONS,
-        sourcepage_field=KB_FIELDS_SOURCEPAGE,
-        content_field=KB_FIELDS_CONTENT,
-        query_language=AZURE_SEARCH_QUERY_LANGUAGE,
-        query_speller=AZURE_SEARCH_QUERY_SPELLER,
-    )
-    current_app.config[CONFIG_CHAT_APPROACH_T5] = ChatReadRetrieveReadApproach(
-        search_client=search_client_T5,
-        openai_client=openai_client,
-        auth_helper=auth_helper_T5,
-        chatgpt_model=OPENAI_CHATGPT_MODEL,
-        chatgpt_deployment=AZURE_OPENAI_CHATGPT_DEPLOYMENT,
-        embedding_model=OPENAI_EMB_MODEL,
-        embedding_deployment=AZURE_OPENAI_EMB_DEPLOYMENT,
-        embedding_dimensions=OPENAI_EMB_DIMENSIONS,
-        sourcepage_field=KB_FIELDS_SOURCEPAGE,
-        content_field=KB_FIELDS_CONTENT,
-        query_language=AZURE_SEARCH_QUERY_LANGUAGE,
-        query_speller=AZURE_SEARCH_QUERY_SPELLER,
-    )
-    current_app.config[CONFIG_CHAT_APPROACH_T6] = ChatReadRetrieveReadApproach(
-        search_client=search_client_T6,
-        openai_client=openai_client,
-        auth_helper=auth_helper_T6,
-        chatgpt_model=OPENAI_CHATGPT_MODEL,
-        chatgpt_deployment=AZURE_OPENAI_CHATGPT_DEPLOYMENT,
-        embedding_model=OPENAI_EMB_MODEL,
-        embedding_deployment=AZURE_OPENAI_EMB_DEPLOYMENT,
-        embedding_dimensions=OPENAI_EMB_DIMENSIONS,
-        sourcepage_field=KB_FIELDS_SOURCEPAGE,
-        content_field=KB_FIELDS_CONTENT,
-        query_language=AZURE_SEARCH_QUERY_LANGUAGE,
-        query_speller=AZURE_SEARCH_QUERY_SPELLER,
-    )
-    current_app.config[CONFIG_CHAT_APPROACH_T7] = ChatReadRetrieveReadApproach(
-        search_client=search_client_T7,
-        openai_client=openai_client,
-        auth_helper=auth_helper_T7,
-        chatgpt_model=OPENAI_CHATGPT_MODEL,
-        chatgpt_deployment=AZURE_OPENAI_CHATGPT_DEPLOYMENT,
-        embedding_model=OPENAI_EMB_MODEL,
-        embedding_deployment=AZURE_OPENAI_EMB_DEPLOYMENT,
-        embedding_dimensions=OPENAI_EMB_DIMENSIONS,
-        sourcepage_field=KB_FIELDS_SOURCEPAGE,
-        content_field=KB_FIELDS_CONTENT,
-        query_language=AZURE_SEARCH_QUERY_LANGUAGE,
-        query_speller=AZURE_SEARCH_QUERY_SPELLER,
-    )
 
+    async def build_tenant(tenant_name: str) -> Tenant:
+        # Only the search client and the index-specific auth fields are per tenant,
+        # the OpenAI client, credential and blob container are shared by all tenants
+        index_name = index_name_for_tenant(tenant_name, AZURE_SEARCH_INDEX_PREFIX, AZURE_SEARCH_TENANT_INDEXES)
+        tenant_search_index = None
+        if search_index_schemas:
+            tenant_search_index = await search_index_schemas.get_index(index_name)
+        tenant_search_client = SearchClient(
+            endpoint=search_endpoint,
+            index_name=index_name,
+            credential=azure_credential,
+        )
+        tenant_auth_helper = AuthenticationHelper(
+            search_index=tenant_search_index,
+            use_authentication=AZURE_USE_AUTHENTICATION,
+            server_app_id=AZURE_SERVER_APP_ID,
+            server_app_secret=AZURE_SERVER_APP_SECRET,
+            client_app_id=AZURE_CLIENT_APP_ID,
+            tenant_id=AZURE_AUTH_TENANT_ID,
+            require_access_control=AZURE_ENFORCE_ACCESS_CONTROL,
+            enable_global_documents=AZURE_ENABLE_GLOBAL_DOCUMENT_ACCESS,
+            enable_unauthenticated_access=AZURE_ENABLE_UNAUTHENTICATED_ACCESS,
+            groups_cache_ttl=AZURE_AUTH_GROUPS_CACHE_TTL,
+            group_aliases=group_aliases,
+        )
+        tenant = Tenant(
+            name=tenant_name,
+            index_name=index_name,
+            search_client=tenant_search_client,
+            auth_helper=tenant_auth_helper,
+            chat_approach=ChatReadRetrieveReadApproach(
+                search_client=tenant_search_client,
+                openai_client=openai_client,
+                auth_helper=tenant_auth_helper,
+                chatgpt_model=OPENAI_CHATGPT_MODEL,
+                chatgpt_deployment=AZURE_OPENAI_CHATGPT_DEPLOYMENT,
+                embedding_model=OPENAI_EMB_MODEL,
+                embedding_deployment=AZURE_OPENAI_EMB_DEPLOYMENT,
+                embedding_dimensions=OPENAI_EMB_DIMENSIONS,
+                sourcepage_field=KB_FIELDS_SOURCEPAGE,
+                content_field=KB_FIELDS_CONTENT,
+                query_language=AZURE_SEARCH_QUERY_LANGUAGE,
+                query_speller=AZURE_SEARCH_QUERY_SPELLER,
+            ),
+        )
+        if USE_GPT4V and AZURE_OPENAI_GPT4V_MODEL and vision_token_provider:
+            tenant.chat_vision_approach = ChatReadRetrieveReadVisionApproach(
+                search_client=tenant_search_client,
+                openai_client=openai_client,
+                blob_container_client=blob_container_client,
+                auth_helper=tenant_auth_helper,
+                vision_endpoint=AZURE_VISION_ENDPOINT,
+                vision_token_provider=vision_token_provider,
+                gpt4v_deployment=AZURE_OPENAI_GPT4V_DEPLOYMENT,
+                gpt4v_model=AZURE_OPENAI_GPT4V_MODEL,
+                embedding_model=OPENAI_EMB_MODEL,
+                embedding_deployment=AZURE_OPENAI_EMB_DEPLOYMENT,
+                embedding_dimensions=OPENAI_EMB_DIMENSIONS,
+                sourcepage_field=KB_FIELDS_SOURCEPAGE,
+                content_field=KB_FIELDS_CONTENT,
+                query_language=AZURE_SEARCH_QUERY_LANGUAGE,
+                query_speller=AZURE_SEARCH_QUERY_SPELLER,
+            )
+        return tenant
+
+    current_app.config[CONFIG_TENANT_REGISTRY] = TenantRegistry(build_tenant, max_tenants=AZURE_SEARCH_MAX_TENANTS)
+    phase_start = log_startup_phase("openai client and approaches", phase_start)
+
+    # The configured tenant indexes are requested right away, fetch their schemas concurrently now
+    # rather than one after the other on the first request to each tenant
+    if search_index_schemas and AZURE_SEARCH_TENANT_INDEXES:
+        await search_index_schemas.prefetch(AZURE_SEARCH_TENANT_INDEXES.values())
+        phase_start = log_startup_phase("search index schemas", phase_start)
+
+    log_startup_phase("total", startup_start)
 
 
 @bp.after_app_serving
 async def close_clients():
+    current_app.logger.info(
+        "Embedding cache: %d hits, %d misses", Approach.embedding_cache.hits, Approach.embedding_cache.misses
+    )
+    current_app.logger.info(
+        "Retrieval cache: %d hits, %d misses", Approach.retrieval_cache.hits, Approach.retrieval_cache.misses
+    )
+    answer_cache: Optional[AnswerCache] = current_app.config.get(CONFIG_ANSWER_CACHE)
+    if answer_cache is not None:
+        current_app.logger.info("Answer cache: %d hits, %d misses", answer_cache.hits, answer_cache.misses)
+    semantic_cache: Optional[SemanticAnswerCache] = current_app.config.get(CONFIG_SEMANTIC_ANSWER_CACHE)
+    if semantic_cache is not None:
+        current_app.logger.info(
+            "Semantic answer cache: %d hits, %d misses, %.1f%% hit rate",
+            semantic_cache.hits,
+            semantic_cache.misses,
+            semantic_cache.hit_rate * 100,
+        )
     await current_app.config[CONFIG_SEARCH_CLIENT].close()
     await current_app.config[CONFIG_BLOB_CONTAINER_CLIENT].close()
+    await current_app.config[CONFIG_TENANT_REGISTRY].close()
+    if current_app.config.get(CONFIG_SEARCH_INDEX_CLIENT):
+        await current_app.config[CONFIG_SEARCH_INDEX_CLIENT].close()
+    if current_app.config.get(CONFIG_CONTENT_SAS_URL_GENERATOR):
+        await current_app.config[CONFIG_CONTENT_SAS_URL_GENERATOR].blob_service_client.close()
     if current_app.config.get(CONFIG_USER_BLOB_CONTAINER_CLIENT):
         await current_app.config[CONFIG_USER_BLOB_CONTAINER_CLIENT].close()
-
-
-
-
-
-
-
-
-
-
-
-
-
-# #dynamic approach to setup clients
-# async def setup_clients():
-#     # Replace these with your own values, either in environment variables or directly here
-#     AZURE_STORAGE_ACCOUNT = os.environ["AZURE_STORAGE_ACCOUNT"]
-#     AZURE_STORAGE_CONTAINER = os.environ["AZURE_STORAGE_CONTAINER"]
-#     AZURE_USERSTORAGE_ACCOUNT = os.environ.get("AZURE_USERSTORAGE_ACCOUNT")
-#     AZURE_USERSTORAGE_CONTAINER = os.environ.get("AZURE_USERSTORAGE_CONTAINER")
-#     AZURE_SEARCH_SERVICE = os.environ["AZURE_SEARCH_SERVICE"]
-#     AZURE_SEARCH_INDEX_PREFIX = os.environ["AZURE_SEARCH_INDEX_PREFIX"]
-#   # Shared by all OpenAI deployments
-#     OPENAI_HOST = os.getenv("OPENAI_HOST", "azure")
-#     OPENAI_CHATGPT_MODEL = os.environ["AZURE_OPENAI_CHATGPT_MODEL"]
-#     OPENAI_EMB_MODEL = os.getenv("AZURE_OPENAI_EMB_MODEL_NAME", "text-embedding-ada-002")
-#     OPENAI_EMB_DIMENSIONS = int(os.getenv("AZURE_OPENAI_EMB_DIMENSIONS", 1536))
-#     # Used with Azure OpenAI deployments
-#     AZURE_OPENAI_SERVICE = os.getenv("AZURE_OPENAI_SERVICE")
-#     AZURE_OPENAI_GPT4V_DEPLOYMENT = os.environ.get("AZURE_OPENAI_GPT4V_DEPLOYMENT")
-#     AZURE_OPENAI_GPT4V_MODEL = os.environ.get("AZURE_OPENAI_GPT4V_MODEL")
-#     AZURE_OPENAI_CHATGPT_DEPLOYMENT = (
-#         os.getenv("AZURE_OPENAI_CHATGPT_DEPLOYMENT") if OPENAI_HOST.startswith("azure") else None
-#     )
-#     AZURE_OPENAI_EMB_DEPLOYMENT = os.getenv("AZURE_OPENAI_EMB_DEPLOYMENT") if OPENAI_HOST.startswith("azure") else None
-#     AZURE_OPENAI_CUSTOM_URL = os.getenv("AZURE_OPENAI_CUSTOM_URL")
-#     AZURE_VISION_ENDPOINT = os.getenv("AZURE_VISION_ENDPOINT", "")
-#     # Used only with non-Azure OpenAI deployments
-#     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-#     OPENAI_ORGANIZATION = os.getenv("OPENAI_ORGANIZATION")
-
-#     AZURE_TENANT_ID = os.getenv("AZURE_TENANT_ID")
-#     AZURE_USE_AUTHENTICATION = os.getenv("AZURE_USE_AUTHENTICATION", "").lower() == "true"
-#     AZURE_ENFORCE_ACCESS_CONTROL = os.getenv("AZURE_ENFORCE_ACCESS_CONTROL", "").lower() == "true"
-#     AZURE_ENABLE_GLOBAL_DOCUMENT_ACCESS = os.getenv("AZURE_ENABLE_GLOBAL_DOCUMENT_ACCESS", "").lower() == "true"
-#     AZURE_ENABLE_UNAUTHENTICATED_ACCESS = os.getenv("AZURE_ENABLE_UNAUTHENTICATED_ACCESS", "").lower() == "true"
-#     AZURE_SERVER_APP_ID = os.getenv("AZURE_SERVER_APP_ID")
-#     AZURE_SERVER_APP_SECRET = os.getenv("AZURE_SERVER_APP_SECRET")
-#     AZURE_CLIENT_APP_ID = os.getenv("AZURE_CLIENT_APP_ID")
-#     AZURE_AUTH_TENANT_ID = os.getenv("AZURE_AUTH_TENANT_ID", AZURE_TENANT_ID)
-
-#     KB_FIELDS_CONTENT = os.getenv("KB_FIELDS_CONTENT", "content")
-#     KB_FIELDS_SOURCEPAGE = os.getenv("KB_FIELDS_SOURCEPAGE", "sourcepage")
-
-#     AZURE_SEARCH_QUERY_LANGUAGE = os.getenv("AZURE_SEARCH_QUERY_LANGUAGE", "en-us")
-#     AZURE_SEARCH_QUERY_SPELLER = os.getenv("AZURE_SEARCH_QUERY_SPELLER", "lexicon")
-#     AZURE_SEARCH_SEMANTIC_RANKER = os.getenv("AZURE_SEARCH_SEMANTIC_RANKER", "free").lower()
-
-#     AZURE_SPEECH_SERVICE_ID = os.getenv("AZURE_SPEECH_SERVICE_ID")
-#     AZURE_SPEECH_SERVICE_LOCATION = os.getenv("AZURE_SPEECH_SERVICE_LOCATION")
-#     AZURE_SPEECH_VOICE = os.getenv("AZURE_SPEECH_VOICE", "en-US-AndrewMultilingualNeural")
-
-#     USE_GPT4V = os.getenv("USE_GPT4V", "").lower() == "true"
-#     USE_USER_UPLOAD = os.getenv("USE_USER_UPLOAD", "").lower() == "true"
-#     USE_SPEECH_INPUT_BROWSER = os.getenv("USE_SPEECH_INPUT_BROWSER", "").lower() == "true"
-#     USE_SPEECH_OUTPUT_BROWSER = os.getenv("USE_SPEECH_OUTPUT_BROWSER", "").lower() == "true"
-#     USE_SPEECH_OUTPUT_AZURE = os.getenv("USE_SPEECH_OUTPUT_AZURE", "").lower() == "true"
-#     # Set up the Azure credential
-#     azure_credential = DefaultAzureCredential(exclude_shared_token_cache_credential=True)
-
-#     # Set up the blob container client
-#     blob_container_client = ContainerClient(
-#         f"https://{AZURE_STORAGE_ACCOUNT}.blob.core.windows.net", AZURE_STORAGE_CONTAINER, credential=azure_credential
-#     )
-
-#     # Instantiate the ADLSGen2ListFileStrategy to list folders
-#     adls_list_file_strategy = ADLSGen2ListFileStrategy(
-#         data_lake_storage_account=AZURE_STORAGE_ACCOUNT,
-#         data_lake_filesystem=AZURE_STORAGE_CONTAINER,
-#         data_lake_path="/",  # Root path or specify the path as needed
-#         credential=azure_credential,
-#     )
-
-#     # Retrieve the list of folders
-#     folder_list = await adls_list_file_strategy.list_folders()
-#     num_folders = len(folder_list)
-
-#     # Set up search clients and authentication helpers dynamically
-#     search_clients = {}
-#     auth_helpers = {}
-#     search_index_client = SearchIndexClient(
-#         endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net",
-#         credential=azure_credential,
-#     )
-
-#     for i in range(num_folders):
-#         index_name = f"{AZURE_SEARCH_INDEX_PREFIX}_T{i+1}"
-#         search_clients[f"T{i+1}"] = SearchClient(
-#             endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net",
-#             index_name=index_name,
-#             credential=azure_credential,
-#         )
-#         if AZURE_USE_AUTHENTICATION:
-#             search_index = await search_index_client.get_index(index_name)
-#         else:
-#             search_index = None
-#         auth_helpers[f"T{i+1}"] = AuthenticationHelper(
-#             search_index=search_index,
-#             use_authentication=AZURE_USE_AUTHENTICATION,
-#             server_app_id=AZURE_SERVER_APP_ID,
-#             server_app_secret=AZURE_SERVER_APP_SECRET,
-#             client_app_id=AZURE_CLIENT_APP_ID,
-#             tenant_id=AZURE_AUTH_TENANT_ID,
-#             require_access_control=AZURE_ENFORCE_ACCESS_CONTROL,
-#             enable_global_documents=AZURE_ENABLE_GLOBAL_DOCUMENT_ACCESS,
-#             enable_unauthenticated_access=AZURE_ENABLE_UNAUTHENTICATED_ACCESS,
-#         )
-
-#     # Set up user upload feature if enabled
-#     if USE_USER_UPLOAD:
-#         current_app.logger.info("USE_USER_UPLOAD is true, setting up user upload feature")
-#         AZURE_USERSTORAGE_ACCOUNT = os.environ.get("AZURE_USERSTORAGE_ACCOUNT")
-#         AZURE_USERSTORAGE_CONTAINER = os.environ.get("AZURE_USERSTORAGE_CONTAINER")
-#         if not AZURE_USERSTORAGE_ACCOUNT or not AZURE_USERSTORAGE_CONTAINER:
-#             raise ValueError(
-#                 "AZURE_USERSTORAGE_ACCOUNT and AZURE_USERSTORAGE_CONTAINER must be set when USE_USER_UPLOAD is true"
-#             )
-#         user_blob_container_client = FileSystemClient(
-#             f"https://{AZURE_USERSTORAGE_ACCOUNT}.dfs.core.windows.net",
-#             AZURE_USERSTORAGE_CONTAINER,
-#             credential=azure_credential,
-#         )
-#         current_app.config[CONFIG_USER_BLOB_CONTAINER_CLIENT] = user_blob_container_client
-
-#         # Set up ingester
-#         file_processors = setup_file_processors(
-#             azure_credential=azure_credential,
-#             document_intelligence_service=os.getenv("AZURE_DOCUMENTINTELLIGENCE_SERVICE"),
-#             local_pdf_parser=os.getenv("USE_LOCAL_PDF_PARSER", "").lower() == "true",
-#             local_html_parser=os.getenv("USE_LOCAL_HTML_PARSER", "").lower() == "true",
-#             search_images=USE_GPT4V,
-#         )
-#         index_names = [f"{AZURE_SEARCH_INDEX_PREFIX}_T{i+1}" for i in range(num_folders)]
-#         search_info = await setup_search_info(
-#             search_service=AZURE_SEARCH_SERVICE, index_name_list=index_names, azure_credential=azure_credential
-#         )
-#         text_embeddings_service = setup_embeddings_service(
-#             azure_credential=azure_credential,
-#             openai_host=OPENAI_HOST,
-#             openai_model_name=OPENAI_EMB_MODEL,
-#             openai_service=AZURE_OPENAI_SERVICE,
-#             openai_deployment=AZURE_OPENAI_EMB_DEPLOYMENT,
-#             openai_dimensions=OPENAI_EMB_DIMENSIONS,
-#             openai_key=clean_key_if_exists(os.getenv("OPENAI_API_KEY")),
-#             openai_org=os.getenv("OPENAI_ORGANIZATION"),
-#             disable_vectors=os.getenv("USE_VECTORS", "").lower() == "false",
-#         )
-#         ingester = UploadUserFileStrategy(
-#             search_info=search_info, embeddings=text_embeddings_service, file_processors=file_processors
-#         )
-#         current_app.config[CONFIG_INGESTER] = ingester
-
-#     # Used by the OpenAI SDK
-#     openai_client: AsyncOpenAI
-
-#     if OPENAI_HOST.startswith("azure"):
-#         token_provider = get_bearer_token_provider(azure_credential, "https://cognitiveservices.azure.com/.default")
-
-#         if OPENAI_HOST == "azure_custom":
-#             endpoint = os.environ["AZURE_OPENAI_CUSTOM_URL"]
-#         else:
-#             endpoint = f"https://{AZURE_OPENAI_SERVICE}.openai.azure.com"
-
-#         api_version = os.getenv("AZURE_OPENAI_API_VERSION") or "2024-03-01-preview"
-
-#         openai_client = AsyncAzureOpenAI(
-#             api_version=api_version,
-#             azure_endpoint=endpoint,
-#             azure_ad_token_provider=token_provider,
-#         )
-#     elif OPENAI_HOST == "local":
-#         openai_client = AsyncOpenAI(
-#             base_url=os.environ["OPENAI_BASE_URL"],
-#             api_key="no-key-required",
-#         )
-#     else:
-#         openai_client = AsyncOpenAI(
-#             api_key=OPENAI_API_KEY,
-#             organization=OPENAI_ORGANIZATION,
-#         )
-
-#     # Configurations for dynamic search clients and auth helpers
-#     for i in range(num_folders):
-#         index_suffix = f"T{i+1}"
-#         current_app.config[f"CONFIG_SEARCH_CLIENT_{index_suffix}"] = search_clients[index_suffix]
-#         current_app.config[f"CONFIG_AUTH_CLIENT_{index_suffix}"] = auth_helpers[index_suffix]
-
-#     current_app.config[CONFIG_BLOB_CONTAINER_CLIENT] = blob_container_client
-#     current_app.config[CONFIG_OPENAI_CLIENT] = openai_client
-#     current_app.config[CONFIG_GPT4V_DEPLOYED] = bool(USE_GPT4V)
-#     current_app.config[CONFIG_SEMANTIC_RANKER_DEPLOYED] = AZURE_SEARCH_SEMANTIC_RANKER != "disabled"
-#     current_app.config[CONFIG_VECTOR_SEARCH_ENABLED] = os.getenv("USE_VECTORS", "").lower() != "false"
-#     current_app.config[CONFIG_USER_UPLOAD_ENABLED] = bool(USE_USER_UPLOAD)
-
-#     # Various approaches to integrate GPT and external knowledge, most applications will use a single one of these patterns
-#     # or some derivative, here we include several for exploration purposes
-#     current_app.config[CONFIG_ASK_APPROACH] = RetrieveThenReadApproach(
-#         search_client=search_clients["T1"],
-#         openai_client=openai_client,
-#         auth_helper=auth_helpers["T1"],
-#         chatgpt_model=OPENAI_CHATGPT_MODEL,
-#         chatgpt_deployment=os.getenv("AZURE_OPENAI_CHATGPT_DEPLOYMENT"),
-#         embedding_model=OPENAI_EMB_MODEL,
-#         embedding_deployment=os.getenv("AZURE_OPENAI_EMB_DEPLOYMENT"),
-#         embedding_dimensions=OPENAI_EMB_DIMENSIONS,
-#         sourcepage_field=KB_FIELDS_SOURCEPAGE,
-#         content_field=KB_FIELDS_CONTENT,
-#         query_language=AZURE_SEARCH_QUERY_LANGUAGE,
-#         query_speller=AZURE_SEARCH_QUERY_SPELLER,
-#         semantic_ranker=AZURE_SEARCH_SEMANTIC_RANKER,
-#         use_vectors=os.getenv("USE_VECTORS", "").lower() != "false",
-#     )
-
-#     for i in range(num_folders):
-#         index_suffix = f"T{i+1}"
-#         current_app.config[f"CONFIG_CHAT_APPROACH_{index_suffix}"] = ChatReadRetrieveReadApproach(
-#             search_client=search_clients[index_suffix],
-#             openai_client=openai_client,
-#             auth_helper=auth_helpers[index_suffix],
-#             chatgpt_model=OPENAI_CHATGPT_MODEL,
-#             chatgpt_deployment=os.getenv("AZURE_OPENAI_CHATGPT_DEPLOYMENT"),
-#             embedding_model=OPENAI_EMB_MODEL,
-#             embedding_deployment=os.getenv("AZURE_OPENAI_EMB_DEPLOYMENT"),
-#             embedding_dimensions=OPENAI_EMB_DIMENSIONS,
-#             sourcepage_field=KB_FIELDS_SOURCEPAGE,
-#             content_field=KB_FIELDS_CONTENT,
-#             query_language=AZURE_SEARCH_QUERY_LANGUAGE,
-#             query_speller=AZURE_SEARCH_QUERY_SPELLER,
-#         )
-
-
-
-
-# def create_app():
-#     app = Quart(__name__)
-#     app.register_blueprint(bp)
-
-#     if os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING"):
-#         configure_azure_monitor()
-#         # This tracks HTTP requests made by aiohttp:
-#         AioHttpClientInstrumentor().instrument()
-#         # This tracks HTTP requests made by httpx:
-#         HTTPXClientInstrumentor().instrument()
-#         # This tracks OpenAI SDK requests:
-#         OpenAIInstrumentor().instrument()
-#         # This middleware tracks app route requests:
-#         app.asgi_app = OpenTelemetryMiddleware(app.asgi_app)  # type: ignore[assignment]
-
-#     # Level should be one of https://docs.python.org/3/library/logging.html#logging-levels
-#     default_level = "INFO"  # In development, log more verbosely
-#     if os.getenv("WEBSITE_HOSTNAME"):  # In production, don't log as heavily
-#         default_level = "WARNING"
-#     logging.basicConfig(level=os.getenv("APP_LOG_LEVEL", default_level))
-
-#     if allowed_origin := os.getenv("ALLOWED_ORIGIN"):
-#         app.logger.info("CORS enabled for %s", allowed_origin)
-#         cors(app, allow_origin=allowed_origin, allow_methods=["GET", "POST"])
-    # return app
+    await GroupMembershipCache.close_all()
+    if current_app.config.get(CONFIG_DOCUMENT_ACL_MAP):
+        await current_app.config[CONFIG_DOCUMENT_ACL_MAP].close()
 
 
 def create_app():
     app = Quart(__name__)
+    app.json = OrjsonProvider(app)
     app.register_blueprint(bp)
 
     data_lake_storage_account = os.getenv('AZURE_ADLS_GEN2_STORAGE_ACCOUNT')
     data_lake_filesystem = os.getenv('AZURE_ADLS_GEN2_FILESYSTEM')
     data_lake_path = os.getenv('AZURE_ADLS_GEN2_FILESYSTEM_PATH')
 
-   #changes
     credential = DefaultAzureCredential()  # Adjust based on your setup
 
     list_file_strategy = ADLSGen2ListFileStrategy(
@@ -1327,12 +1207,8 @@ def create_app():
         data_lake_path=data_lake_path,
         credential=credential
     )
-#pppp
     app.config['LIST_FILE_STRATEGY'] = list_file_strategy
 
-    # Rest of your setup code
-
-
     if os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING"):
         configure_azure_monitor()
         # This tracks HTTP requests made by aiohttp:
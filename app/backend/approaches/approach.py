@@ -1,3 +1,4 @@
+import asyncio
 import os
 from abc import ABC
 from dataclasses import dataclass
@@ -7,8 +8,8 @@ from typing import (
     Awaitable,
     Callable,
     List,
+    Literal,
     Optional,
-    TypedDict,
     Union,
     cast,
 )
@@ -26,8 +27,17 @@ from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletionMessageParam
 
 from core.authentication import AuthenticationHelper
+from core.embeddingbatcher import EmbeddingBatcher
+from core.embeddingcache import EmbeddingCache, normalize_query_text
+from core.pageimagecache import PageImageCache
+from core.retrievalcache import RetrievalCache
+from core.thoughtsstore import ThoughtsStore
 from text import nonewlines
 
+# Fields fetched for each hit. The vectors dwarf the rest of a document, so they're only fetched on request
+SEARCH_SELECT_FIELDS = ["id", "content", "category", "sourcepage", "sourcefile"]
+SEARCH_ACL_FIELDS = ["oids", "groups"]
+
 
 @dataclass
 class Document:
@@ -92,6 +102,17 @@ class ThoughtStep:
 
 
 class Approach(ABC):
+    # Shared by the approaches of all tenants, they embed queries with the same models
+    embedding_cache = EmbeddingCache()
+    embedding_batcher = EmbeddingBatcher()
+    page_image_cache = PageImageCache()
+    retrieval_cache = RetrievalCache()
+    # Thoughts are only sent to clients that ask for them with the include_thoughts override unless this is on
+    include_thoughts_by_default = False
+    thoughts_store = ThoughtsStore()
+    # Detail level of the page images sent to GPT-4V, requests can pick another with the gpt4v_image_detail override
+    image_detail: Literal["auto", "low", "high"] = "auto"
+
     def __init__(
         self,
         search_client: SearchClient,
@@ -138,7 +159,31 @@ class Approach(ABC):
         use_semantic_captions: bool,
         minimum_search_score: Optional[float],
         minimum_reranker_score: Optional[float],
+        include_vectors: bool = False,
     ) -> List[Document]:
+        select = self.search_select_fields(vectors if include_vectors else [])
+        # The SDK has no public accessor for the index of a client
+        index_name = getattr(self.search_client, "_index_name", "")
+        cache_key = RetrievalCache.key(
+            index_name,
+            query_text,
+            filter,
+            vectors,
+            [
+                top,
+                bool(use_semantic_ranker and query_text),
+                use_semantic_captions,
+                minimum_search_score,
+                minimum_reranker_score,
+                select,
+                self.query_language,
+                self.query_speller,
+            ],
+        )
+        cached = Approach.retrieval_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         # Use semantic ranker if requested and if retrieval mode is text or hybrid (vectors + text)
         if use_semantic_ranker and query_text:
             results = await self.search_client.search(
@@ -151,10 +196,11 @@ class Approach(ABC):
                 top=top,
                 query_caption="extractive|highlight-false" if use_semantic_captions else None,
                 vector_queries=vectors,
+                select=select,
             )
         else:
             results = await self.search_client.search(
-                search_text=query_text or "", filter=filter, top=top, vector_queries=vectors
+                search_text=query_text or "", filter=filter, top=top, vector_queries=vectors, select=select
             )
 
         documents = []
@@ -186,8 +232,21 @@ class Approach(ABC):
                 )
             ]
 
+        Approach.retrieval_cache.put(cache_key, index_name, qualified_documents)
         return qualified_documents
 
+    def search_select_fields(self, vectors: List[VectorQuery]) -> List[str]:
+        """Returns the fields to fetch, with the vector fields searched by the given queries, which the index must have."""
+        select = list(SEARCH_SELECT_FIELDS)
+        # Only indexes used with authentication are known to have the ACL fields
+        if self.auth_helper and self.auth_helper.has_auth_fields:
+            select.extend(SEARCH_ACL_FIELDS)
+        for vector in vectors:
+            for field in (vector.fields or "").split(","):
+                if field and field not in select:
+                    select.append(field)
+        return select
+
     def get_sources_content(
         self, results: List[Document], use_semantic_captions: bool, use_image_citation: bool
     ) -> list[str]:
@@ -204,6 +263,31 @@ class Approach(ABC):
                 for doc in results
             ]
 
+    def add_thoughts(
+        self,
+        extra_info: dict[str, Any],
+        build_thoughts: Callable[[], list[ThoughtStep]],
+        overrides: dict[str, Any],
+        auth_claims: dict[str, Any],
+    ) -> dict[str, Any]:
+        """
+        Adds the thoughts to the context of a response, or the id to fetch them by later when they weren't asked for.
+        They repeat the prompts and the search results, which makes them the bulk of the response.
+        """
+        if overrides.get("include_thoughts", self.include_thoughts_by_default):
+            extra_info["thoughts"] = build_thoughts()
+        else:
+            thoughts_id = self.thoughts_store.put(build_thoughts, auth_claims.get("oid"))
+            if thoughts_id:
+                extra_info["thoughts_id"] = thoughts_id
+        return extra_info
+
+    def get_image_detail(self, overrides: dict[str, Any]) -> Literal["auto", "low", "high"]:
+        detail = overrides.get("gpt4v_image_detail")
+        if detail in ("auto", "low", "high"):
+            return detail
+        return self.image_detail
+
     def get_citation(self, sourcepage: str, use_image_citation: bool) -> str:
         if use_image_citation:
             return sourcepage
@@ -222,23 +306,21 @@ class Approach(ABC):
             "text-embedding-3-small": True,
             "text-embedding-3-large": True,
         }
-
-        class ExtraArgs(TypedDict, total=False):
-            dimensions: int
-
-        dimensions_args: ExtraArgs = (
-            {"dimensions": self.embedding_dimensions} if SUPPORTED_DIMENSIONS_MODEL[self.embedding_model] else {}
-        )
-        embedding = await self.openai_client.embeddings.create(
-            # Azure OpenAI takes the deployment name as the model name
-            model=self.embedding_deployment if self.embedding_deployment else self.embedding_model,
-            input=q,
-            **dimensions_args,
-        )
-        query_vector = embedding.data[0].embedding
+        dimensions = self.embedding_dimensions if SUPPORTED_DIMENSIONS_MODEL[self.embedding_model] else None
+        # Azure OpenAI takes the deployment name as the model name
+        model = self.embedding_deployment if self.embedding_deployment else self.embedding_model
+        cache_key = ("text", model, dimensions, normalize_query_text(q))
+        query_vector = Approach.embedding_cache.get(cache_key)
+        if query_vector is None:
+            query_vector = await Approach.embedding_batcher.embed(self.openai_client, model, dimensions, q)
+            Approach.embedding_cache.put(cache_key, query_vector)
         return VectorizedQuery(vector=query_vector, k_nearest_neighbors=50, fields="embedding")
 
     async def compute_image_embedding(self, q: str):
+        cache_key = ("image", self.vision_endpoint, normalize_query_text(q))
+        image_query_vector = Approach.embedding_cache.get(cache_key)
+        if image_query_vector is not None:
+            return VectorizedQuery(vector=image_query_vector, k_nearest_neighbors=50, fields="imageEmbedding")
         endpoint = urljoin(self.vision_endpoint, "computervision/retrieval:vectorizeText")
         headers = {"Content-Type": "application/json"}
         params = {"api-version": "2023-02-01-preview", "modelVersion": "latest"}
@@ -252,8 +334,20 @@ class Approach(ABC):
             ) as response:
                 json = await response.json()
                 image_query_vector = json["vector"]
+        Approach.embedding_cache.put(cache_key, image_query_vector)
         return VectorizedQuery(vector=image_query_vector, k_nearest_neighbors=50, fields="imageEmbedding")
 
+    async def compute_vectors(self, q: str, vector_fields: List[str]) -> List[VectorQuery]:
+        """Computes the query vectors for the given fields, the text and image embeddings concurrently."""
+        return list(
+            await asyncio.gather(
+                *[
+                    self.compute_text_embedding(q) if field == "embedding" else self.compute_image_embedding(q)
+                    for field in vector_fields
+                ]
+            )
+        )
+
     async def run(
         self,
         messages: list[ChatCompletionMessageParam],
@@ -1,11 +1,21 @@
+import asyncio
 import json
+import logging
+import math
 import re
 from abc import ABC, abstractmethod
-from typing import Any, AsyncGenerator, Optional, Union
+from typing import Any, AsyncGenerator, Awaitable, Callable, Optional, Union
 
-from openai.types.chat import ChatCompletion, ChatCompletionMessageParam
+from azure.search.documents.models import VectorizedQuery, VectorQuery
+from openai import AsyncStream
+from openai.types.chat import (
+    ChatCompletion,
+    ChatCompletionChunk,
+    ChatCompletionMessageParam,
+)
 
-from approaches.approach import Approach
+from approaches.approach import Approach, Document
+from core.embeddingcache import normalize_query_text
 
 
 class ChatApproach(Approach, ABC):
@@ -16,6 +26,11 @@ class ChatApproach(Approach, ABC):
         {"role": "assistant", "content": "Show available health plans"},
     ]
     NO_RESPONSE = "0"
+    # Start retrieving with the question as asked while the search query is generated, see retrieve_speculatively
+    speculative_retrieval = False
+    speculative_min_similarity = 0.95
+    # Merge the content deltas streamed within this many seconds into one event, 0 streams every delta as it comes
+    stream_flush_interval = 0.0
 
     follow_up_questions_prompt_content = """Generate 3 very brief follow-up questions that the user would likely ask next.
     Enclose the follow-up questions in double angle brackets. Example:
@@ -57,6 +72,56 @@ class ChatApproach(Approach, ABC):
         else:
             return override_prompt.format(follow_up_questions_prompt=follow_up_questions_prompt)
 
+    async def retrieve_speculatively(
+        self,
+        generate_search_query: Awaitable[str],
+        original_user_query: str,
+        embed: Callable[[str], Awaitable[list[VectorQuery]]],
+        search: Callable[[str, list[VectorQuery]], Awaitable[list[Document]]],
+    ) -> tuple[str, list[Document], bool]:
+        """
+        Embeds and searches with the question as asked while the search query is being generated.
+        The speculative results are kept if the generated query turns out to be the same once normalized,
+        or close enough to the question, by cosine similarity of their first vectors.
+        Returns the query the documents were retrieved with, the documents, and whether they came from the speculation.
+        """
+
+        async def search_speculatively() -> list[Document]:
+            return await search(original_user_query, await speculative_vectors)
+
+        async def speculation_result(task: asyncio.Task) -> Any:
+            # A failed speculation only means searching with the generated query after all
+            try:
+                return await task
+            except Exception as error:
+                logging.warning("Speculative retrieval failed: %s", error)
+                return None
+
+        speculative_vectors = asyncio.create_task(embed(original_user_query))
+        speculative_results = asyncio.create_task(search_speculatively())
+        for task in (speculative_vectors, speculative_results):
+            # Marks the errors of a discarded speculation as handled
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        try:
+            query_text = await generate_search_query
+            if normalize_query_text(query_text).lower() == normalize_query_text(original_user_query).lower():
+                results = await speculation_result(speculative_results)
+                if results is not None:
+                    return original_user_query, results, True
+            vectors = await embed(query_text)
+            if vectors and self.speculative_min_similarity < 1:
+                original_vectors = await speculation_result(speculative_vectors)
+                similarity = cosine_similarity(vectors[0], original_vectors[0]) if original_vectors else None
+                if similarity is not None and similarity >= self.speculative_min_similarity:
+                    results = await speculation_result(speculative_results)
+                    if results is not None:
+                        return original_user_query, results, True
+        finally:
+            # Cancels the speculation when it isn't used, or when generating the query failed
+            for task in (speculative_vectors, speculative_results):
+                task.cancel()
+        return query_text, await search(query_text, vectors), False
+
     def get_search_query(self, chat_completion: ChatCompletion, user_query: str):
         response_message = chat_completion.choices[0].message
 
@@ -121,26 +186,37 @@ class ChatApproach(Approach, ABC):
             "object": "chat.completion.chunk",
         }
 
+        events = self.stream_answer(await chat_coroutine, overrides.get("suggest_followup_questions", False))
+        if self.stream_flush_interval > 0:
+            events = coalesce_deltas(events, self.stream_flush_interval)
+        async for event in events:
+            yield event
+
+    async def stream_answer(
+        self, chat_completion: AsyncStream[ChatCompletionChunk], suggest_followup_questions: bool
+    ) -> AsyncGenerator[dict, None]:
         followup_questions_started = False
         followup_content = ""
-        async for event_chunk in await chat_coroutine:
+        async for event_chunk in chat_completion:
             # "2023-07-01-preview" API version has a bug where first response has empty choices
-            event = event_chunk.model_dump()  # Convert pydantic model to dict
-            if event["choices"]:
+            if event_chunk.choices:
+                # Only forward what clients read, dumping the whole pydantic chunk costs more than the rest of the stream
+                choice = event_chunk.choices[0]
                 # if event contains << and not >>, it is start of follow-up question, truncate
-                content = event["choices"][0]["delta"].get("content")
-                content = content or ""  # content may either not exist in delta, or explicitly be None
-                if overrides.get("suggest_followup_questions") and "<<" in content:
+                content = choice.delta.content or ""  # content may either not exist in delta, or explicitly be None
+                if suggest_followup_questions and "<<" in content:
                     followup_questions_started = True
                     earlier_content = content[: content.index("<<")]
                     if earlier_content:
-                        event["choices"][0]["delta"]["content"] = earlier_content
-                        yield event
+                        yield delta_event(earlier_content, choice.finish_reason)
                     followup_content += content[content.index("<<") :]
                 elif followup_questions_started:
                     followup_content += content
+                    if choice.finish_reason:
+                        # The follow-up questions are sent on their own, the end of the answer still has to be
+                        yield delta_event(None, choice.finish_reason)
                 else:
-                    yield event
+                    yield delta_event(choice.delta.content, choice.finish_reason)
         if followup_content:
             _, followup_questions = self.extract_followup_questions(followup_content)
             yield {
@@ -169,3 +245,65 @@ class ChatApproach(Approach, ABC):
             return await self.run_without_streaming(messages, overrides, auth_claims, session_state)
         else:
             return self.run_with_streaming(messages, overrides, auth_claims, session_state)
+
+
+def delta_event(content: Optional[str], finish_reason: Optional[str]) -> dict[str, Any]:
+    return {
+        "choices": [{"delta": {"content": content}, "finish_reason": finish_reason, "index": 0}],
+        "object": "chat.completion.chunk",
+    }
+
+
+async def coalesce_deltas(events: AsyncGenerator[dict, None], flush_interval: float) -> AsyncGenerator[dict, None]:
+    """
+    Merges consecutive content deltas into one event, flushed flush_interval seconds after its first delta.
+    Any other event flushes the pending content first, so events keep their order.
+    """
+    loop = asyncio.get_running_loop()
+    pending: Optional[dict] = None
+    flush_at = 0.0
+    next_event: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if next_event is None:
+                next_event = asyncio.ensure_future(events.__anext__())
+            if pending is not None:
+                done, _ = await asyncio.wait({next_event}, timeout=max(0.0, flush_at - loop.time()))
+                if not done:
+                    yield pending
+                    pending = None
+                    continue
+            try:
+                event = await next_event
+            except StopAsyncIteration:
+                break
+            finally:
+                next_event = None
+            choice = event["choices"][0] if event.get("choices") else {}
+            content = choice.get("delta", {}).get("content")
+            if content and choice.keys() <= {"delta", "finish_reason", "index"} and choice["finish_reason"] is None:
+                if pending is None:
+                    pending = delta_event(content, None)
+                    flush_at = loop.time() + flush_interval
+                else:
+                    pending["choices"][0]["delta"]["content"] += content
+                continue
+            if pending is not None:
+                yield pending
+                pending = None
+            yield event
+        if pending is not None:
+            yield pending
+    finally:
+        if next_event is not None:
+            next_event.cancel()
+
+
+def cosine_similarity(first: VectorQuery, second: VectorQuery) -> Optional[float]:
+    if not isinstance(first, VectorizedQuery) or not isinstance(second, VectorizedQuery):
+        return None
+    if first.fields != second.fields or not first.vector or not second.vector:
+        return None
+    dot = sum(a * b for a, b in zip(first.vector, second.vector))
+    norms = math.sqrt(sum(a * a for a in first.vector)) * math.sqrt(sum(b * b for b in second.vector))
+    return dot / norms if norms else None
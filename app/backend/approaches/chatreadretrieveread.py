@@ -11,9 +11,10 @@ from openai.types.chat import (
 )
 from openai_messages_token_helper import build_messages, get_token_limit
 
-from approaches.approach import ThoughtStep
+from approaches.approach import Document, ThoughtStep
 from approaches.chatapproach import ChatApproach
 from core.authentication import AuthenticationHelper
+from core.querycache import QueryRewriteCache
 
 
 class ChatReadRetrieveReadApproach(ChatApproach):
@@ -23,6 +24,11 @@ class ChatReadRetrieveReadApproach(ChatApproach):
     original user question, and search results to OpenAI to generate a response.
     """
 
+    # Shared by the approaches of all tenants, the search query doesn't depend on the index
+    query_rewrite_cache = QueryRewriteCache()
+    # Search with the question as asked when there is no history to resolve it against
+    skip_query_rewrite_without_history = False
+
     def __init__(
         self,
         *,
@@ -125,50 +131,75 @@ class ChatReadRetrieveReadApproach(ChatApproach):
 
         # STEP 1: Generate an optimized keyword search query based on the chat history and the last question
         query_response_token_limit = 100
-        query_messages = build_messages(
-            model=self.chatgpt_model,
-            system_prompt=self.query_prompt_template,
-            tools=tools,
-            few_shots=self.query_prompt_few_shots,
-            past_messages=messages[:-1],
-            new_user_content=user_query_request,
-            max_tokens=self.chatgpt_token_limit - query_response_token_limit,
+        query_messages: list[ChatCompletionMessageParam] = []
+        query_props: dict[str, Any] = (
+            {"model": self.chatgpt_model, "deployment": self.chatgpt_deployment}
+            if self.chatgpt_deployment
+            else {"model": self.chatgpt_model}
         )
-
-        chat_completion: ChatCompletion = await self.openai_client.chat.completions.create(
-            messages=query_messages,  # type: ignore
-            # Azure OpenAI takes the deployment name as the model name
-            model=self.chatgpt_deployment if self.chatgpt_deployment else self.chatgpt_model,
-            temperature=0.0,  # Minimize creativity for search query generation
-            max_tokens=query_response_token_limit,  # Setting too low risks malformed JSON, setting too high may affect performance
-            n=1,
-            tools=tools,
+        query_cache_key = QueryRewriteCache.key(
+            self.chatgpt_deployment or self.chatgpt_model, messages[:-1], original_user_query
         )
 
-        query_text = self.get_search_query(chat_completion, original_user_query)
+        async def generate_search_query() -> str:
+            nonlocal query_messages
+            query_messages = build_messages(
+                model=self.chatgpt_model,
+                system_prompt=self.query_prompt_template,
+                tools=tools,
+                few_shots=self.query_prompt_few_shots,
+                past_messages=messages[:-1],
+                new_user_content=user_query_request,
+                max_tokens=self.chatgpt_token_limit - query_response_token_limit,
+            )
+
+            chat_completion: ChatCompletion = await self.openai_client.chat.completions.create(
+                messages=query_messages,  # type: ignore
+                # Azure OpenAI takes the deployment name as the model name
+                model=self.chatgpt_deployment if self.chatgpt_deployment else self.chatgpt_model,
+                temperature=0.0,  # Minimize creativity for search query generation
+                max_tokens=query_response_token_limit,  # Setting too low risks malformed JSON, setting too high may affect performance
+                n=1,
+                tools=tools,
+            )
+
+            query_text = self.get_search_query(chat_completion, original_user_query)
+            self.query_rewrite_cache.put(query_cache_key, query_text)
+            return query_text
 
         # STEP 2: Retrieve relevant documents from the search index with the GPT optimized query
+        async def embed(query_text: str) -> list[VectorQuery]:
+            # If retrieval mode includes vectors, compute an embedding for the query
+            return [await self.compute_text_embedding(query_text)] if has_vector else []
 
-        # If retrieval mode includes vectors, compute an embedding for the query
-        vectors: list[VectorQuery] = []
-        if has_vector:
-            vectors.append(await self.compute_text_embedding(query_text))
-
-        # Only keep the text query if the retrieval mode uses text, otherwise drop it
-        if not has_text:
-            query_text = None
-
-        results = await self.search(
-            top,
-            query_text,
-            filter,
-            vectors,
-            use_semantic_ranker,
-            use_semantic_captions,
-            minimum_search_score,
-            minimum_reranker_score,
-        )
+        async def search(query_text: str, vectors: list[VectorQuery]) -> list[Document]:
+            return await self.search(
+                top,
+                # Only keep the text query if the retrieval mode uses text, otherwise drop it
+                query_text if has_text else None,
+                filter,
+                vectors,
+                use_semantic_ranker,
+                use_semantic_captions,
+                minimum_search_score,
+                minimum_reranker_score,
+            )
 
+        speculative = False
+        if len(messages) == 1 and self.skip_query_rewrite_without_history:
+            query_text = original_user_query
+            query_props["query_rewrite"] = "skipped"
+        elif (cached_query_text := self.query_rewrite_cache.get(query_cache_key)) is not None:
+            query_text = cached_query_text
+            query_props["query_rewrite"] = "cached"
+        elif self.speculative_retrieval:
+            query_text, results, speculative = await self.retrieve_speculatively(
+                generate_search_query(), original_user_query, embed, search
+            )
+        else:
+            query_text = await generate_search_query()
+        if not speculative:
+            results = await search(query_text, await embed(query_text))
         sources_content = self.get_sources_content(results, use_semantic_captions, use_image_citation=False)
         content = "\n".join(sources_content)
 
@@ -192,27 +223,24 @@ class ChatReadRetrieveReadApproach(ChatApproach):
 
         data_points = {"text": sources_content}
 
-        extra_info = {
-            "data_points": data_points,
-            "thoughts": [
+        extra_info = self.add_thoughts(
+            {"data_points": data_points},
+            lambda: [
                 ThoughtStep(
                     "Prompt to generate search query",
                     [str(message) for message in query_messages],
-                    (
-                        {"model": self.chatgpt_model, "deployment": self.chatgpt_deployment}
-                        if self.chatgpt_deployment
-                        else {"model": self.chatgpt_model}
-                    ),
+                    query_props,
                 ),
                 ThoughtStep(
                     "Search using generated search query",
-                    query_text,
+                    query_text if has_text else None,
                     {
                         "use_semantic_captions": use_semantic_captions,
                         "use_semantic_ranker": use_semantic_ranker,
                         "top": top,
                         "filter": filter,
                         "has_vector": has_vector,
+                        **({"speculative": True} if speculative else {}),
                     },
                 ),
                 ThoughtStep(
@@ -229,7 +257,9 @@ class ChatReadRetrieveReadApproach(ChatApproach):
                     ),
                 ),
             ],
-        }
+            overrides,
+            auth_claims,
+        )
 
         chat_coroutine = self.openai_client.chat.completions.create(
             # Azure OpenAI takes the deployment name as the model name
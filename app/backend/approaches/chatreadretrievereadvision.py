@@ -1,6 +1,7 @@
 from typing import Any, Awaitable, Callable, Coroutine, Optional, Union
 
 from azure.search.documents.aio import SearchClient
+from azure.search.documents.models import VectorQuery
 from azure.storage.blob.aio import ContainerClient
 from openai import AsyncOpenAI, AsyncStream
 from openai.types.chat import (
@@ -12,10 +13,10 @@ from openai.types.chat import (
 )
 from openai_messages_token_helper import build_messages, get_token_limit
 
-from approaches.approach import ThoughtStep
+from approaches.approach import Document, ThoughtStep
 from approaches.chatapproach import ChatApproach
 from core.authentication import AuthenticationHelper
-from core.imageshelper import fetch_image
+from core.imageshelper import fetch_images
 
 
 class ChatReadRetrieveReadVisionApproach(ChatApproach):
@@ -116,43 +117,42 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
             max_tokens=self.chatgpt_token_limit - query_response_token_limit,
         )
 
-        chat_completion: ChatCompletion = await self.openai_client.chat.completions.create(
-            model=self.gpt4v_deployment if self.gpt4v_deployment else self.gpt4v_model,
-            messages=query_messages,
-            temperature=0.0,  # Minimize creativity for search query generation
-            max_tokens=query_response_token_limit,
-            n=1,
-        )
-
-        query_text = self.get_search_query(chat_completion, original_user_query)
+        async def generate_search_query() -> str:
+            chat_completion: ChatCompletion = await self.openai_client.chat.completions.create(
+                model=self.gpt4v_deployment if self.gpt4v_deployment else self.gpt4v_model,
+                messages=query_messages,
+                temperature=0.0,  # Minimize creativity for search query generation
+                max_tokens=query_response_token_limit,
+                n=1,
+            )
+            return self.get_search_query(chat_completion, original_user_query)
 
         # STEP 2: Retrieve relevant documents from the search index with the GPT optimized query
-
-        # If retrieval mode includes vectors, compute an embedding for the query
-        vectors = []
-        if has_vector:
-            for field in vector_fields:
-                vector = (
-                    await self.compute_text_embedding(query_text)
-                    if field == "embedding"
-                    else await self.compute_image_embedding(query_text)
-                )
-                vectors.append(vector)
-
-        # Only keep the text query if the retrieval mode uses text, otherwise drop it
-        if not has_text:
-            query_text = None
-
-        results = await self.search(
-            top,
-            query_text,
-            filter,
-            vectors,
-            use_semantic_ranker,
-            use_semantic_captions,
-            minimum_search_score,
-            minimum_reranker_score,
-        )
+        async def embed(query_text: str) -> list[VectorQuery]:
+            # If retrieval mode includes vectors, compute an embedding for the query
+            return await self.compute_vectors(query_text, vector_fields) if has_vector else []
+
+        async def search(query_text: str, vectors: list[VectorQuery]) -> list[Document]:
+            return await self.search(
+                top,
+                # Only keep the text query if the retrieval mode uses text, otherwise drop it
+                query_text if has_text else None,
+                filter,
+                vectors,
+                use_semantic_ranker,
+                use_semantic_captions,
+                minimum_search_score,
+                minimum_reranker_score,
+            )
+
+        speculative = False
+        if self.speculative_retrieval:
+            query_text, results, speculative = await self.retrieve_speculatively(
+                generate_search_query(), original_user_query, embed, search
+            )
+        else:
+            query_text = await generate_search_query()
+            results = await search(query_text, await embed(query_text))
         sources_content = self.get_sources_content(results, use_semantic_captions, use_image_citation=True)
         content = "\n".join(sources_content)
 
@@ -170,10 +170,10 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
         if include_gtpV_text:
             user_content.append({"text": "\n\nSources:\n" + content, "type": "text"})
         if include_gtpV_images:
-            for result in results:
-                url = await fetch_image(self.blob_container_client, result)
-                if url:
-                    image_list.append({"image_url": url, "type": "image_url"})
+            for url in await fetch_images(
+                self.blob_container_client, results, self.page_image_cache, detail=self.get_image_detail(overrides)
+            ):
+                image_list.append({"image_url": url, "type": "image_url"})
             user_content.extend(image_list)
 
         response_token_limit = 1024
@@ -190,9 +190,9 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
             "images": [d["image_url"] for d in image_list],
         }
 
-        extra_info = {
-            "data_points": data_points,
-            "thoughts": [
+        extra_info = self.add_thoughts(
+            {"data_points": data_points},
+            lambda: [
                 ThoughtStep(
                     "Prompt to generate search query",
                     [str(message) for message in query_messages],
@@ -204,13 +204,14 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
                 ),
                 ThoughtStep(
                     "Search using generated search query",
-                    query_text,
+                    query_text if has_text else None,
                     {
                         "use_semantic_captions": use_semantic_captions,
                         "use_semantic_ranker": use_semantic_ranker,
                         "top": top,
                         "filter": filter,
                         "vector_fields": vector_fields,
+                        **({"speculative": True} if speculative else {}),
                     },
                 ),
                 ThoughtStep(
@@ -227,7 +228,9 @@ class ChatReadRetrieveReadVisionApproach(ChatApproach):
                     ),
                 ),
             ],
-        }
+            overrides,
+            auth_claims,
+        )
 
         chat_coroutine = self.openai_client.chat.completions.create(
             model=self.gpt4v_deployment if self.gpt4v_deployment else self.gpt4v_model,
@@ -137,9 +137,9 @@ info4.pdf: In-network institutions include Overlake, Swedish and others in the r
         ).model_dump()
 
         data_points = {"text": sources_content}
-        extra_info = {
-            "data_points": data_points,
-            "thoughts": [
+        extra_info = self.add_thoughts(
+            {"data_points": data_points},
+            lambda: [
                 ThoughtStep(
                     "Search using user query",
                     query_text,
@@ -165,7 +165,9 @@ info4.pdf: In-network institutions include Overlake, Swedish and others in the r
                     ),
                 ),
             ],
-        }
+            overrides,
+            auth_claims,
+        )
 
         chat_completion["choices"][0]["context"] = extra_info
         chat_completion["choices"][0]["session_state"] = session_state
@@ -12,7 +12,7 @@ from openai_messages_token_helper import build_messages, get_token_limit
 
 from approaches.approach import Approach, ThoughtStep
 from core.authentication import AuthenticationHelper
-from core.imageshelper import fetch_image
+from core.imageshelper import fetch_images
 
 
 class RetrieveThenReadVisionApproach(Approach):
@@ -98,15 +98,7 @@ class RetrieveThenReadVisionApproach(Approach):
 
         # If retrieval mode includes vectors, compute an embedding for the query
 
-        vectors = []
-        if has_vector:
-            for field in vector_fields:
-                vector = (
-                    await self.compute_text_embedding(q)
-                    if field == "embedding"
-                    else await self.compute_image_embedding(q)
-                )
-                vectors.append(vector)
+        vectors = await self.compute_vectors(q, vector_fields) if has_vector else []
 
         # Only keep the text query if the retrieval mode uses text, otherwise drop it
         query_text = q if has_text else None
@@ -132,10 +124,10 @@ class RetrieveThenReadVisionApproach(Approach):
             content = "\n".join(sources_content)
             user_content.append({"text": content, "type": "text"})
         if include_gtpV_images:
-            for result in results:
-                url = await fetch_image(self.blob_container_client, result)
-                if url:
-                    image_list.append({"image_url": url, "type": "image_url"})
+            for url in await fetch_images(
+                self.blob_container_client, results, self.page_image_cache, detail=self.get_image_detail(overrides)
+            ):
+                image_list.append({"image_url": url, "type": "image_url"})
             user_content.extend(image_list)
 
         response_token_limit = 1024
@@ -160,9 +152,9 @@ class RetrieveThenReadVisionApproach(Approach):
             "images": [d["image_url"] for d in image_list],
         }
 
-        extra_info = {
-            "data_points": data_points,
-            "thoughts": [
+        extra_info = self.add_thoughts(
+            {"data_points": data_points},
+            lambda: [
                 ThoughtStep(
                     "Search using user query",
                     query_text,
@@ -188,7 +180,9 @@ class RetrieveThenReadVisionApproach(Approach):
                     ),
                 ),
             ],
-        }
+            overrides,
+            auth_claims,
+        )
         chat_completion["choices"][0]["context"] = extra_info
         chat_completion["choices"][0]["session_state"] = session_state
         return chat_completion
@@ -7,35 +7,23 @@ CONFIG_ASK_APPROACH_T3 = "ask_approach_T3"
 CONFIG_ASK_VISION_APPROACH = "ask_vision_approach"
 CONFIG_CHAT_VISION_APPROACH = "chat_vision_approach"
 CONFIG_CHAT_APPROACH = "chat_approach"
-CONFIG_CHAT_APPROACH_T1 = "chat_approach_T1"
-CONFIG_CHAT_APPROACH_T2 = "chat_approach_T2"
-CONFIG_CHAT_APPROACH_T3 = "chat_approach_T3"
-CONFIG_CHAT_APPROACH_T4 = "chat_approach_T4"
-CONFIG_CHAT_APPROACH_T5 = "chat_approach_T5"
-CONFIG_CHAT_APPROACH_T6 = "chat_approach_T6"
-CONFIG_CHAT_APPROACH_T7 = "chat_approach_T7"
 CONFIG_BLOB_CONTAINER_CLIENT = "blob_container_client"
+CONFIG_CONTENT_CACHE = "content_cache"
+CONFIG_ANSWER_CACHE = "answer_cache"
+CONFIG_SEMANTIC_ANSWER_CACHE = "semantic_answer_cache"
+CONFIG_REQUEST_COALESCER = "request_coalescer"
+CONFIG_CONTENT_SAS_URL_GENERATOR = "content_sas_url_generator"
 CONFIG_USER_UPLOAD_ENABLED = "user_upload_enabled"
 CONFIG_USER_BLOB_CONTAINER_CLIENT = "user_blob_container_client"
 CONFIG_AUTH_CLIENT = "auth_client"
-CONFIG_AUTH_CLIENT_T1 = "auth_client_t1"
-CONFIG_AUTH_CLIENT_T2 = "auth_client_t2"
-CONFIG_AUTH_CLIENT_T3 = "auth_client_t3"
-CONFIG_AUTH_CLIENT_T4 = "auth_client_t4"
-CONFIG_AUTH_CLIENT_T5 = "auth_client_t5"
-CONFIG_AUTH_CLIENT_T6 = "auth_client_t6"
-CONFIG_AUTH_CLIENT_T7 = "auth_client_t7"
+CONFIG_DOCUMENT_ACL_MAP = "document_acl_map"
 CONFIG_GPT4V_DEPLOYED = "gpt4v_deployed"
 CONFIG_SEMANTIC_RANKER_DEPLOYED = "semantic_ranker_deployed"
 CONFIG_VECTOR_SEARCH_ENABLED = "vector_search_enabled"
 CONFIG_SEARCH_CLIENT = "search_client"
-CONFIG_SEARCH_CLIENT_T1 = "search_client_T1"
-CONFIG_SEARCH_CLIENT_T2 = "search_client_T2"
-CONFIG_SEARCH_CLIENT_T3 = "search_client_T3"
-CONFIG_SEARCH_CLIENT_T4 = "search_client_T4"
-CONFIG_SEARCH_CLIENT_T5 = "search_client_T5"
-CONFIG_SEARCH_CLIENT_T6 = "search_client_T6"
-CONFIG_SEARCH_CLIENT_T7 = "search_client_T7"
+CONFIG_SEARCH_INDEX_NAME = "search_index_name"
+CONFIG_SEARCH_INDEX_CLIENT = "search_index_client"
+CONFIG_TENANT_REGISTRY = "tenant_registry"
 CONFIG_OPENAI_CLIENT = "openai_client"
 CONFIG_INGESTER = "ingester"
 CONFIG_LIST_FILE_STRATEGY = "list_file_strategy"
@@ -0,0 +1,164 @@
+import copy
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Callable, Optional
+
+
+def normalize_content(content: Any) -> str:
+    return " ".join(str(content).split()).lower()
+
+
+def is_complete_answer(response: dict[str, Any]) -> bool:
+    # Answers cut off by the token limit or the content filter must not be served to everyone
+    return bool(response.get("choices")) and response["choices"][0].get("finish_reason") == "stop"
+
+
+def cacheable_answer(response: dict[str, Any]) -> dict[str, Any]:
+    response = copy.deepcopy(response)
+    # Thoughts that weren't sent can only be fetched by the user that got the answer
+    response["choices"][0]["context"].pop("thoughts_id", None)
+    return response
+
+
+def cached_answer(response: dict[str, Any], session_state: Any) -> dict[str, Any]:
+    response = copy.deepcopy(response)
+    response["choices"][0]["session_state"] = session_state
+    return response
+
+
+async def record_stream(
+    events: AsyncGenerator[dict[str, Any], None], on_complete: Callable[[dict[str, Any]], None]
+) -> AsyncGenerator[dict[str, Any], None]:
+    """
+    Passes a streamed answer through, and hands it to on_complete as a whole once it was streamed completely,
+    with the finish reason OpenAI ended it with.
+    """
+    context: dict[str, Any] = {}
+    content = ""
+    session_state = None
+    finish_reason = None
+    async for event in events:
+        if event.get("choices"):
+            choice = event["choices"][0]
+            context.update(choice.get("context") or {})
+            content += choice.get("delta", {}).get("content") or ""
+            session_state = choice.get("session_state", session_state)
+            finish_reason = choice.get("finish_reason") or finish_reason
+        yield event
+    on_complete(
+        {
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "context": context,
+                    "session_state": session_state,
+                    "finish_reason": finish_reason,
+                }
+            ],
+            "object": "chat.completion",
+        }
+    )
+
+
+async def replay_stream(response: dict[str, Any]) -> AsyncGenerator[dict[str, Any], None]:
+    """Emits a cached answer in the chunks of a streamed one."""
+    choice = response["choices"][0]
+    context = dict(choice["context"])
+    followup_questions = context.pop("followup_questions", None)
+    yield {
+        "choices": [
+            {
+                "delta": {"role": "assistant"},
+                "context": context,
+                "session_state": choice.get("session_state"),
+                "finish_reason": None,
+                "index": 0,
+            }
+        ],
+        "object": "chat.completion.chunk",
+    }
+    yield {
+        "choices": [{"delta": {"content": choice["message"]["content"]}, "finish_reason": "stop", "index": 0}],
+        "object": "chat.completion.chunk",
+    }
+    if followup_questions:
+        yield {
+            "choices": [
+                {
+                    "delta": {"role": "assistant"},
+                    "context": {"followup_questions": followup_questions},
+                    "finish_reason": None,
+                    "index": 0,
+                }
+            ],
+            "object": "chat.completion.chunk",
+        }
+
+
+class AnswerCache:
+    """
+    LRU cache of complete answers, keyed by the search index, the approach, the normalized conversation,
+    the search filter (which carries the security filter of the user) and the overrides.
+    A handful of questions make up much of the traffic, a hit skips the search and both chat completions.
+    Streamed answers are cached with record_stream and replayed with replay_stream.
+    Only answers that OpenAI finished with "stop" are cached, see is_complete_answer.
+    Ingestion into an index through this process invalidates its answers, other processes only through the ttl.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: Optional[float] = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, str, dict[str, Any]]] = OrderedDict()
+        self._keys_by_index: dict[str, set[str]] = {}
+
+    @staticmethod
+    def key(
+        index_name: str, approach: str, messages: list[dict[str, Any]], filter: Optional[str], overrides: dict[str, Any]
+    ) -> str:
+        conversation = [[message["role"], normalize_content(message.get("content", ""))] for message in messages]
+        return hashlib.sha256(
+            json.dumps([index_name, approach, conversation, filter, overrides], sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def get(self, key: str, session_state: Any = None) -> Optional[dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return cached_answer(entry[2], session_state)
+
+    def put(self, key: str, index_name: str, response: dict[str, Any]):
+        if self.max_entries <= 0:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic(), index_name, cacheable_answer(response))
+        self._keys_by_index.setdefault(index_name, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, index_name: str):
+        """Drops the answers from an index, called when documents were added to or removed from it."""
+        for key in self._keys_by_index.pop(index_name, set()):
+            self._entries.pop(key, None)
+
+    def _remove(self, key: str):
+        _, index_name, _ = self._entries.pop(key)
+        keys = self._keys_by_index.get(index_name)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_index[index_name]
+
+    def __len__(self) -> int:
+        return len(self._entries)
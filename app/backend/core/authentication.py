@@ -1,7 +1,14 @@
 # Refactored from https://github.com/Azure-Samples/ms-identity-python-on-behalf-of
 
+import asyncio
+import copy
+import functools
+import hashlib
 import json
 import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Optional
 
 import aiohttp
@@ -18,6 +25,8 @@ from tenacity import (
     wait_random_exponential,
 )
 
+from core.documentacl import DocumentAclMap
+
 
 # AuthError is raised when the authentication token sent by the client UI cannot be parsed or there is an authentication error accessing the graph API
 class AuthError(Exception):
@@ -29,8 +38,269 @@ class AuthError(Exception):
         return self.error or ""
 
 
+class JwksCache:
+    """
+    Caches the signing keys used to validate access tokens, shared by all authentication helpers of the process.
+    Once the TTL has passed the keys are refreshed in the background, with retries, while the stale ones keep being used.
+    A token signed with an unknown key triggers an immediate refresh, at most once per min_refresh_interval,
+    as that is how Entra key rotation shows up. Requests only wait for a single attempt of up to fetch_timeout,
+    if it fails they go on with the stale keys and the background refresh takes over the retries.
+    """
+
+    _caches: dict[str, "JwksCache"] = {}
+
+    def __init__(
+        self, key_url: str, ttl: float = 24 * 3600, min_refresh_interval: float = 300, fetch_timeout: float = 5
+    ):
+        self.key_url = key_url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.fetch_timeout = fetch_timeout
+        self._jwks: Optional[dict[str, Any]] = None
+        self._fetched_at = 0.0
+        self._attempted_at = 0.0
+        self._request_task: Optional[asyncio.Task] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def for_key_url(cls, key_url: str) -> "JwksCache":
+        if key_url not in cls._caches:
+            cls._caches[key_url] = cls(key_url)
+        return cls._caches[key_url]
+
+    async def get_key(self, kid: str) -> Optional[dict[str, Any]]:
+        if self._jwks is None:
+            await self._fetch_for_request()
+        elif time.monotonic() - self._fetched_at > self.ttl:
+            self._start_refresh()
+        key = self._find_key(kid)
+        if key is None and time.monotonic() - self._attempted_at > self.min_refresh_interval:
+            await self._fetch_for_request()
+            key = self._find_key(kid)
+        return key
+
+    def _find_key(self, kid: str) -> Optional[dict[str, Any]]:
+        for key in (self._jwks or {}).get("keys", []):
+            if key.get("kid") == kid:
+                return key
+        return None
+
+    async def _fetch_for_request(self):
+        # Concurrent requests share a single download
+        if self._request_task is None or self._request_task.done():
+            self._attempted_at = time.monotonic()
+            self._request_task = asyncio.create_task(self._download(self.fetch_timeout))
+            self._request_task.add_done_callback(self._on_request_fetch_done)
+        try:
+            await asyncio.shield(self._request_task)
+        except Exception:
+            # Logged once by _on_request_fetch_done, the request goes on with the keys it has
+            pass
+
+    def _on_request_fetch_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            logging.warning(
+                "Failed to fetch signing keys from %s, retrying in the background: %s", self.key_url, task.exception()
+            )
+            self._start_refresh()
+
+    def _start_refresh(self) -> asyncio.Task:
+        # Concurrent requests share a single download
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._fetch())
+            self._refresh_task.add_done_callback(self._log_refresh_failure)
+        return self._refresh_task
+
+    def _log_refresh_failure(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            logging.warning("Failed to refresh signing keys from %s: %s", self.key_url, task.exception())
+
+    async def _fetch(self):
+        async for attempt in AsyncRetrying(
+            retry=retry_if_exception_type(AuthError),
+            wait=wait_random_exponential(min=15, max=60),
+            stop=stop_after_attempt(5),
+        ):
+            with attempt:
+                await self._download()
+
+    async def _download(self, timeout: float = 300):
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+            async with session.get(url=self.key_url) as resp:
+                resp_status = resp.status
+                if resp_status in [500, 502, 503, 504]:
+                    raise AuthError(error=f"Failed to get keys info: {await resp.text()}", status_code=resp_status)
+                jwks = await resp.json()
+
+        if not jwks or "keys" not in jwks:
+            raise AuthError({"code": "invalid_keys", "description": "Unable to get keys to validate auth token."}, 401)
+        self._jwks = jwks
+        self._fetched_at = time.monotonic()
+
+
+class AuthClaimsCache:
+    """
+    Caches the auth claims of validated access tokens until the token expires, keyed by a hash of the token.
+    A chat session sends many requests with the same token, only the first one needs to validate it,
+    exchange it through the On-Behalf-Of flow and look up the user's groups.
+    """
+
+    _caches: dict[str, "AuthClaimsCache"] = {}
+
+    def __init__(self, max_entries: int = 10000, max_ttl: float = 3600, expiry_margin: float = 60):
+        self.max_entries = max_entries
+        # Group membership changes are picked up after at most max_ttl, even for long-lived tokens
+        self.max_ttl = max_ttl
+        self.expiry_margin = expiry_margin
+        self._entries: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
+
+    @classmethod
+    def for_client_id(cls, client_id: Optional[str]) -> "AuthClaimsCache":
+        # All helpers of a server app derive the same claims from a token, so they share a cache
+        key = client_id or ""
+        if key not in cls._caches:
+            cls._caches[key] = cls()
+        return cls._caches[key]
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[dict[str, Any]]:
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, auth_claims = entry
+        if time.time() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return copy.deepcopy(auth_claims)
+
+    def put(self, token: str, auth_claims: dict[str, Any]):
+        try:
+            token_expiry = float(jwt.get_unverified_claims(token)["exp"])
+        except Exception:
+            # Without an expiry the claims can't be cached safely
+            return
+        now = time.time()
+        expires_at = min(token_expiry - self.expiry_margin, now + self.max_ttl)
+        if expires_at <= now:
+            return
+        key = self._key(token)
+        self._entries[key] = (expires_at, copy.deepcopy(auth_claims))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class GroupMembershipCache:
+    """
+    Caches the groups listed from Microsoft Graph per user oid, for users whose groups don't fit in the token.
+    Listing them takes one Graph call per page of groups, so the entries outlive individual access tokens.
+    Concurrent lookups for the same user share a single listing, and all listings reuse one HTTP session.
+    """
+
+    _caches: dict[str, "GroupMembershipCache"] = {}
+
+    def __init__(self, ttl: float = 7200, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, list[str]]] = OrderedDict()
+        self._pending: dict[str, asyncio.Task] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @classmethod
+    def for_client_id(cls, client_id: Optional[str], ttl: float = 7200) -> "GroupMembershipCache":
+        key = client_id or ""
+        if key not in cls._caches:
+            cls._caches[key] = cls(ttl)
+        cls._caches[key].ttl = ttl
+        return cls._caches[key]
+
+    @classmethod
+    async def close_all(cls):
+        for cache in cls._caches.values():
+            await cache.close()
+
+    async def get_groups(self, oid: str, graph_resource_access_token: dict) -> list[str]:
+        entry = self._entries.get(oid)
+        if entry is not None and time.monotonic() < entry[0]:
+            self._entries.move_to_end(oid)
+            return list(entry[1])
+        task = self._pending.get(oid)
+        if task is None:
+            task = asyncio.create_task(self._list_groups(oid, graph_resource_access_token))
+            self._pending[oid] = task
+            task.add_done_callback(lambda _: self._pending.pop(oid, None))
+        # Shielded so a cancelled request doesn't fail the others waiting for the same listing
+        return list(await asyncio.shield(task))
+
+    async def _list_groups(self, oid: str, graph_resource_access_token: dict) -> list[str]:
+        groups = await AuthenticationHelper.list_groups(graph_resource_access_token, session=self._get_session())
+        if self.ttl > 0:
+            self._entries[oid] = (time.monotonic() + self.ttl, groups)
+            self._entries.move_to_end(oid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return groups
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # A session is bound to the event loop it was created on
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            self._session = aiohttp.ClientSession()
+            self._session_loop = loop
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+class GroupAliases:
+    """
+    Pre-registered aliases standing for sets of groups, used to keep the groups filter of users in thousands of groups short.
+    A user who is a member of every group of an alias gets the alias in place of those groups. For this to grant the same
+    documents, the groups field of every document that grants one of the alias' groups must also contain the alias.
+    """
+
+    def __init__(self, aliases: dict[str, list[str]], min_groups: int = 100):
+        # Largest aliases first, they shorten the filter the most
+        self.aliases = sorted(
+            ((alias, frozenset(groups)) for alias, groups in aliases.items() if groups), key=lambda item: -len(item[1])
+        )
+        self.min_groups = min_groups
+
+    @classmethod
+    def from_file(cls, path: str, min_groups: int = 100) -> "GroupAliases":
+        with open(path, encoding="utf-8") as aliases_file:
+            return cls(json.load(aliases_file), min_groups)
+
+    def collapse(self, groups: list[str]) -> list[str]:
+        if len(groups) < self.min_groups:
+            return groups
+        remaining = set(groups)
+        collapsed = []
+        for alias, alias_groups in self.aliases:
+            if alias_groups <= remaining:
+                remaining -= alias_groups
+                collapsed.append(alias)
+        if not collapsed:
+            return groups
+        return collapsed + [group for group in groups if group in remaining]
+
+
 class AuthenticationHelper:
     scope: str = "https://graph.microsoft.com/.default"
+    # All helpers of a server app share one MSAL application and token cache,
+    # so a token acquired for one tenant is reused by the others
+    _confidential_clients: dict[tuple[Optional[str], str], ConfidentialClientApplication] = {}
+    # MSAL is synchronous, so the On-Behalf-Of exchange runs in a bounded pool instead of blocking the event loop
+    obo_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="obo")
 
     def __init__(
         self,
@@ -43,6 +313,9 @@ class AuthenticationHelper:
         require_access_control: bool = False,
         enable_global_documents: bool = False,
         enable_unauthenticated_access: bool = False,
+        groups_cache_ttl: float = 7200,
+        group_aliases: Optional[GroupAliases] = None,
+        max_security_filters: int = 1000,
     ):
         self.use_authentication = use_authentication
         self.server_app_id = server_app_id
@@ -59,6 +332,13 @@ class AuthenticationHelper:
         self.valid_audiences = [f"api://{server_app_id}", str(server_app_id)]
         # See https://learn.microsoft.com/entra/identity-platform/access-tokens#validate-the-issuer for more information on token validation
         self.key_url = f"{self.authority}/discovery/v2.0/keys"
+        self.jwks_cache = JwksCache.for_key_url(self.key_url)
+        self.auth_claims_cache = AuthClaimsCache.for_client_id(server_app_id)
+        self.groups_cache = GroupMembershipCache.for_client_id(server_app_id, groups_cache_ttl)
+        self.group_aliases = group_aliases
+        # Filters of recent users, the search.in clause of a user in many groups is long and costly to rebuild
+        self.max_security_filters = max_security_filters
+        self._security_filters: OrderedDict[tuple[str, tuple[str, ...], bool, bool], Optional[str]] = OrderedDict()
 
         if self.use_authentication:
             field_names = [field.name for field in search_index.fields] if search_index else []
@@ -66,8 +346,8 @@ class AuthenticationHelper:
             self.require_access_control = require_access_control
             self.enable_global_documents = enable_global_documents
             self.enable_unauthenticated_access = enable_unauthenticated_access
-            self.confidential_client = ConfidentialClientApplication(
-                server_app_id, authority=self.authority, client_credential=server_app_secret, token_cache=TokenCache()
+            self.confidential_client = AuthenticationHelper.get_confidential_client(
+                server_app_id, self.authority, server_app_secret
             )
         else:
             self.has_auth_fields = False
@@ -75,6 +355,17 @@ class AuthenticationHelper:
             self.enable_global_documents = True
             self.enable_unauthenticated_access = True
 
+    @classmethod
+    def get_confidential_client(
+        cls, server_app_id: Optional[str], authority: str, server_app_secret: Optional[str]
+    ) -> ConfidentialClientApplication:
+        key = (server_app_id, authority)
+        if key not in cls._confidential_clients:
+            cls._confidential_clients[key] = ConfidentialClientApplication(
+                server_app_id, authority=authority, client_credential=server_app_secret, token_cache=TokenCache()
+            )
+        return cls._confidential_clients[key]
+
     def get_auth_setup_for_client(self) -> dict[str, Any]:
         # returns MSAL.js settings used by the client app
         return {
@@ -140,21 +431,27 @@ class AuthenticationHelper:
         # Build different permutations of the oid or groups security filter using OData filters
         # https://learn.microsoft.com/azure/search/search-security-trimming-for-azure-search
         # https://learn.microsoft.com/azure/search/search-query-odata-filter
-        use_oid_security_filter = self.require_access_control or overrides.get("use_oid_security_filter")
-        use_groups_security_filter = self.require_access_control or overrides.get("use_groups_security_filter")
+        use_oid_security_filter = bool(self.require_access_control or overrides.get("use_oid_security_filter"))
+        use_groups_security_filter = bool(self.require_access_control or overrides.get("use_groups_security_filter"))
 
         if (use_oid_security_filter or use_groups_security_filter) and not self.has_auth_fields:
             raise AuthError(
                 error="oids and groups must be defined in the search index to use authentication", status_code=400
             )
 
-        oid_security_filter = (
-            "oids/any(g:search.in(g, '{}'))".format(auth_claims.get("oid", "")) if use_oid_security_filter else None
-        )
+        oid = auth_claims.get("oid", "")
+        groups = auth_claims.get("groups", [])
+        # Strings cache their hash, so hashing the tuple is cheap next to collapsing the groups into aliases
+        key = (oid, tuple(groups), use_oid_security_filter, use_groups_security_filter)
+        if key in self._security_filters:
+            self._security_filters.move_to_end(key)
+            return self._security_filters[key]
+
+        if self.group_aliases and use_groups_security_filter:
+            groups = self.group_aliases.collapse(groups)
+        oid_security_filter = f"oids/any(g:search.in(g, '{oid}'))" if use_oid_security_filter else None
         groups_security_filter = (
-            "groups/any(g:search.in(g, '{}'))".format(", ".join(auth_claims.get("groups", [])))
-            if use_groups_security_filter
-            else None
+            "groups/any(g:search.in(g, '{}'))".format(", ".join(groups)) if use_groups_security_filter else None
         )
 
         # If only one security filter is specified, use that filter
@@ -174,35 +471,46 @@ class AuthenticationHelper:
             if security_filter:
                 security_filter = f"({security_filter} or {global_documents_filter})"
 
+        self._security_filters[key] = security_filter
+        while len(self._security_filters) > self.max_security_filters:
+            self._security_filters.popitem(last=False)
         return security_filter
 
     @staticmethod
-    async def list_groups(graph_resource_access_token: dict) -> list[str]:
+    async def list_groups(
+        graph_resource_access_token: dict, session: Optional[aiohttp.ClientSession] = None
+    ) -> list[str]:
+        if session is None:
+            async with aiohttp.ClientSession() as new_session:
+                return await AuthenticationHelper.list_groups(graph_resource_access_token, new_session)
+
+        # The session is shared between users, so the token goes on each request
         headers = {"Authorization": "Bearer " + graph_resource_access_token["access_token"]}
         groups = []
-        async with aiohttp.ClientSession(headers=headers) as session:
-            resp_json = None
-            resp_status = None
-            async with session.get(url="https://graph.microsoft.com/v1.0/me/transitiveMemberOf?$select=id") as resp:
-                resp_json = await resp.json()
-                resp_status = resp.status
-                if resp_status != 200:
-                    raise AuthError(error=json.dumps(resp_json), status_code=resp_status)
-
-            while resp_status == 200:
-                value = resp_json["value"]
-                for group in value:
-                    groups.append(group["id"])
-                next_link = resp_json.get("@odata.nextLink")
-                if next_link:
-                    async with session.get(url=next_link) as resp:
-                        resp_json = await resp.json()
-                        resp_status = resp.status
-                else:
-                    break
+        resp_json = None
+        resp_status = None
+        async with session.get(
+            url="https://graph.microsoft.com/v1.0/me/transitiveMemberOf?$select=id", headers=headers
+        ) as resp:
+            resp_json = await resp.json()
+            resp_status = resp.status
             if resp_status != 200:
                 raise AuthError(error=json.dumps(resp_json), status_code=resp_status)
 
+        while resp_status == 200:
+            value = resp_json["value"]
+            for group in value:
+                groups.append(group["id"])
+            next_link = resp_json.get("@odata.nextLink")
+            if next_link:
+                async with session.get(url=next_link, headers=headers) as resp:
+                    resp_json = await resp.json()
+                    resp_status = resp.status
+            else:
+                break
+        if resp_status != 200:
+            raise AuthError(error=json.dumps(resp_json), status_code=resp_status)
+
         return groups
 
     async def get_auth_claims_if_enabled(self, headers: dict) -> dict[str, Any]:
@@ -213,13 +521,21 @@ class AuthenticationHelper:
             # The scope is set to the Microsoft Graph API, which may need to be called for more authorization information
             # https://learn.microsoft.com/en-us/azure/active-directory/develop/v2-oauth2-on-behalf-of-flow
             auth_token = AuthenticationHelper.get_token_auth_header(headers)
+            cached_auth_claims = self.auth_claims_cache.get(auth_token)
+            if cached_auth_claims is not None:
+                return cached_auth_claims
             # Validate the token before use
             await self.validate_access_token(auth_token)
 
             # Use the on-behalf-of-flow to acquire another token for use with Microsoft Graph
             # See https://learn.microsoft.com/entra/identity-platform/v2-oauth2-on-behalf-of-flow for more information
-            graph_resource_access_token = self.confidential_client.acquire_token_on_behalf_of(
-                user_assertion=auth_token, scopes=["https://graph.microsoft.com/.default"]
+            graph_resource_access_token = await asyncio.get_running_loop().run_in_executor(
+                AuthenticationHelper.obo_executor,
+                functools.partial(
+                    self.confidential_client.acquire_token_on_behalf_of,
+                    user_assertion=auth_token,
+                    scopes=["https://graph.microsoft.com/.default"],
+                ),
             )
             if "error" in graph_resource_access_token:
                 raise AuthError(error=str(graph_resource_access_token), status_code=401)
@@ -240,7 +556,10 @@ class AuthenticationHelper:
             )
             if missing_groups_claim or has_group_overage_claim:
                 # Read the user's groups from Microsoft Graph
-                auth_claims["groups"] = await AuthenticationHelper.list_groups(graph_resource_access_token)
+                auth_claims["groups"] = await self.groups_cache.get_groups(
+                    id_token_claims["oid"], graph_resource_access_token
+                )
+            self.auth_claims_cache.put(auth_token, auth_claims)
             return auth_claims
         except AuthError as e:
             logging.exception("Exception getting authorization information - " + json.dumps(e.error))
@@ -253,7 +572,13 @@ class AuthenticationHelper:
                 raise
             return {}
 
-    async def check_path_auth(self, path: str, auth_claims: dict[str, Any], search_client: SearchClient) -> bool:
+    async def check_path_auth(
+        self,
+        path: str,
+        auth_claims: dict[str, Any],
+        search_client: SearchClient,
+        acl_map: Optional[DocumentAclMap] = None,
+    ) -> bool:
         # Start with the standard security filter for all queries
         security_filter = self.build_security_filters(overrides={}, auth_claims=auth_claims)
         # If there was no security filter or no path, then the path is allowed
@@ -265,6 +590,13 @@ class AuthenticationHelper:
         if fragment_index != -1:
             path = path[:fragment_index]
 
+        # Without overrides the security filter is set only when access control is required, so it checks both oids
+        # and groups. The map answers most requests locally, anything it can't grant is checked against the index
+        if acl_map and acl_map.allows(
+            path, auth_claims.get("oid", ""), auth_claims.get("groups", []), self.enable_global_documents
+        ):
+            return True
+
         # Filter down to only chunks that are from the specific source file
         # Sourcepage is used for GPT-4V
         # Replace ' with '' to escape the single quote for the filter
@@ -287,26 +619,6 @@ class AuthenticationHelper:
         """
         Validate an access token is issued by Entra
         """
-        jwks = None
-        async for attempt in AsyncRetrying(
-            retry=retry_if_exception_type(AuthError),
-            wait=wait_random_exponential(min=15, max=60),
-            stop=stop_after_attempt(5),
-        ):
-            with attempt:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url=self.key_url) as resp:
-                        resp_status = resp.status
-                        if resp_status in [500, 502, 503, 504]:
-                            raise AuthError(
-                                error=f"Failed to get keys info: {await resp.text()}", status_code=resp_status
-                            )
-                        jwks = await resp.json()
-
-        if not jwks or "keys" not in jwks:
-            raise AuthError({"code": "invalid_keys", "description": "Unable to get keys to validate auth token."}, 401)
-
-        rsa_key = None
         issuer = None
         audience = None
         try:
@@ -314,14 +626,16 @@ class AuthenticationHelper:
             unverified_claims = jwt.get_unverified_claims(token)
             issuer = unverified_claims.get("iss")
             audience = unverified_claims.get("aud")
-            for key in jwks["keys"]:
-                if key["kid"] == unverified_header["kid"]:
-                    rsa_key = {"kty": key["kty"], "kid": key["kid"], "use": key["use"], "n": key["n"], "e": key["e"]}
-                    break
+            kid = unverified_header["kid"]
         except Exception as exc:
             raise AuthError(
                 {"code": "invalid_header", "description": "Unable to parse authorization token."}, 401
             ) from exc
+
+        rsa_key = None
+        key = await self.jwks_cache.get_key(kid)
+        if key:
+            rsa_key = {"kty": key["kty"], "kid": key["kid"], "use": key["use"], "n": key["n"], "e": key["e"]}
         if not rsa_key:
             raise AuthError({"code": "invalid_header", "description": "Unable to find appropriate key"}, 401)
 
@@ -0,0 +1,63 @@
+import asyncio
+import mimetypes
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from azure.storage.blob import BlobSasPermissions, UserDelegationKey, generate_blob_sas
+from azure.storage.blob.aio import BlobServiceClient
+
+
+class BlobSasUrlGenerator:
+    """
+    Generates short-lived, read-only user delegation SAS URLs for single blobs of a container,
+    so that clients can download citations straight from storage instead of through the app.
+    The user delegation key is requested once and reused until it gets close to its expiry.
+    """
+
+    def __init__(
+        self,
+        blob_service_client: BlobServiceClient,
+        container: str,
+        sas_ttl: timedelta = timedelta(minutes=5),
+        key_ttl: timedelta = timedelta(hours=1),
+    ):
+        if sas_ttl >= key_ttl:
+            raise ValueError("The SAS lifetime must be shorter than the user delegation key lifetime")
+        self.blob_service_client = blob_service_client
+        self.container = container
+        self.sas_ttl = sas_ttl
+        self.key_ttl = key_ttl
+        self._user_delegation_key: Optional[UserDelegationKey] = None
+        self._key_expiry = datetime.min.replace(tzinfo=timezone.utc)
+        self._key_lock = asyncio.Lock()
+
+    async def _get_user_delegation_key(self, now: datetime) -> UserDelegationKey:
+        async with self._key_lock:
+            # A SAS can't outlive the key it is signed with
+            if self._user_delegation_key is None or now + self.sas_ttl >= self._key_expiry:
+                # Start a little in the past to tolerate clock skew between the app and storage
+                key_start = now - timedelta(minutes=5)
+                key_expiry = now + self.key_ttl
+                self._user_delegation_key = await self.blob_service_client.get_user_delegation_key(
+                    key_start, key_expiry
+                )
+                self._key_expiry = key_expiry
+            return self._user_delegation_key
+
+    async def get_url(self, blob_name: str) -> str:
+        now = datetime.now(timezone.utc)
+        user_delegation_key = await self._get_user_delegation_key(now)
+        sas_token = generate_blob_sas(
+            account_name=self.blob_service_client.account_name,
+            container_name=self.container,
+            blob_name=blob_name,
+            user_delegation_key=user_delegation_key,
+            permission=BlobSasPermissions(read=True),
+            start=now - timedelta(minutes=5),
+            expiry=now + self.sas_ttl,
+            # Citations are often stored as application/octet-stream, make sure browsers display them inline
+            content_type=mimetypes.guess_type(blob_name)[0],
+            content_disposition="inline",
+        )
+        blob_url = self.blob_service_client.get_blob_client(self.container, blob_name).url
+        return f"{blob_url}?{sas_token}"
@@ -0,0 +1,242 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import BinaryIO, Optional
+
+from quart.wrappers.response import FileBody
+
+# Temporary files of writers that died mid-stream are removed after this many seconds
+STALE_TEMP_FILE_AGE = 3600
+
+
+@dataclass
+class CachedContent:
+    blob_name: str
+    etag: str
+    content_type: str
+    size: int
+    last_modified: Optional[datetime]
+    file_path: str
+
+
+class CachedFileBody(FileBody):
+    """
+    Response body of a cached file that is already open, so that another worker evicting it
+    doesn't break the response. Reads happen in a thread like those of FileBody.
+    """
+
+    # Larger than the default of FileBody, each read is a hop to a thread
+    buffer_size = 64 * 1024
+
+    def __init__(self, file: BinaryIO, size: int):
+        self.cached_file = file
+        self.size = size
+        self.begin = 0
+        self.end = size
+
+    async def __aenter__(self) -> "CachedFileBody":
+        await asyncio.to_thread(self.cached_file.seek, self.begin)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb) -> None:
+        await self.close()
+
+    async def __anext__(self) -> bytes:
+        read_size = min(self.buffer_size, self.end - self.cached_file.tell())
+        chunk = await asyncio.to_thread(self.cached_file.read, read_size) if read_size > 0 else b""
+        if not chunk:
+            raise StopAsyncIteration()
+        return chunk
+
+    async def close(self):
+        await asyncio.to_thread(self.cached_file.close)
+
+
+class ContentCacheWriter:
+    """Writes a blob to a temporary file while it is streamed, it only enters the cache once fully written."""
+
+    def __init__(self, cache: "ContentCache", entry: CachedContent):
+        self.cache = cache
+        self.entry = entry
+        fd, self.temp_path = tempfile.mkstemp(dir=cache.directory, suffix=".tmp")
+        self.file = os.fdopen(fd, "wb")
+        self.written = 0
+
+    def write(self, chunk: bytes):
+        self.file.write(chunk)
+        self.written += len(chunk)
+
+    def commit(self):
+        self.file.close()
+        if self.written != self.entry.size:
+            logging.warning(
+                "Not caching %s, expected %d bytes but got %d", self.entry.blob_name, self.entry.size, self.written
+            )
+            self.discard()
+            return
+        os.replace(self.temp_path, self.entry.file_path)
+        self.cache._add(self.entry)
+
+    def discard(self):
+        """Removes the partial file, e.g. when the client disconnected mid-stream. Does nothing after commit."""
+        self.file.close()
+        try:
+            os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
+
+
+class ContentCache:
+    """
+    On-disk LRU cache of blob content, keyed by blob name and ETag, bounded by the total size of the cached files.
+    Only the latest version of each blob is kept. The directory is the only state, so the gunicorn workers
+    sharing it see each other's files and keep it within max_size together: the size is summed from the directory
+    and the least recently opened files are evicted. A file that is gone is a cache miss.
+    The methods do disk I/O, call them with asyncio.to_thread.
+    """
+
+    def __init__(self, directory: str, max_size: int, max_entry_size: Optional[int] = None):
+        self.directory = directory
+        self.max_size = max_size
+        # A single large manual shouldn't flush out all the hot citations
+        self.max_entry_size = max_entry_size if max_entry_size is not None else max_size // 4
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, blob_name: str) -> Optional[CachedContent]:
+        entry = self._read_metadata(self._metadata_path(blob_name))
+        if entry is None or not os.path.exists(entry.file_path):
+            return None
+        return entry
+
+    def open(self, entry: CachedContent) -> Optional[BinaryIO]:
+        """Opens a cached file for reading, or returns None if it was evicted since."""
+        try:
+            cached_file = open(entry.file_path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            # Eviction goes by modification time, this makes it least recently used
+            os.utime(entry.file_path)
+        except OSError:
+            pass
+        return cached_file
+
+    def read(self, entry: CachedContent) -> Optional[bytes]:
+        cached_file = self.open(entry)
+        if cached_file is None:
+            return None
+        with cached_file:
+            return cached_file.read()
+
+    def writer(
+        self, blob_name: str, etag: str, content_type: str, size: int, last_modified: Optional[datetime]
+    ) -> Optional[ContentCacheWriter]:
+        """Returns a writer for a blob being downloaded, or None if it is too large to be cached."""
+        if size > self.max_entry_size:
+            return None
+        key = hashlib.sha256(etag.encode()).hexdigest()
+        entry = CachedContent(
+            blob_name=blob_name,
+            etag=etag,
+            content_type=content_type,
+            size=size,
+            last_modified=last_modified,
+            file_path=os.path.join(self.directory, f"{self._blob_key(blob_name)}-{key}"),
+        )
+        return ContentCacheWriter(self, entry)
+
+    def put(
+        self, blob_name: str, etag: str, content_type: str, content: bytes, last_modified: Optional[datetime]
+    ) -> Optional[CachedContent]:
+        """Caches content that is already in memory, returns the new entry or None if it is too large."""
+        writer = self.writer(blob_name, etag, content_type, len(content), last_modified)
+        if writer is None:
+            return None
+        writer.write(content)
+        writer.commit()
+        return writer.entry
+
+    def usage(self) -> int:
+        """Returns the total size of the cached files, as found in the directory."""
+        return sum(size for _, size, _ in self._scan())
+
+    @staticmethod
+    def _blob_key(blob_name: str) -> str:
+        return hashlib.sha256(blob_name.encode()).hexdigest()
+
+    def _metadata_path(self, blob_name: str) -> str:
+        return os.path.join(self.directory, f"{self._blob_key(blob_name)}.json")
+
+    def _add(self, entry: CachedContent):
+        metadata_path = self._metadata_path(entry.blob_name)
+        previous = self._read_metadata(metadata_path)
+        metadata = asdict(entry)
+        metadata["last_modified"] = entry.last_modified.isoformat() if entry.last_modified else None
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as metadata_file:
+            json.dump(metadata, metadata_file)
+        # Atomic so that other workers never read half written metadata
+        os.replace(temp_path, metadata_path)
+        if previous is not None and previous.file_path != entry.file_path:
+            self._remove_file(previous.file_path)
+        self._evict()
+
+    def _scan(self) -> list[tuple[float, int, str]]:
+        """Returns the modification time, size and path of the cached files, removing stale temporary files."""
+        files = []
+        now = time.time()
+        for dir_entry in os.scandir(self.directory):
+            try:
+                stat = dir_entry.stat()
+                if dir_entry.name.endswith(".tmp"):
+                    if stat.st_mtime < now - STALE_TEMP_FILE_AGE:
+                        os.remove(dir_entry.path)
+                elif not dir_entry.name.endswith(".json"):
+                    files.append((stat.st_mtime, stat.st_size, dir_entry.path))
+            except FileNotFoundError:
+                # Removed by another worker meanwhile
+                continue
+        return files
+
+    def _evict(self):
+        files = self._scan()
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, file_path in sorted(files):
+            if size <= self.max_size:
+                break
+            self._remove_file(file_path)
+            size -= file_size
+
+    def _remove_file(self, file_path: str):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        # Drops the metadata too, unless it already points to a newer version
+        metadata_path = f"{file_path.rsplit('-', 1)[0]}.json"
+        entry = self._read_metadata(metadata_path)
+        if entry is not None and entry.file_path == file_path:
+            try:
+                os.remove(metadata_path)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _read_metadata(metadata_path: str) -> Optional[CachedContent]:
+        try:
+            with open(metadata_path, encoding="utf-8") as metadata_file:
+                metadata = json.load(metadata_file)
+            if metadata["last_modified"]:
+                metadata["last_modified"] = datetime.fromisoformat(metadata["last_modified"])
+            return CachedContent(**metadata)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            logging.warning("Ignoring unreadable content cache metadata %s: %s", metadata_path, error)
+            return None
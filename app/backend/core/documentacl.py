@@ -0,0 +1,214 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from azure.search.documents.aio import SearchClient
+from azure.search.documents.indexes.models import SearchIndex
+
+
+@dataclass(frozen=True)
+class DocumentAcl:
+    oids: frozenset[str]
+    groups: frozenset[str]
+
+
+class DocumentAclMap:
+    """
+    In-memory map from the sourcefile and sourcepage of the documents of an index to the oids and groups of their chunks,
+    so opening a citation doesn't need a search round trip to check access.
+    The map is rebuilt in the background every refresh_interval, paging through the index by key,
+    and isn't trusted any more once it is older than max_staleness. Paging by key needs a sortable and filterable key,
+    see key_field. A failed rebuild is retried after retry_interval, doubling up to refresh_interval.
+    The index has no change feed to refresh from incrementally, so with a snapshot_path the gunicorn workers
+    share the map instead: one of them rebuilds it under a lock file and the others load its snapshot.
+    Only grants are answered locally: unknown paths, denials and a stale map fall back to a live query,
+    so newly indexed documents and newly granted access are never refused because of the map.
+    """
+
+    def __init__(
+        self,
+        search_client: SearchClient,
+        key_field: str = "id",
+        refresh_interval: float = 300,
+        max_staleness: Optional[float] = None,
+        page_size: int = 1000,
+        retry_interval: float = 30,
+        snapshot_path: Optional[str] = None,
+    ):
+        self.search_client = search_client
+        self.key_field = key_field
+        self.refresh_interval = refresh_interval
+        self.max_staleness = max_staleness if max_staleness is not None else 3 * refresh_interval
+        self.page_size = page_size
+        self.retry_interval = retry_interval
+        self.snapshot_path = snapshot_path
+        self._snapshot_mtime = 0.0
+        self._acls: Optional[dict[str, frozenset[DocumentAcl]]] = None
+        self._loaded_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._failures = 0
+        self._retry_at = 0.0
+
+    @staticmethod
+    def key_field(search_index: SearchIndex) -> Optional[str]:
+        """Returns the key of the index if it can be sorted and filtered on, which refresh pages by, else None."""
+        return next(
+            (field.name for field in search_index.fields if field.key and field.sortable and field.filterable), None
+        )
+
+    def allows(self, path: str, oid: str, groups: list[str], allow_global_documents: bool) -> bool:
+        """Returns True if the map shows a chunk of the document the user can access, False if the index must be asked."""
+        now = time.monotonic()
+        age = now - self._loaded_at
+        if (self._acls is None or age > self.refresh_interval) and now >= self._retry_at:
+            self.start_refresh()
+        if self._acls is None or age > self.max_staleness:
+            return False
+        groups_set = set(groups)
+        for acl in self._acls.get(path, ()):
+            if oid in acl.oids or not groups_set.isdisjoint(acl.groups):
+                return True
+            if allow_global_documents and not acl.oids and not acl.groups:
+                return True
+        return False
+
+    def start_refresh(self) -> asyncio.Task:
+        # Concurrent requests share a single rebuild
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self.refresh())
+            self._refresh_task.add_done_callback(self._log_refresh_failure)
+        return self._refresh_task
+
+    def _log_refresh_failure(self, task: asyncio.Task):
+        if task.cancelled():
+            return
+        if task.exception():
+            # Without the backoff every /content request would start another doomed refresh
+            retry_after = min(self.retry_interval * 2**self._failures, self.refresh_interval)
+            self._failures += 1
+            self._retry_at = time.monotonic() + retry_after
+            logging.warning(
+                "Failed to refresh the document ACL map, retrying in %.0f seconds: %s", retry_after, task.exception()
+            )
+        else:
+            self._failures = 0
+
+    async def refresh(self):
+        if not self.snapshot_path:
+            await self._build()
+            return
+        if await asyncio.to_thread(self._load_snapshot):
+            return
+        if not await asyncio.to_thread(self._lock):
+            # Another worker is rebuilding the map, its snapshot is picked up by a later request
+            self._retry_at = time.monotonic() + self.retry_interval
+            return
+        try:
+            # It may have finished rebuilding while the lock was taken
+            if await asyncio.to_thread(self._load_snapshot):
+                return
+            built_at = time.time()
+            await self._build()
+            await asyncio.to_thread(self._write_snapshot, built_at)
+        finally:
+            await asyncio.to_thread(self._unlock)
+
+    async def _build(self):
+        start = time.monotonic()
+        acls: dict[str, set[DocumentAcl]] = {}
+        last_key = None
+        while True:
+            # Paging by key instead of skip, which the search service caps at 100000
+            filter = "{} gt '{}'".format(self.key_field, last_key.replace("'", "''")) if last_key is not None else None
+            results = await self.search_client.search(
+                search_text="*",
+                filter=filter,
+                order_by=[f"{self.key_field} asc"],
+                select=[self.key_field, "sourcefile", "sourcepage", "oids", "groups"],
+                top=self.page_size,
+            )
+            count = 0
+            async for document in results:
+                count += 1
+                last_key = document[self.key_field]
+                acl = DocumentAcl(
+                    oids=frozenset(document.get("oids") or ()), groups=frozenset(document.get("groups") or ())
+                )
+                for field in ("sourcefile", "sourcepage"):
+                    if document.get(field):
+                        acls.setdefault(document[field], set()).add(acl)
+            if count < self.page_size:
+                break
+        self._acls = {path: frozenset(path_acls) for path, path_acls in acls.items()}
+        self._loaded_at = start
+        logging.info("Loaded the ACLs of %d documents in %.2f seconds", len(self._acls), time.monotonic() - start)
+
+    def _load_snapshot(self) -> bool:
+        """Loads the snapshot if another worker wrote it within refresh_interval, returns True if the map is current."""
+        snapshot_path = str(self.snapshot_path)
+        try:
+            mtime = os.path.getmtime(snapshot_path)
+            if time.time() - mtime > self.refresh_interval:
+                return False
+            if mtime == self._snapshot_mtime:
+                return True
+            with open(snapshot_path, encoding="utf-8") as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as error:
+            logging.warning("Ignoring unreadable document ACL snapshot %s: %s", snapshot_path, error)
+            return False
+        self._acls = {
+            path: frozenset(DocumentAcl(oids=frozenset(oids), groups=frozenset(groups)) for oids, groups in path_acls)
+            for path, path_acls in snapshot["acls"].items()
+        }
+        self._loaded_at = time.monotonic() - (time.time() - snapshot["built_at"])
+        self._snapshot_mtime = mtime
+        return True
+
+    def _write_snapshot(self, built_at: float):
+        snapshot_path = str(self.snapshot_path)
+        acls = {
+            path: [[sorted(acl.oids), sorted(acl.groups)] for acl in path_acls]
+            for path, path_acls in (self._acls or {}).items()
+        }
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(snapshot_path) or ".", suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as snapshot_file:
+                json.dump({"built_at": built_at, "acls": acls}, snapshot_file)
+            # Atomic so that other workers never read a half written snapshot
+            os.replace(temp_path, snapshot_path)
+            self._snapshot_mtime = os.path.getmtime(snapshot_path)
+        except OSError as error:
+            logging.warning("Could not write document ACL snapshot %s: %s", snapshot_path, error)
+
+    def _lock(self) -> bool:
+        lock_path = f"{self.snapshot_path}.lock"
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            pass
+        try:
+            # Left behind by a worker that died while rebuilding, the next refresh takes it over
+            if time.time() - os.path.getmtime(lock_path) > self.max_staleness:
+                os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+        return False
+
+    def _unlock(self):
+        try:
+            os.remove(f"{self.snapshot_path}.lock")
+        except FileNotFoundError:
+            pass
+
+    async def close(self):
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
@@ -0,0 +1,96 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Optional, Union
+
+from openai import AsyncOpenAI, RateLimitError
+
+
+@dataclass
+class PendingBatch:
+    openai_client: AsyncOpenAI
+    model: str
+    dimensions: Optional[int]
+    loop: asyncio.AbstractEventLoop
+    items: list[tuple[str, asyncio.Future]] = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class EmbeddingBatcher:
+    """
+    Collects the query texts that concurrent requests want embedded for up to max_wait seconds,
+    and embeds them with a single embeddings.create call per model, of at most max_batch_size inputs.
+    This keeps the request count against the rate limit of the embedding deployment down at peak.
+    When a batch fails, its texts are embedded one by one, so a bad query only fails the request it came from.
+    A max_batch_size of 1 disables batching.
+    """
+
+    def __init__(self, max_batch_size: int = 16, max_wait: float = 0.005):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending: dict[tuple[int, str, Optional[int]], PendingBatch] = {}
+        # Keeps the running batches from being garbage collected
+        self._tasks: set[asyncio.Task] = set()
+
+    async def embed(self, openai_client: AsyncOpenAI, model: str, dimensions: Optional[int], text: str) -> list[float]:
+        if self.max_batch_size <= 1:
+            return (await self._create(openai_client, model, dimensions, [text]))[0]
+        loop = asyncio.get_running_loop()
+        key = (id(openai_client), model, dimensions)
+        batch = self._pending.get(key)
+        if batch is None or batch.loop is not loop:
+            batch = PendingBatch(openai_client=openai_client, model=model, dimensions=dimensions, loop=loop)
+            batch.timer = loop.call_later(self.max_wait, self._dispatch, key, batch)
+            self._pending[key] = batch
+        future = loop.create_future()
+        batch.items.append((text, future))
+        if len(batch.items) >= self.max_batch_size:
+            self._dispatch(key, batch)
+        return await future
+
+    def _dispatch(self, key: tuple[int, str, Optional[int]], batch: PendingBatch):
+        if self._pending.get(key) is batch:
+            del self._pending[key]
+        if batch.timer:
+            batch.timer.cancel()
+        task = batch.loop.create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: PendingBatch):
+        # Popular queries often arrive together, each distinct text is only embedded once
+        texts = list(dict.fromkeys(text for text, _ in batch.items))
+        results: dict[str, Union[list[float], BaseException]]
+        try:
+            results = dict(zip(texts, await self._create(batch.openai_client, batch.model, batch.dimensions, texts)))
+        except Exception as error:
+            # Retrying one by one would only hit the rate limit harder, the client already retried with backoff
+            if len(texts) == 1 or isinstance(error, RateLimitError):
+                results = {text: error for text in texts}
+            else:
+                vectors = await asyncio.gather(
+                    *(self._create(batch.openai_client, batch.model, batch.dimensions, [text]) for text in texts),
+                    return_exceptions=True,
+                )
+                results = {
+                    text: vector if isinstance(vector, BaseException) else vector[0]
+                    for text, vector in zip(texts, vectors)
+                }
+        for text, future in batch.items:
+            # The request may have been cancelled while waiting
+            if future.done():
+                continue
+            result = results[text]
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    @staticmethod
+    async def _create(
+        openai_client: AsyncOpenAI, model: str, dimensions: Optional[int], texts: list[str]
+    ) -> list[list[float]]:
+        extra_args: dict[str, Any] = {"dimensions": dimensions} if dimensions else {}
+        response = await openai_client.embeddings.create(model=model, input=texts, **extra_args)
+        if len(response.data) != len(texts):
+            raise ValueError(f"Expected {len(texts)} embeddings, got {len(response.data)}")
+        return [embedding.embedding for embedding in sorted(response.data, key=lambda embedding: embedding.index)]
@@ -0,0 +1,43 @@
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+def normalize_query_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    """
+    LRU cache of query vectors, keyed by the embedding model, its dimensions and the whitespace-normalized query text.
+    Rewritten search queries recur a lot across users, a hit saves an embedding round trip.
+    Entries expire after ttl seconds so a redeployed model doesn't keep being served old vectors, None disables expiry.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: Optional[float] = 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[float, list[float]]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[list[float]]:
+        entry = self._entries.get(key)
+        if entry is None or (self.ttl is not None and time.monotonic() - entry[0] > self.ttl):
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, vector: list[float]):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic(), vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,45 @@
+from typing import Any
+
+import orjson
+from quart.json.provider import DefaultJSONProvider
+
+# Datetimes go through the default hook, so they keep the format of Quart's provider
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def default(o: Any) -> Any:
+    # orjson serializes dataclasses itself, this handles the pydantic models of the OpenAI SDK and Quart's extra types
+    if hasattr(o, "model_dump"):
+        return o.model_dump()
+    return DefaultJSONProvider.default(o)
+
+
+def dumps_line(obj: Any) -> bytes:
+    """Serializes an event of an NDJSON stream, including the trailing newline."""
+    return orjson.dumps(obj, default=default, option=ORJSON_OPTIONS | orjson.OPT_APPEND_NEWLINE)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    JSON provider that serializes with orjson, the results of the approaches are large
+    and the stdlib encoder spends a lot of CPU on them. The output is the same JSON, UTF-8 encoded.
+    Indented output in debug mode still goes through the stdlib encoder.
+    """
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs.keys() - {"separators"}:
+            return super().dumps(obj, **kwargs)
+        return self._dumps(obj).decode("utf-8")
+
+    def response(self, *args: Any, **kwargs: Any):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumps(obj) + b"\n", mimetype=self.mimetype)
+
+    def _dumps(self, obj: Any) -> bytes:
+        option = ORJSON_OPTIONS
+        if self.sort_keys:
+            # orjson keeps the field order of dataclasses, the default hook turns them into dicts that get sorted
+            option |= orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS
+        return orjson.dumps(obj, default=default, option=option)
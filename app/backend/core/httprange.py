@@ -0,0 +1,31 @@
+import re
+from typing import Optional
+
+# Only a single "bytes=start-" or "bytes=start-end" range is supported, which is what PDF viewers send.
+# Suffix ranges ("bytes=-500") and multiple ranges are ignored and answered with the full content, as RFC 9110 allows.
+RANGE_PATTERN = re.compile(r"^bytes=(\d+)-(\d*)$")
+
+
+def parse_range_header(range_header: Optional[str]) -> Optional[tuple[int, Optional[int]]]:
+    """Returns the (offset, length) to download for a Range header, length is None when the range is open ended."""
+    if not range_header:
+        return None
+    match = RANGE_PATTERN.match(range_header.strip())
+    if not match:
+        return None
+    start = int(match.group(1))
+    if not match.group(2):
+        return start, None
+    end = int(match.group(2))
+    if end < start:
+        return None
+    return start, end - start + 1
+
+
+def total_size_from_content_range(content_range: Optional[str]) -> str:
+    """Returns the complete length from a "bytes start-end/size" Content-Range, or "*" when it is unknown."""
+    if content_range and "/" in content_range:
+        size = content_range.rsplit("/", 1)[1]
+        if size.isdigit():
+            return size
+    return "*"
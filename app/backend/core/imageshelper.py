@@ -1,13 +1,15 @@
+import asyncio
 import base64
 import logging
 import os
-from typing import Optional
+from typing import Iterable, Optional
 
 from azure.core.exceptions import ResourceNotFoundError
 from azure.storage.blob.aio import ContainerClient
 from typing_extensions import Literal, Required, TypedDict
 
 from approaches.approach import Document
+from core.pageimagecache import PageImageCache
 
 
 class ImageURL(TypedDict, total=False):
@@ -18,14 +20,23 @@ class ImageURL(TypedDict, total=False):
     """Specifies the detail level of the image."""
 
 
-async def download_blob_as_base64(blob_container_client: ContainerClient, file_path: str) -> Optional[str]:
+async def download_blob_as_base64(
+    blob_container_client: ContainerClient,
+    file_path: str,
+    page_image_cache: Optional[PageImageCache] = None,
+    detail: str = "auto",
+) -> Optional[str]:
     base_name, _ = os.path.splitext(file_path)
     image_filename = base_name + ".png"
+    if page_image_cache is not None and (cached := page_image_cache.get(image_filename, detail)):
+        return cached
     try:
         blob = await blob_container_client.get_blob_client(image_filename).download_blob()
         if not blob.properties:
             logging.warning(f"No blob exists for {image_filename}")
             return None
+        if page_image_cache is not None:
+            return await page_image_cache.put(image_filename, await blob.readall(), detail)
         img = base64.b64encode(await blob.readall()).decode("utf-8")
         return f"data:image/png;base64,{img}"
     except ResourceNotFoundError:
@@ -33,11 +44,45 @@ async def download_blob_as_base64(blob_container_client: ContainerClient, file_p
         return None
 
 
-async def fetch_image(blob_container_client: ContainerClient, result: Document) -> Optional[ImageURL]:
+async def fetch_image(
+    blob_container_client: ContainerClient,
+    result: Document,
+    page_image_cache: Optional[PageImageCache] = None,
+    detail: Literal["auto", "low", "high"] = "auto",
+) -> Optional[ImageURL]:
     if result.sourcepage:
-        img = await download_blob_as_base64(blob_container_client, result.sourcepage)
+        img = await download_blob_as_base64(blob_container_client, result.sourcepage, page_image_cache, detail)
         if img:
-            return {"url": img, "detail": "auto"}
+            return {"url": img, "detail": detail}
         else:
             return None
     return None
+
+
+async def fetch_images(
+    blob_container_client: ContainerClient,
+    results: Iterable[Document],
+    page_image_cache: Optional[PageImageCache] = None,
+    max_concurrency: int = 8,
+    detail: Literal["auto", "low", "high"] = "auto",
+) -> list[ImageURL]:
+    """
+    Fetches the images of the results concurrently, in the order they are first cited.
+    Results of the same page share its image, each image is downloaded and returned once.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch(result: Document) -> Optional[ImageURL]:
+        async with semaphore:
+            return await fetch_image(blob_container_client, result, page_image_cache, detail)
+
+    pages: dict[Optional[str], asyncio.Future] = {}
+    for result in results:
+        if result.sourcepage not in pages:
+            pages[result.sourcepage] = asyncio.ensure_future(fetch(result))
+    images: dict[str, ImageURL] = {}
+    for image in await asyncio.gather(*pages.values()):
+        # Different source pages can still point to the same page image
+        if image and image["url"] not in images:
+            images[image["url"]] = image
+    return list(images.values())
@@ -0,0 +1,88 @@
+import asyncio
+import base64
+import io
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from PIL import Image
+
+# GPT-4V scales images down to fit these (longest side, shortest side) before counting tokens,
+# anything larger only makes the prompt bigger. https://platform.openai.com/docs/guides/vision
+DETAIL_SIZE_LIMITS = {"low": (512, 512), "high": (2048, 768), "auto": (2048, 768)}
+
+
+def resize_image(image: bytes, detail: str, jpeg_quality: int = 85) -> tuple[bytes, str]:
+    """Scales a page image down to what the model will look at for that detail level and recompresses it."""
+    long_limit, short_limit = DETAIL_SIZE_LIMITS.get(detail, DETAIL_SIZE_LIMITS["auto"])
+    with Image.open(io.BytesIO(image)) as original:
+        width, height = original.size
+        scale = min(1.0, long_limit / max(width, height), short_limit / min(width, height))
+        resized = original
+        if scale < 1:
+            resized = original.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+        output = io.BytesIO()
+        resized.convert("RGB").save(output, format="JPEG", quality=jpeg_quality, optimize=True)
+    if scale >= 1 and output.tell() >= len(image):
+        # Small renders of text pages can be smaller as PNG
+        return image, "image/png"
+    return output.getvalue(), "image/jpeg"
+
+
+class PageImageCache:
+    """
+    LRU cache of page images as data URLs, bounded by their total size, so the pages that keep being cited
+    aren't downloaded from storage and encoded again for every vision request.
+    With resize on, images are scaled down to the size the model uses for the requested detail level,
+    which also cuts the prompt size and the image tokens.
+    """
+
+    def __init__(self, max_size: int = 64 * 1024 * 1024, ttl: Optional[float] = 3600, resize: bool = False):
+        self.max_size = max_size
+        # Re-ingested documents get new page images under the same names
+        self.ttl = ttl
+        self.resize = resize
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[str, Optional[str]], tuple[float, str]] = OrderedDict()
+
+    def _key(self, image_filename: str, detail: str) -> tuple[str, Optional[str]]:
+        return image_filename, detail if self.resize else None
+
+    def get(self, image_filename: str, detail: str = "auto") -> Optional[str]:
+        key = self._key(image_filename, detail)
+        entry = self._entries.get(key)
+        if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    async def put(self, image_filename: str, image: bytes, detail: str = "auto") -> str:
+        """Encodes a downloaded page image as a data URL, resized if enabled, and caches it."""
+        mime_type = "image/png"
+        if self.resize:
+            # CPU bound, keep it off the event loop
+            image, mime_type = await asyncio.to_thread(resize_image, image, detail)
+        data_url = f"data:{mime_type};base64,{base64.b64encode(image).decode('utf-8')}"
+        key = self._key(image_filename, detail)
+        if key in self._entries:
+            self._remove(key)
+        if len(data_url) <= self.max_size:
+            self._entries[key] = (time.monotonic(), data_url)
+            self.size += len(data_url)
+            while self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+        return data_url
+
+    def _remove(self, key: tuple[str, Optional[str]]):
+        _, data_url = self._entries.pop(key)
+        self.size -= len(data_url)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,34 @@
+from typing import Union
+
+import fitz  # type: ignore
+
+PAGE_FORMATS = {"pdf": "application/pdf", "png": "image/png"}
+
+# Resolution of rendered pages, high enough for small print in scanned manuals
+PAGE_IMAGE_DPI = 150
+
+
+class PageNotFoundError(Exception):
+    pass
+
+
+def extract_pdf_page(pdf: Union[bytes, str], page_number: int, page_format: str = "pdf") -> bytes:
+    """
+    Extracts a single page, numbered from 1 like the #page= fragment of citations, from a PDF given as bytes or a path.
+    Returns a single-page PDF, or the page rendered as a PNG. CPU bound, so call it from a thread.
+    Raises ValueError if the document isn't a PDF and PageNotFoundError if it doesn't have that page.
+    """
+    try:
+        document = fitz.open(stream=pdf, filetype="pdf") if isinstance(pdf, bytes) else fitz.open(pdf, filetype="pdf")
+    except Exception as error:
+        # PyMuPDF raises different exception types depending on its version and how the file is broken
+        raise ValueError(f"Not a PDF: {error}") from error
+    with document:
+        if page_number < 1 or page_number > document.page_count:
+            raise PageNotFoundError(f"Page {page_number} not found, the document has {document.page_count} pages")
+        if page_format == "png":
+            return document[page_number - 1].get_pixmap(dpi=PAGE_IMAGE_DPI).tobytes("png")
+        with fitz.open() as page_document:
+            page_document.insert_pdf(document, from_page=page_number - 1, to_page=page_number - 1)
+            # Drop the objects only used by the other pages, e.g. their fonts and images
+            return page_document.tobytes(garbage=3, deflate=True)
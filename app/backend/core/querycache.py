@@ -0,0 +1,49 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from openai.types.chat import ChatCompletionMessageParam
+
+
+class QueryRewriteCache:
+    """
+    LRU cache of the search queries generated from a conversation, keyed by a hash of the model,
+    the history and the question, with whitespace and case normalized.
+    The same first questions come back again and again, a hit saves a chat completion round trip.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: Optional[float] = 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    @staticmethod
+    def key(model: str, past_messages: list[ChatCompletionMessageParam], user_query: str) -> str:
+        def normalize(text: object) -> str:
+            return " ".join(str(text).split()).lower()
+
+        conversation = [[message["role"], normalize(message.get("content", ""))] for message in past_messages]
+        conversation.append(["user", normalize(user_query)])
+        return hashlib.sha256(json.dumps([model, conversation]).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None or (self.ttl is not None and time.monotonic() - entry[0] > self.ttl):
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, query_text: str):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic(), query_text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,110 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Awaitable, Callable, Optional, Union
+
+ApproachResult = Union[dict[str, Any], AsyncGenerator[dict[str, Any], None]]
+
+
+@dataclass
+class InFlightStream:
+    events: list[dict[str, Any]] = field(default_factory=list)
+    done: bool = False
+    error: Optional[BaseException] = None
+    # Replaced on every change, waiters hold on to the one that was current when they started waiting
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+    subscribers: int = 0
+    task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+def for_follower(response: dict[str, Any], session_state: Any) -> dict[str, Any]:
+    """Copies what differs between the requests sharing an answer, the rest stays shared."""
+    if not response.get("choices"):
+        return response
+    choice = dict(response["choices"][0])
+    if "session_state" in choice:
+        choice["session_state"] = session_state
+    # Thoughts that weren't sent can only be fetched by the user that asked first
+    if isinstance(choice.get("context"), dict) and "thoughts_id" in choice["context"]:
+        choice["context"] = {name: value for name, value in choice["context"].items() if name != "thoughts_id"}
+    return {**response, "choices": [choice, *response["choices"][1:]]}
+
+
+class RequestCoalescer:
+    """
+    Lets concurrent identical requests share one run of the approach: the first one runs it,
+    the ones arriving while it runs get its answer. A streamed answer is read from OpenAI once
+    and fanned out to every request, later ones get the events streamed so far first.
+    The run stops once every streaming request has gone away.
+    """
+
+    def __init__(self):
+        self._answers: dict[str, asyncio.Task] = {}
+        self._streams: dict[str, InFlightStream] = {}
+
+    async def run(
+        self, key: str, run: Callable[[], Awaitable[ApproachResult]], stream: bool, session_state: Any = None
+    ) -> ApproachResult:
+        if stream:
+            return self._stream(key, run, session_state)
+        task = self._answers.get(key)
+        leader = task is None
+        if task is None:
+            task = asyncio.ensure_future(run())
+            self._answers[key] = task
+            task.add_done_callback(lambda _: self._answers.pop(key, None))
+        # A request going away doesn't cancel the run the others are waiting for
+        result = await asyncio.shield(task)
+        if leader or not isinstance(result, dict):
+            return result
+        return for_follower(result, session_state)
+
+    async def _stream(
+        self, key: str, run: Callable[[], Awaitable[ApproachResult]], session_state: Any
+    ) -> AsyncGenerator[dict[str, Any], None]:
+        flight = self._streams.get(key)
+        leader = flight is None
+        if flight is None:
+            flight = InFlightStream()
+            flight.task = asyncio.create_task(self._pump(key, flight, run))
+            self._streams[key] = flight
+        flight.subscribers += 1
+        try:
+            position = 0
+            while True:
+                changed = flight.changed
+                while position < len(flight.events):
+                    event = flight.events[position]
+                    position += 1
+                    yield event if leader else for_follower(event, session_state)
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await changed.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done and flight.task is not None:
+                if self._streams.get(key) is flight:
+                    del self._streams[key]
+                flight.task.cancel()
+
+    async def _pump(self, key: str, flight: InFlightStream, run: Callable[[], Awaitable[ApproachResult]]):
+        try:
+            result = await run()
+            if isinstance(result, dict):
+                flight.events.append(result)
+            else:
+                async for event in result:
+                    flight.events.append(event)
+                    flight.notify()
+        except Exception as error:
+            flight.error = error
+        finally:
+            flight.done = True
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+            flight.notify()
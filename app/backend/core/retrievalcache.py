@@ -0,0 +1,85 @@
+import hashlib
+import json
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Optional
+
+from azure.search.documents.models import VectorizedQuery, VectorQuery
+
+
+def vector_query_key(vector_query: VectorQuery) -> list[Any]:
+    key: list[Any] = [type(vector_query).__name__, vector_query.fields, vector_query.k_nearest_neighbors]
+    if isinstance(vector_query, VectorizedQuery):
+        # Hashing the packed floats is much cheaper than serializing them
+        key.append(hashlib.sha256(array("d", vector_query.vector or []).tobytes()).hexdigest())
+    else:
+        key.append(getattr(vector_query, "text", None) or getattr(vector_query, "url", None))
+    return key
+
+
+class RetrievalCache:
+    """
+    LRU cache of search results, keyed by the index, the query text, the filter, the query vectors
+    and the search options, so repeated searches within ttl seconds don't count against the search service.
+    Results of an index are invalidated when this process changes its content, see SearchManager.on_content_changed,
+    the ttl bounds how stale they get when another process does.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: Optional[float] = 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, str, list[Any]]] = OrderedDict()
+        self._keys_by_index: dict[str, set[str]] = {}
+
+    @staticmethod
+    def key(
+        index_name: str,
+        query_text: Optional[str],
+        filter: Optional[str],
+        vectors: list[VectorQuery],
+        options: list[Any],
+    ) -> str:
+        vector_keys = [vector_query_key(vector_query) for vector_query in vectors]
+        return hashlib.sha256(
+            json.dumps([index_name, query_text, filter, vector_keys, options], default=str).encode()
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[list[Any]]:
+        entry = self._entries.get(key)
+        if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return list(entry[2])
+
+    def put(self, key: str, index_name: str, documents: list[Any]):
+        if self.max_entries <= 0:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic(), index_name, list(documents))
+        self._keys_by_index.setdefault(index_name, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, index_name: str):
+        for key in self._keys_by_index.pop(index_name, set()):
+            self._entries.pop(key, None)
+
+    def _remove(self, key: str):
+        _, index_name, _ = self._entries.pop(key)
+        keys = self._keys_by_index.get(index_name)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_index[index_name]
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,82 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Iterable, Optional
+
+from azure.search.documents.indexes.aio import SearchIndexClient
+from azure.search.documents.indexes.models import SearchField, SearchIndex
+
+
+class SearchIndexSchemaCache:
+    """
+    Caches the field list of search indexes in memory and in a JSON snapshot on disk.
+    Every gunicorn worker needs the schemas to build its authentication helpers, and workers are recycled regularly,
+    so a restarted worker reuses the snapshot written by its siblings instead of fetching each schema again.
+    Only the field names and types are kept, which is all the authentication helper looks at.
+    """
+
+    def __init__(
+        self,
+        search_index_client: SearchIndexClient,
+        snapshot_path: Optional[str] = None,
+        ttl: float = 3600,
+    ):
+        self.search_index_client = search_index_client
+        self.snapshot_path = snapshot_path
+        self.ttl = ttl
+        self._entries: dict[str, dict[str, Any]] = self._read_snapshot()
+
+    async def get_index(self, index_name: str) -> SearchIndex:
+        entry = self._entries.get(index_name)
+        if entry is not None and time.time() - entry["fetched_at"] < self.ttl:
+            return SearchIndex(
+                name=index_name,
+                fields=[SearchField(name=field["name"], type=field["type"]) for field in entry["fields"]],
+            )
+
+        search_index = await self.search_index_client.get_index(index_name)
+        self._entries[index_name] = {
+            "fetched_at": time.time(),
+            "fields": [{"name": field.name, "type": field.type} for field in search_index.fields],
+        }
+        self._write_snapshot(index_name)
+        return search_index
+
+    async def prefetch(self, index_names: Iterable[str]):
+        """Fetches the given schemas concurrently. Missing indexes are logged, the tenant will fail when requested."""
+        index_names = list(index_names)
+        results = await asyncio.gather(*(self.get_index(name) for name in index_names), return_exceptions=True)
+        for index_name, result in zip(index_names, results):
+            if isinstance(result, Exception):
+                logging.warning("Could not fetch schema of search index %s: %s", index_name, result)
+
+    def _read_snapshot(self) -> dict[str, dict[str, Any]]:
+        if not self.snapshot_path or self.ttl <= 0:
+            return {}
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as snapshot_file:
+                return json.load(snapshot_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as error:
+            logging.warning("Ignoring unreadable search index snapshot %s: %s", self.snapshot_path, error)
+            return {}
+
+    def _write_snapshot(self, index_name: str):
+        if not self.snapshot_path or self.ttl <= 0:
+            return
+        # Other workers may have added indexes since we read the snapshot, so merge rather than overwrite
+        entries = self._read_snapshot()
+        entries[index_name] = self._entries[index_name]
+        try:
+            directory = os.path.dirname(self.snapshot_path) or "."
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as snapshot_file:
+                json.dump(entries, snapshot_file)
+            # Atomic so that a worker starting up never reads a half written snapshot
+            os.replace(temp_path, self.snapshot_path)
+        except OSError as error:
+            logging.warning("Could not write search index snapshot %s: %s", self.snapshot_path, error)
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import numpy as np
+
+from core.answercache import cacheable_answer, cached_answer
+
+
+class SemanticScope:
+    """
+    The cached questions of one index, approach, search filter and overrides, as rows of a normalized matrix.
+    The matrix grows as questions are added, most scopes only ever hold a few.
+    """
+
+    def __init__(self, index_name: str, dimensions: int):
+        self.index_name = index_name
+        self.vectors = np.zeros((0, dimensions), dtype=np.float32)
+        self.stored_at = np.zeros(0, dtype=np.float64)
+        self.used_at = np.zeros(0, dtype=np.float64)
+        self.answers: list[Optional[dict[str, Any]]] = []
+        self.size = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self.answers)
+
+    def grow(self, capacity: int):
+        vectors = np.zeros((capacity, self.vectors.shape[1]), dtype=np.float32)
+        vectors[: self.size] = self.vectors[: self.size]
+        self.vectors = vectors
+        self.stored_at = np.resize(self.stored_at, capacity)
+        self.used_at = np.resize(self.used_at, capacity)
+        self.answers.extend([None] * (capacity - len(self.answers)))
+
+
+class SemanticAnswerCache:
+    """
+    Answers questions that are close enough to a question answered before, by the cosine similarity of their embeddings.
+    Only single-turn conversations are looked up, a question alone doesn't say what a follow-up is about.
+    Questions are kept per scope, so a hit never crosses the search filter, and thereby the security filter, it was
+    answered with. Each scope holds at most max_entries questions and evicts the least recently used one.
+    With access control every user has scopes of their own, so the memory is bounded by max_rows, the number of
+    question vectors allocated across all scopes, and the least recently used scopes are dropped to stay within it.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        max_entries: int = 256,
+        max_scopes: int = 1000,
+        max_rows: int = 4096,
+        ttl: Optional[float] = 3600,
+    ):
+        self.threshold = threshold
+        self.max_entries = min(max_entries, max_rows)
+        self.max_scopes = max_scopes
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._scopes: OrderedDict[str, SemanticScope] = OrderedDict()
+        self._rows = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @staticmethod
+    def scope(index_name: str, approach: str, filter: Optional[str], overrides: dict[str, Any]) -> str:
+        return hashlib.sha256(
+            json.dumps([index_name, approach, filter, overrides], sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def get(self, scope_key: str, vector: list[float], session_state: Any = None) -> Optional[dict[str, Any]]:
+        scope = self._scopes.get(scope_key)
+        query = self._normalize(vector)
+        if scope is None or scope.size == 0 or query is None or len(query) != scope.vectors.shape[1]:
+            self.misses += 1
+            return None
+        self._scopes.move_to_end(scope_key)
+        similarities = scope.vectors[: scope.size] @ query
+        now = time.monotonic()
+        if self.ttl is not None:
+            similarities[now - scope.stored_at[: scope.size] > self.ttl] = -1
+        best = int(np.argmax(similarities))
+        answer = scope.answers[best]
+        if similarities[best] < self.threshold or answer is None:
+            self.misses += 1
+            return None
+        scope.used_at[best] = now
+        self.hits += 1
+        return cached_answer(answer, session_state)
+
+    def put(self, scope_key: str, index_name: str, vector: list[float], response: dict[str, Any]):
+        query = self._normalize(vector)
+        if query is None or self.max_entries <= 0:
+            return
+        scope = self._scopes.get(scope_key)
+        if scope is None or scope.vectors.shape[1] != len(query):
+            # A different embedding model or dimensions make the stored vectors useless
+            if scope is not None:
+                self._drop(scope_key)
+            scope = SemanticScope(index_name, len(query))
+            self._scopes[scope_key] = scope
+        self._scopes.move_to_end(scope_key)
+
+        if scope.size < self.max_entries:
+            if scope.size == scope.capacity:
+                capacity = min(max(2 * scope.capacity, 8), self.max_entries)
+                self._rows += capacity - scope.capacity
+                scope.grow(capacity)
+            row = scope.size
+            scope.size += 1
+        else:
+            row = int(np.argmin(scope.used_at))
+        while len(self._scopes) > self.max_scopes or self._rows > self.max_rows:
+            self._drop(next(iter(self._scopes)))
+        now = time.monotonic()
+        scope.vectors[row] = query
+        scope.stored_at[row] = now
+        scope.used_at[row] = now
+        scope.answers[row] = cacheable_answer(response)
+
+    def invalidate(self, index_name: str):
+        """Drops the answers from an index, called when documents were added to or removed from it."""
+        for scope_key in [key for key, scope in self._scopes.items() if scope.index_name == index_name]:
+            self._drop(scope_key)
+
+    def _drop(self, scope_key: str):
+        self._rows -= self._scopes.pop(scope_key).capacity
+
+    @staticmethod
+    def _normalize(vector: list[float]) -> Optional[np.ndarray]:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else None
+
+    def __len__(self) -> int:
+        return sum(scope.size for scope in self._scopes.values())
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+from azure.search.documents.aio import SearchClient
+
+from approaches.approach import Approach
+from core.authentication import AuthenticationHelper
+
+# Tenants are addressed by their ADLS folder name, e.g. /chat/Phelps
+TENANT_NAME_PATTERN = re.compile(r"^[\w][\w .-]{0,127}$")
+
+
+@dataclass
+class Tenant:
+    name: str
+    index_name: str
+    search_client: SearchClient
+    auth_helper: AuthenticationHelper
+    chat_approach: Approach
+    chat_vision_approach: Optional[Approach] = None
+
+
+def is_valid_tenant_name(tenant_name: str) -> bool:
+    return TENANT_NAME_PATTERN.match(tenant_name) is not None
+
+
+def index_name_for_tenant(tenant_name: str, index_prefix: str, index_aliases: Optional[dict[str, str]] = None) -> str:
+    """
+    Returns the search index holding the documents of a tenant.
+    Explicit aliases win, otherwise the folder name is turned into a valid index name under the given prefix.
+    """
+    if index_aliases and tenant_name in index_aliases:
+        return index_aliases[tenant_name]
+    # Index names may only contain lowercase letters, digits and dashes
+    # https://learn.microsoft.com/rest/api/searchservice/naming-rules
+    slug = re.sub("[^0-9a-z]+", "-", tenant_name.lower()).strip("-")
+    if not slug:
+        raise ValueError(f"Tenant name '{tenant_name}' cannot be mapped to a search index")
+    return f"{index_prefix}-{slug}"
+
+
+class TenantRegistry:
+    """
+    Builds the search client, authentication helper and approaches of a tenant the first time it is requested,
+    and keeps at most max_tenants of them in memory, evicting the least recently used tenant.
+    The OpenAI client and other shared state are captured by build_tenant, so a tenant only costs its own search client.
+    """
+
+    def __init__(
+        self,
+        build_tenant: Callable[[str], Awaitable[Tenant]],
+        max_tenants: int = 32,
+        close_delay: float = 60.0,
+    ):
+        if max_tenants < 1:
+            raise ValueError("max_tenants must be at least 1")
+        self.build_tenant = build_tenant
+        self.max_tenants = max_tenants
+        # Evicted tenants may still be serving a streamed response, so their clients are closed after a grace period
+        self.close_delay = close_delay
+        self._tenants: OrderedDict[str, Tenant] = OrderedDict()
+        self._pending: dict[str, asyncio.Task] = {}
+        self._closing: set[asyncio.Task] = set()
+
+    def __contains__(self, tenant_name: str) -> bool:
+        return tenant_name in self._tenants
+
+    def __len__(self) -> int:
+        return len(self._tenants)
+
+    async def get(self, tenant_name: str) -> Tenant:
+        tenant = self._tenants.get(tenant_name)
+        if tenant is not None:
+            self._tenants.move_to_end(tenant_name)
+            return tenant
+
+        # Concurrent first requests for the same tenant share a single build, which completes even if they disconnect
+        pending = self._pending.get(tenant_name)
+        if pending is None:
+            pending = asyncio.create_task(self._load(tenant_name))
+            self._pending[tenant_name] = pending
+        return await asyncio.shield(pending)
+
+    async def _load(self, tenant_name: str) -> Tenant:
+        try:
+            tenant = await self.build_tenant(tenant_name)
+        finally:
+            del self._pending[tenant_name]
+        logging.info("Loaded tenant %s using search index %s", tenant_name, tenant.index_name)
+        self._tenants[tenant_name] = tenant
+        self._evict()
+        return tenant
+
+    def _evict(self):
+        while len(self._tenants) > self.max_tenants:
+            tenant_name, tenant = self._tenants.popitem(last=False)
+            logging.info("Evicting least recently used tenant %s", tenant_name)
+            task = asyncio.create_task(self._close_later(tenant))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    async def _close_later(self, tenant: Tenant):
+        try:
+            await asyncio.sleep(self.close_delay)
+        finally:
+            await tenant.search_client.close()
+
+    async def close(self):
+        for task in self._closing:
+            task.cancel()
+        await asyncio.gather(*self._closing, return_exceptions=True)
+        while self._tenants:
+            _, tenant = self._tenants.popitem()
+            await tenant.search_client.close()
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import re
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Union
+
+import orjson
+
+from core.fastjson import ORJSON_OPTIONS, default
+
+THOUGHTS_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+class ThoughtsStore:
+    """
+    Keeps the thoughts of recent responses that were sent without them, for the debug panel to fetch by id.
+    Thoughts are only built when fetched, most of them never are.
+    gunicorn runs several workers and the fetch rarely reaches the one that answered. With a directory the thoughts
+    are also built and written there in the background for the other workers of the instance to read, which gives up
+    the laziness, so it is opt-in.
+    Instances that are scaled out need ARR affinity (sticky sessions) for the fetch to reach the same instance.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 300, directory: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.directory = directory
+        self._entries: OrderedDict[str, tuple[float, Optional[str], Union[Callable[[], list[Any]], list[Any]]]] = (
+            OrderedDict()
+        )
+        self._swept_at = time.time()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def put(self, build_thoughts: Callable[[], list[Any]], oid: Optional[str]) -> Optional[str]:
+        if self.max_entries <= 0:
+            return None
+        self._evict_expired()
+        thoughts_id = uuid.uuid4().hex
+        self._entries[thoughts_id] = (time.monotonic() + self.ttl, oid, build_thoughts)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        if self.directory:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self._write(thoughts_id, oid, build_thoughts)
+            else:
+                loop.run_in_executor(None, self._write, thoughts_id, oid, build_thoughts)
+        return thoughts_id
+
+    def get(self, thoughts_id: str, oid: Optional[str]) -> Optional[list[Any]]:
+        """Returns the thoughts of a response, only to the user that got it."""
+        self._evict_expired()
+        entry = self._entries.get(thoughts_id)
+        if entry is None or entry[1] != oid:
+            return None
+        expires, _, thoughts = entry
+        if callable(thoughts):
+            thoughts = thoughts()
+            self._entries[thoughts_id] = (expires, oid, thoughts)
+        return thoughts
+
+    async def fetch(self, thoughts_id: str, oid: Optional[str]) -> Optional[list[Any]]:
+        """Returns the thoughts of a response from this worker or, when there is a directory, any other worker."""
+        thoughts = self.get(thoughts_id, oid)
+        if thoughts is None and self.directory:
+            thoughts = await asyncio.to_thread(self._read, thoughts_id, oid)
+        return thoughts
+
+    def _path(self, thoughts_id: str) -> str:
+        return os.path.join(self.directory or "", f"{thoughts_id}.json")
+
+    def _write(self, thoughts_id: str, oid: Optional[str], build_thoughts: Callable[[], list[Any]]):
+        try:
+            data = orjson.dumps(
+                {"expires_at": time.time() + self.ttl, "oid": oid, "thoughts": build_thoughts()},
+                default=default,
+                option=ORJSON_OPTIONS,
+            )
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as thoughts_file:
+                thoughts_file.write(data)
+            # Atomic so that another worker never reads half written thoughts
+            os.replace(temp_path, self._path(thoughts_id))
+            self._sweep()
+        except Exception as error:
+            logging.warning("Could not write thoughts %s: %s", thoughts_id, error)
+
+    def _read(self, thoughts_id: str, oid: Optional[str]) -> Optional[list[Any]]:
+        # The id comes from the URL, it must not reach outside the directory
+        if not THOUGHTS_ID_PATTERN.fullmatch(thoughts_id):
+            return None
+        try:
+            with open(self._path(thoughts_id), "rb") as thoughts_file:
+                record = orjson.loads(thoughts_file.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as error:
+            logging.warning("Could not read thoughts %s: %s", thoughts_id, error)
+            return None
+        if record["oid"] != oid or record["expires_at"] < time.time():
+            return None
+        return record["thoughts"]
+
+    def _sweep(self):
+        # Removes the files of expired thoughts, at most once per ttl and per worker
+        now = time.time()
+        if now - self._swept_at < self.ttl:
+            return
+        self._swept_at = now
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime < now - self.ttl:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    def _evict_expired(self):
+        # Entries are ordered by expiry, all have the same ttl
+        now = time.monotonic()
+        while self._entries and next(iter(self._entries.values()))[0] < now:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -1,28 +1,31 @@
 import logging
 from functools import wraps
-from typing import Any, Callable, Dict
+from typing import Any, Callable
 
 from quart import abort, current_app, request
 
-from config import CONFIG_AUTH_CLIENT, CONFIG_SEARCH_CLIENT
+from config import CONFIG_AUTH_CLIENT, CONFIG_DOCUMENT_ACL_MAP, CONFIG_SEARCH_CLIENT
 from core.authentication import AuthError
 from error import error_response
 
 
-def authenticated_path(route_fn: Callable[[str, Dict[str, Any]], Any]):
+def authenticated_path(route_fn: Callable[..., Any]):
     """
     Decorator for routes that request a specific file that might require access control enforcement
+    Further URL parameters of the route are passed through as keyword arguments after auth_claims
     """
 
     @wraps(route_fn)
-    async def auth_handler(path=""):
+    async def auth_handler(path="", **kwargs):
         # If authentication is enabled, validate the user can access the file
         auth_helper = current_app.config[CONFIG_AUTH_CLIENT]
         search_client = current_app.config[CONFIG_SEARCH_CLIENT]
         authorized = False
         try:
             auth_claims = await auth_helper.get_auth_claims_if_enabled(request.headers)
-            authorized = await auth_helper.check_path_auth(path, auth_claims, search_client)
+            authorized = await auth_helper.check_path_auth(
+                path, auth_claims, search_client, current_app.config.get(CONFIG_DOCUMENT_ACL_MAP)
+            )
         except AuthError:
             abort(403)
         except Exception as error:
@@ -32,24 +35,25 @@ def authenticated_path(route_fn: Callable[[str, Dict[str, Any]], Any]):
         if not authorized:
             abort(403)
 
-        return await route_fn(path, auth_claims)
+        return await route_fn(path, auth_claims, **kwargs)
 
     return auth_handler
 
 
-def authenticated(route_fn: Callable[[Dict[str, Any]], Any]):
+def authenticated(route_fn: Callable[..., Any]):
     """
     Decorator for routes that might require access control. Unpacks Authorization header information into an auth_claims dictionary
+    URL parameters of the route are passed through as keyword arguments after auth_claims
     """
 
     @wraps(route_fn)
-    async def auth_handler():
+    async def auth_handler(**kwargs):
         auth_helper = current_app.config[CONFIG_AUTH_CLIENT]
         try:
             auth_claims = await auth_helper.get_auth_claims_if_enabled(request.headers)
         except AuthError:
             abort(403)
 
-        return await route_fn(auth_claims)
+        return await route_fn(auth_claims, **kwargs)
 
     return auth_handler
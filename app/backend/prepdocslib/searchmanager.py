@@ -285,7 +285,7 @@
 import asyncio
 import logging
 import os
-from typing import List, Optional
+from typing import Callable, List, Optional
 
 from azure.search.documents.indexes.models import (
     HnswAlgorithmConfiguration,
@@ -330,6 +330,9 @@ class SearchManager:
     To learn more, please visit https://learn.microsoft.com/azure/search/search-what-is-azure-search
     """
 
+    # Called with the name of an index once its content changed, the app drops what it cached from that index
+    on_content_changed: Optional[Callable[[str], None]] = None
+
     def __init__(
         self,
         search_info: SearchInfo,
@@ -354,7 +357,8 @@ class SearchManager:
         async with self.search_info.create_search_index_client() as search_index_client:
             fields = [
                 (
-                    SimpleField(name="id", type="Edm.String", key=True)
+                    # Sortable and filterable so the app can page through the index by key, see DocumentAclMap
+                    SimpleField(name="id", type="Edm.String", key=True, sortable=True, filterable=True)
                     if not self.use_int_vectorization
                     else SearchField(
                         name="id",
@@ -532,6 +536,7 @@ class SearchManager:
                         document["imageEmbedding"] = image_embeddings[section.split_page.page_num]
 
                 await search_client.upload_documents(documents)
+        self.content_changed(index_name)
 
     async def remove_content(self, path: Optional[str] = None, only_oid: Optional[str] = None):
         logger.info(
@@ -566,3 +571,8 @@ class SearchManager:
                 logger.info("Removed %d sections from index", len(removed_docs))
                 # It can take a few seconds for search results to reflect changes, so wait a bit
                 await asyncio.sleep(2)
+        self.content_changed(self.search_info.index_name)
+
+    def content_changed(self, index_name: str):
+        if SearchManager.on_content_changed is not None:
+            SearchManager.on_content_changed(index_name)
@@ -1,6 +1,6 @@
 const BACKEND_URI = "";
 
-import { ChatAppResponse, ChatAppResponseOrError, ChatAppRequest, Config, SimpleAPIResponse } from "./models";
+import { ChatAppResponse, ChatAppResponseOrError, ChatAppRequest, Config, SimpleAPIResponse, Thoughts } from "./models";
 
 import { useLogin, appServicesToken } from "../authConfig";
 
@@ -64,6 +64,20 @@ export async function configApi(idToken: string | undefined): Promise<Config> {
   return (await response.json()) as Config;
 }
 
+// Thoughts of a response that was requested without them, see include_thoughts
+export async function thoughtsApi(thoughtsId: string, idToken: string | undefined): Promise<Thoughts[]> {
+  const response = await fetch(`${BACKEND_URI}/thoughts/${thoughtsId}`, {
+    method: "GET",
+    headers: getHeaders(idToken)
+  });
+
+  const parsedResponse = await response.json();
+  if (response.status > 299 || !response.ok) {
+    throw Error(parsedResponse.error || "Unknown error");
+  }
+  return parsedResponse.thoughts as Thoughts[];
+}
+
 export async function chatApi(
   request: ChatAppRequest,
   idToken: string | undefined
@@ -33,7 +33,9 @@ export type ChatAppRequestOverrides = {
     use_groups_security_filter?: boolean;
     use_gpt4v?: boolean;
     gpt4v_input?: GPT4VInput;
+    gpt4v_image_detail?: "auto" | "low" | "high";
     vector_fields: VectorFieldOptions[];
+    include_thoughts?: boolean;
 };
 
 export type ResponseMessage = {
@@ -50,7 +52,8 @@ export type Thoughts = {
 export type ResponseContext = {
     data_points: string[];
     followup_questions: string[] | null;
-    thoughts: Thoughts[];
+    thoughts?: Thoughts[];
+    thoughts_id?: string;
 };
 
 export type ResponseChoice = {
@@ -10,7 +10,7 @@ import {
 import styles from "./AnalysisPanel.module.css";
 
 import { SupportingContent } from "../SupportingContent";
-import { ChatAppResponse } from "../../api";
+import { ChatAppResponse, Thoughts, thoughtsApi } from "../../api";
 import { AnalysisPanelTabs } from "./AnalysisPanelTabs";
 import { ThoughtProcess } from "./ThoughtProcess";
 import { getHeaders } from "../../api";
@@ -50,7 +50,8 @@ export const AnalysisPanel = ({
   onCitationClicked
 }: Props) => {
   const isDisabledThoughtProcessTab: boolean =
-    !answer.choices[0].context.thoughts;
+    !answer.choices[0].context.thoughts &&
+    !answer.choices[0].context.thoughts_id;
   const isDisabledSupportingContentTab: boolean =
     !answer.choices[0].context.data_points;
   const isDisabledCitationTab: boolean = !activeCitation;
@@ -59,6 +60,17 @@ export const AnalysisPanel = ({
   const [downloadProgress, setDownloadProgress] = useState(7);
   const [hasDownloaded, setHasDownloaded] = useState(false);
   const [fileFormat, setFileFormat] = useState("pdf");
+  // Answers leave out their thoughts unless asked for, they are fetched when the tab is opened
+  const [fetchedThoughts, setFetchedThoughts] = useState<{
+    id: string;
+    thoughts: Thoughts[];
+  }>();
+  const { thoughts, thoughts_id } = answer.choices[0].context;
+  const shownThoughts =
+    thoughts ||
+    (fetchedThoughts && fetchedThoughts.id === thoughts_id
+      ? fetchedThoughts.thoughts
+      : []);
 
   const client = useLogin ? useMsal().instance : undefined;
   const fileIsNotPDF = fileFormat !== "pdf";
@@ -176,6 +188,29 @@ export const AnalysisPanel = ({
     }
   };
 
+  const fetchThoughts = async (thoughtsId: string) => {
+    const token = client ? await getToken(client) : undefined;
+    let fetched: Thoughts[] = [];
+    try {
+      fetched = await thoughtsApi(thoughtsId, token);
+    } catch (e) {
+      // Thoughts expire after a few minutes on the server
+      console.log("Could not fetch thoughts:", e);
+    }
+    setFetchedThoughts({ id: thoughtsId, thoughts: fetched });
+  };
+
+  useEffect(() => {
+    if (
+      activeTab === AnalysisPanelTabs.ThoughtProcessTab &&
+      !thoughts &&
+      thoughts_id &&
+      fetchedThoughts?.id !== thoughts_id
+    ) {
+      fetchThoughts(thoughts_id);
+    }
+  }, [activeTab, thoughts_id]);
+
   function removeContentPath(contentPath: string) {
     return contentPath.replace(/\/content\//, "");
   }
@@ -230,7 +265,7 @@ export const AnalysisPanel = ({
             isDisabledThoughtProcessTab ? pivotItemDisabledStyle : undefined
           }
         >
-          <ThoughtProcess thoughts={answer.choices[0].context.thoughts || []} />
+          <ThoughtProcess thoughts={shownThoughts} />
         </PivotItem>
         <PivotItem
           itemKey={AnalysisPanelTabs.SupportingContentTab}
@@ -23,7 +23,21 @@ from openai.types.create_embedding_response import Usage
 
 import app
 import core
-from core.authentication import AuthenticationHelper
+from approaches.approach import Approach
+from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
+from core.authentication import (
+    AuthClaimsCache,
+    AuthenticationHelper,
+    GroupMembershipCache,
+    JwksCache,
+)
+from core.embeddingbatcher import EmbeddingBatcher
+from core.embeddingcache import EmbeddingCache
+from core.pageimagecache import PageImageCache
+from core.querycache import QueryRewriteCache
+from core.retrievalcache import RetrievalCache
+from core.thoughtsstore import ThoughtsStore
+from prepdocslib.searchmanager import SearchManager
 
 from .mocks import (
     MockAsyncPageIterator,
@@ -149,6 +163,15 @@ def mock_openai_chatcompletion(monkeypatch):
                         "created": 1,
                     }
                 )
+                self.responses.append(
+                    {
+                        "object": "chat.completion.chunk",
+                        "choices": [{"delta": {"role": None, "content": None}, "index": 0, "finish_reason": "stop"}],
+                        "id": chunk_id,
+                        "model": model,
+                        "created": 1,
+                    }
+                )
 
         def __aiter__(self):
             return self
@@ -242,6 +265,7 @@ auth_envs = [
         "AZURE_OPENAI_CHATGPT_DEPLOYMENT": "test-chatgpt",
         "AZURE_OPENAI_EMB_DEPLOYMENT": "test-ada",
         "AZURE_USE_AUTHENTICATION": "true",
+        "AZURE_SEARCH_SCHEMA_CACHE_TTL": "0",
         "AZURE_USER_STORAGE_ACCOUNT": "test-user-storage-account",
         "AZURE_USER_STORAGE_CONTAINER": "test-user-storage-container",
         "AZURE_SERVER_APP_ID": "SERVER_APP",
@@ -258,6 +282,7 @@ auth_public_envs = [
         "AZURE_OPENAI_CHATGPT_DEPLOYMENT": "test-chatgpt",
         "AZURE_OPENAI_EMB_DEPLOYMENT": "test-ada",
         "AZURE_USE_AUTHENTICATION": "true",
+        "AZURE_SEARCH_SCHEMA_CACHE_TTL": "0",
         "AZURE_ENABLE_GLOBAL_DOCUMENT_ACCESS": "true",
         "AZURE_ENABLE_UNAUTHENTICATED_ACCESS": "true",
         "AZURE_USER_STORAGE_ACCOUNT": "test-user-storage-account",
@@ -271,7 +296,7 @@ auth_public_envs = [
 
 
 @pytest.fixture(params=envs, ids=["client0", "client1"])
-def mock_env(monkeypatch, request):
+def mock_env(monkeypatch, request, tmp_path):
     with mock.patch.dict(os.environ, clear=True):
         monkeypatch.setenv("AZURE_STORAGE_ACCOUNT", "test-storage-account")
         monkeypatch.setenv("AZURE_STORAGE_CONTAINER", "test-storage-container")
@@ -279,6 +304,11 @@ def mock_env(monkeypatch, request):
         monkeypatch.setenv("AZURE_SUBSCRIPTION_ID", "test-storage-subid")
         monkeypatch.setenv("AZURE_SEARCH_INDEX", "test-search-index")
         monkeypatch.setenv("AZURE_SEARCH_SERVICE", "test-search-service")
+        monkeypatch.setenv("CONTENT_CACHE_DIR", str(tmp_path / "content-cache"))
+        monkeypatch.setenv("THOUGHTS_DIR", str(tmp_path / "thoughts"))
+        monkeypatch.setenv("AZURE_SEARCH_ACL_SNAPSHOT_PATH", str(tmp_path / "document-acls.json"))
+        # The snapshots include the thoughts
+        monkeypatch.setenv("INCLUDE_THOUGHTS", "true")
         monkeypatch.setenv("AZURE_OPENAI_CHATGPT_MODEL", "gpt-35-turbo")
         monkeypatch.setenv("ALLOWED_ORIGIN", "https://frontend.com")
         for key, value in request.param.items():
@@ -320,11 +350,17 @@ async def auth_client(
     mock_list_groups_success,
     mock_acs_search_filter,
     request,
+    tmp_path,
 ):
     monkeypatch.setenv("AZURE_STORAGE_ACCOUNT", "test-storage-account")
     monkeypatch.setenv("AZURE_STORAGE_CONTAINER", "test-storage-container")
     monkeypatch.setenv("AZURE_SEARCH_INDEX", "test-search-index")
     monkeypatch.setenv("AZURE_SEARCH_SERVICE", "test-search-service")
+    monkeypatch.setenv("CONTENT_CACHE_DIR", str(tmp_path / "content-cache"))
+    monkeypatch.setenv("THOUGHTS_DIR", str(tmp_path / "thoughts"))
+    monkeypatch.setenv("AZURE_SEARCH_ACL_SNAPSHOT_PATH", str(tmp_path / "document-acls.json"))
+    # The snapshots include the thoughts
+    monkeypatch.setenv("INCLUDE_THOUGHTS", "true")
     monkeypatch.setenv("AZURE_OPENAI_CHATGPT_MODEL", "gpt-35-turbo")
     monkeypatch.setenv("USE_USER_UPLOAD", "true")
     monkeypatch.setenv("AZURE_USERSTORAGE_ACCOUNT", "test-userstorage-account")
@@ -359,11 +395,17 @@ async def auth_public_documents_client(
     mock_list_groups_success,
     mock_acs_search_filter,
     request,
+    tmp_path,
 ):
     monkeypatch.setenv("AZURE_STORAGE_ACCOUNT", "test-storage-account")
     monkeypatch.setenv("AZURE_STORAGE_CONTAINER", "test-storage-container")
     monkeypatch.setenv("AZURE_SEARCH_INDEX", "test-search-index")
     monkeypatch.setenv("AZURE_SEARCH_SERVICE", "test-search-service")
+    monkeypatch.setenv("CONTENT_CACHE_DIR", str(tmp_path / "content-cache"))
+    monkeypatch.setenv("THOUGHTS_DIR", str(tmp_path / "thoughts"))
+    monkeypatch.setenv("AZURE_SEARCH_ACL_SNAPSHOT_PATH", str(tmp_path / "document-acls.json"))
+    # The snapshots include the thoughts
+    monkeypatch.setenv("INCLUDE_THOUGHTS", "true")
     monkeypatch.setenv("AZURE_OPENAI_CHATGPT_MODEL", "gpt-35-turbo")
     monkeypatch.setenv("USE_USER_UPLOAD", "true")
     monkeypatch.setenv("AZURE_USERSTORAGE_ACCOUNT", "test-userstorage-account")
@@ -396,6 +438,28 @@ def mock_validate_token_success(monkeypatch):
     monkeypatch.setattr(core.authentication.AuthenticationHelper, "validate_access_token", mock_validate_access_token)
 
 
+@pytest.fixture(autouse=True)
+def reset_auth_caches(monkeypatch):
+    # The auth caches are shared by the whole process, don't let one test's users and keys leak into the next
+    monkeypatch.setattr(GroupMembershipCache, "_caches", {})
+    monkeypatch.setattr(JwksCache, "_caches", {})
+    monkeypatch.setattr(AuthClaimsCache, "_caches", {})
+    monkeypatch.setattr(AuthenticationHelper, "_confidential_clients", {})
+
+
+@pytest.fixture(autouse=True)
+def reset_approach_caches(monkeypatch):
+    monkeypatch.setattr(Approach, "embedding_cache", EmbeddingCache())
+    monkeypatch.setattr(Approach, "embedding_batcher", EmbeddingBatcher())
+    monkeypatch.setattr(Approach, "page_image_cache", PageImageCache())
+    monkeypatch.setattr(Approach, "retrieval_cache", RetrievalCache())
+    monkeypatch.setattr(Approach, "thoughts_store", ThoughtsStore())
+    monkeypatch.setattr(Approach, "include_thoughts_by_default", False)
+    monkeypatch.setattr(Approach, "image_detail", "auto")
+    monkeypatch.setattr(ChatReadRetrieveReadApproach, "query_rewrite_cache", QueryRewriteCache())
+    monkeypatch.setattr(SearchManager, "on_content_changed", None)
+
+
 @pytest.fixture
 def mock_confidential_client_success(monkeypatch):
     def mock_acquire_token_on_behalf_of(self, *args, **kwargs):
@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+from core.answercache import (
+    AnswerCache,
+    is_complete_answer,
+    record_stream,
+    replay_stream,
+)
+
+
+def answer(content: str, followup_questions=None) -> dict:
+    context = {"data_points": {"text": ["a.pdf: A"]}, "thoughts_id": "THOUGHTS"}
+    if followup_questions:
+        context["followup_questions"] = followup_questions
+    return {
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "context": context,
+                "session_state": "first",
+            }
+        ]
+    }
+
+
+def test_answer_cache_key_normalizes_conversation():
+    key = AnswerCache.key("index", "Chat", [{"role": "user", "content": "What is  the policy?"}], None, {})
+    assert key == AnswerCache.key("index", "Chat", [{"role": "user", "content": "what is the policy? "}], None, {})
+    assert key != AnswerCache.key("index", "Chat", [{"role": "user", "content": "What is the policy?"}], "oids/any", {})
+    assert key != AnswerCache.key(
+        "index", "Chat", [{"role": "user", "content": "What is the policy?"}], None, {"top": 5}
+    )
+    assert key != AnswerCache.key("other", "Chat", [{"role": "user", "content": "What is the policy?"}], None, {})
+
+
+def test_answer_cache_get_put_invalidate(monkeypatch):
+    cache = AnswerCache(ttl=60)
+    cache.put("k1", "index1", answer("Paris"))
+    cache.put("k2", "index2", answer("Madrid"))
+
+    cached = cache.get("k1", session_state="second")
+    assert cached["choices"][0]["message"]["content"] == "Paris"
+    assert cached["choices"][0]["session_state"] == "second"
+    assert "thoughts_id" not in cached["choices"][0]["context"]
+
+    cache.invalidate("index1")
+    assert cache.get("k1") is None
+    assert cache.get("k2") is not None
+
+    later = time.monotonic() + 61
+    monkeypatch.setattr(time, "monotonic", lambda: later)
+    assert cache.get("k2") is None
+    assert len(cache) == 0
+    assert cache.hits == 2 and cache.misses == 2
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_records_and_replays_streams():
+    cache = AnswerCache()
+
+    async def events():
+        yield {"choices": [{"delta": {"role": "assistant"}, "context": {"data_points": {}}, "session_state": "s"}]}
+        yield {"choices": [{"delta": {"content": "The capital "}, "finish_reason": None, "index": 0}]}
+        yield {"choices": [{"delta": {"content": "is Paris."}, "finish_reason": "stop", "index": 0}]}
+        yield {"choices": [{"delta": {"role": "assistant"}, "context": {"followup_questions": ["And Spain?"]}}]}
+
+    streamed = [event async for event in record_stream(events(), lambda response: cache.put("k", "index", response))]
+    assert len(streamed) == 4
+    cached = cache.get("k")
+    assert is_complete_answer(cached)
+    assert cached["choices"][0]["message"]["content"] == "The capital is Paris."
+    assert cached["choices"][0]["context"] == {"data_points": {}, "followup_questions": ["And Spain?"]}
+
+    replayed = [event async for event in replay_stream(cached)]
+    assert replayed[0]["choices"][0]["context"] == {"data_points": {}}
+    assert replayed[1]["choices"][0]["delta"]["content"] == "The capital is Paris."
+    assert replayed[2]["choices"][0]["context"] == {"followup_questions": ["And Spain?"]}
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_skips_truncated_streams():
+    recorded = []
+
+    async def events():
+        yield {"choices": [{"delta": {"role": "assistant"}, "context": {"data_points": {}}, "session_state": "s"}]}
+        yield {"choices": [{"delta": {"content": "The capital "}, "finish_reason": None, "index": 0}]}
+        yield {"choices": [{"delta": {"content": "is"}, "finish_reason": "length", "index": 0}]}
+
+    assert len([event async for event in record_stream(events(), recorded.append)]) == 3
+    assert recorded[0]["choices"][0]["finish_reason"] == "length"
+    assert not is_complete_answer(recorded[0])
+    assert not is_complete_answer({"choices": [{"message": {"content": ""}, "finish_reason": "content_filter"}]})
+    assert is_complete_answer({"choices": [{**answer("Paris")["choices"][0], "finish_reason": "stop"}]})
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import logging
 import os
@@ -361,6 +362,34 @@ async def test_chat_text(client, snapshot):
     snapshot.assert_match(json.dumps(result, indent=4), "result.json")
 
 
+@pytest.mark.asyncio
+async def test_chat_tenant_text(client, snapshot):
+    response = await client.post(
+        "/chat/Phelps",
+        json={
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {
+                "overrides": {"retrieval_mode": "text"},
+            },
+        },
+    )
+    assert response.status_code == 200
+    result = await response.get_json()
+    snapshot.assert_match(json.dumps(result, indent=4), "result.json")
+    tenant_registry = client.app.config[app.CONFIG_TENANT_REGISTRY]
+    assert "Phelps" in tenant_registry
+    assert (await tenant_registry.get("Phelps")).index_name == "test-search-index-phelps"
+
+
+@pytest.mark.asyncio
+async def test_chat_tenant_invalid_name(client):
+    response = await client.post(
+        "/chat/..%2Fsecrets",
+        json={"messages": [{"content": "What is the capital of France?", "role": "user"}]},
+    )
+    assert response.status_code == 404
+
+
 @pytest.mark.asyncio
 async def test_chat_text_filter(auth_client, snapshot):
     response = await auth_client.post(
@@ -509,6 +538,143 @@ async def test_chat_vector(client, snapshot):
     snapshot.assert_match(json.dumps(result, indent=4), "result.json")
 
 
+@pytest.mark.asyncio
+async def test_chat_thoughts_fetched_later(client):
+    response = await client.post(
+        "/chat",
+        json={
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {
+                "overrides": {"retrieval_mode": "text", "include_thoughts": False},
+            },
+        },
+    )
+    assert response.status_code == 200
+    result = await response.get_json()
+    context = result["choices"][0]["context"]
+    assert "thoughts" not in context
+    assert context["data_points"]
+
+    response = await client.get(f"/thoughts/{context['thoughts_id']}")
+    assert response.status_code == 200
+    thoughts = (await response.get_json())["thoughts"]
+    assert [thought["title"] for thought in thoughts] == [
+        "Prompt to generate search query",
+        "Search using generated search query",
+        "Search results",
+        "Prompt to generate answer",
+    ]
+
+    response = await client.get("/thoughts/unknown")
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_chat_answer_cache(client, monkeypatch):
+    client.app.config[app.CONFIG_ANSWER_CACHE] = app.AnswerCache()
+    request_json = {
+        "stream": True,
+        "messages": [{"content": "What is the capital of France?", "role": "user"}],
+        "context": {"overrides": {"retrieval_mode": "text"}},
+    }
+    response = await client.post("/chat", json=request_json)
+    assert response.status_code == 200
+    streamed = [json.loads(line) for line in (await response.get_data()).splitlines()]
+
+    async def mock_create(*args, **kwargs):
+        raise AssertionError("Cached answers don't call OpenAI")
+
+    monkeypatch.setattr(client.app.config[app.CONFIG_OPENAI_CLIENT].chat.completions, "create", mock_create)
+    response = await client.post("/chat", json=request_json)
+    assert response.status_code == 200
+    replayed = [json.loads(line) for line in (await response.get_data()).splitlines()]
+    assert replayed[0]["choices"][0]["context"] == streamed[0]["choices"][0]["context"]
+    assert "".join(event["choices"][0]["delta"].get("content") or "" for event in replayed) == "".join(
+        event["choices"][0]["delta"].get("content") or "" for event in streamed
+    )
+
+    response = await client.post("/chat", json={**request_json, "stream": False})
+    assert response.status_code == 200
+    result = await response.get_json()
+    assert result["choices"][0]["message"]["content"] == "The capital of France is Paris. [Benefit_Options-2.pdf]."
+
+
+@pytest.mark.asyncio
+async def test_chat_coalesced_answer_cached_once(client, monkeypatch):
+    client.app.config[app.CONFIG_ANSWER_CACHE] = app.AnswerCache()
+    client.app.config[app.CONFIG_REQUEST_COALESCER] = app.RequestCoalescer()
+    puts = []
+    monkeypatch.setattr(app.AnswerCache, "put", lambda self, *args: puts.append(args))
+    request_json = {
+        "stream": True,
+        "messages": [{"content": "What is the capital of France?", "role": "user"}],
+        "context": {"overrides": {"retrieval_mode": "text"}},
+    }
+
+    responses = await asyncio.gather(*(client.post("/chat", json=request_json) for _ in range(3)))
+    answers = [await response.get_data() for response in responses]
+    assert answers[1] == answers[0] and answers[2] == answers[0]
+    assert len(puts) == 1
+
+
+@pytest.mark.asyncio
+async def test_chat_semantic_answer_cache(client, monkeypatch):
+    client.app.config[app.CONFIG_SEMANTIC_ANSWER_CACHE] = app.SemanticAnswerCache(threshold=0.95)
+    response = await client.post(
+        "/chat",
+        json={"messages": [{"content": "What is the capital of France?", "role": "user"}]},
+    )
+    assert response.status_code == 200
+    answer = (await response.get_json())["choices"][0]["message"]["content"]
+
+    async def mock_create(*args, **kwargs):
+        raise AssertionError("Cached answers don't call OpenAI for a completion")
+
+    monkeypatch.setattr(client.app.config[app.CONFIG_OPENAI_CLIENT].chat.completions, "create", mock_create)
+    # The mocked embeddings are the same for every question
+    response = await client.post(
+        "/chat",
+        json={"messages": [{"content": "Which city is the capital of France?", "role": "user"}]},
+    )
+    assert response.status_code == 200
+    assert (await response.get_json())["choices"][0]["message"]["content"] == answer
+    assert client.app.config[app.CONFIG_SEMANTIC_ANSWER_CACHE].hits == 1
+
+
+@pytest.mark.asyncio
+async def test_chat_semantic_answer_cache_skipped(client, monkeypatch):
+    semantic_cache = app.SemanticAnswerCache(threshold=0.95)
+    client.app.config[app.CONFIG_SEMANTIC_ANSWER_CACHE] = semantic_cache
+    compute_text_embedding = app.Approach.compute_text_embedding
+    embedded = []
+
+    async def mock_compute_text_embedding(self, q):
+        embedded.append(q)
+        if len(embedded) == 1:
+            raise ValueError("Embedding deployment unavailable")
+        return await compute_text_embedding(self, q)
+
+    monkeypatch.setattr(app.Approach, "compute_text_embedding", mock_compute_text_embedding)
+    # Text retrieval doesn't embed the question just for the cache
+    response = await client.post(
+        "/chat",
+        json={
+            "messages": [{"content": "What is the capital of France?", "role": "user"}],
+            "context": {"overrides": {"retrieval_mode": "text"}},
+        },
+    )
+    assert response.status_code == 200
+    assert embedded == []
+
+    # A failed embedding only skips the cache
+    response = await client.post(
+        "/chat", json={"messages": [{"content": "What is the capital of France?", "role": "user"}]}
+    )
+    assert response.status_code == 200
+    assert len(embedded) == 2
+    assert (semantic_cache.hits, semantic_cache.misses) == (0, 0)
+
+
 @pytest.mark.asyncio
 async def test_chat_stream_text(client, snapshot):
     response = await client.post(
@@ -744,4 +910,4 @@ async def test_format_as_ndjson():
         yield {"b": "Newlines inside \n strings are fine"}
 
     result = [line async for line in app.format_as_ndjson(gen())]
-    assert result == ['{"a": "I ❤️ 🐍"}\n', '{"b": "Newlines inside \\n strings are fine"}\n']
+    assert result == ['{"a":"I ❤️ 🐍"}\n'.encode(), b'{"b":"Newlines inside \\n strings are fine"}\n']
@@ -1,13 +1,27 @@
+import asyncio
 import json
+import threading
+import time
 
+import aiohttp
+import msal
 import pytest
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents.aio import SearchClient
 from azure.search.documents.indexes.models import SearchField, SearchIndex
+from jose import jwt
+
+from core.authentication import (
+    AuthClaimsCache,
+    AuthenticationHelper,
+    AuthError,
+    GroupAliases,
+    GroupMembershipCache,
+    JwksCache,
+)
+from core.documentacl import DocumentAclMap
 
-from core.authentication import AuthenticationHelper, AuthError
-
-from .mocks import MockAsyncPageIterator
+from .mocks import MockAsyncPageIterator, MockResponse
 
 MockSearchIndex = SearchIndex(
     name="test",
@@ -48,6 +62,82 @@ async def test_get_auth_claims_success(mock_confidential_client_success, mock_va
     assert auth_claims.get("groups") == ["GROUP_Y", "GROUP_Z"]
 
 
+@pytest.mark.asyncio
+async def test_on_behalf_of_runs_off_loop_with_shared_client(
+    monkeypatch, mock_confidential_client_success, mock_validate_token_success
+):
+    helper = create_authentication_helper()
+    other_tenant_helper = create_authentication_helper(require_access_control=True)
+    assert helper.confidential_client is other_tenant_helper.confidential_client
+
+    threads = []
+
+    def mock_acquire_token_on_behalf_of(self, *args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return {"access_token": "MockToken", "id_token_claims": {"oid": "OID_X", "groups": ["GROUP_Y"]}}
+
+    monkeypatch.setattr(
+        msal.ConfidentialClientApplication, "acquire_token_on_behalf_of", mock_acquire_token_on_behalf_of
+    )
+    auth_claims = await helper.get_auth_claims_if_enabled(headers={"Authorization": "Bearer Token"})
+    assert auth_claims.get("groups") == ["GROUP_Y"]
+    assert len(threads) == 1 and threads[0].startswith("obo")
+
+
+def create_token(expires_in: float, oid: str = "OID_X") -> str:
+    return jwt.encode({"oid": oid, "exp": int(time.time() + expires_in)}, "secret", algorithm="HS256")
+
+
+@pytest.mark.asyncio
+async def test_get_auth_claims_cached(monkeypatch, mock_confidential_client_success):
+    validated_tokens = []
+
+    async def mock_validate_access_token(self, token):
+        validated_tokens.append(token)
+
+    monkeypatch.setattr(AuthenticationHelper, "validate_access_token", mock_validate_access_token)
+    helper = create_authentication_helper()
+    helper.auth_claims_cache = AuthClaimsCache()
+    token = create_token(expires_in=3600)
+
+    auth_claims = await helper.get_auth_claims_if_enabled(headers={"Authorization": f"Bearer {token}"})
+    auth_claims["groups"].append("MUTATED_BY_CALLER")
+    auth_claims = await helper.get_auth_claims_if_enabled(headers={"Authorization": f"Bearer {token}"})
+    assert auth_claims == {"oid": "OID_X", "groups": ["GROUP_Y", "GROUP_Z"]}
+    assert validated_tokens == [token]
+
+    other_token = create_token(expires_in=3600, oid="OID_Q")
+    await helper.get_auth_claims_if_enabled(headers={"Authorization": f"Bearer {other_token}"})
+    assert validated_tokens == [token, other_token]
+
+
+def test_auth_claims_cache_expiry():
+    auth_claims_cache = AuthClaimsCache(expiry_margin=60)
+    expiring_token = create_token(expires_in=30)
+    auth_claims_cache.put(expiring_token, {"oid": "OID_X"})
+    assert auth_claims_cache.get(expiring_token) is None
+
+    # Tokens that aren't JWTs with an expiry are never cached
+    auth_claims_cache.put("MockToken", {"oid": "OID_X"})
+    assert auth_claims_cache.get("MockToken") is None
+
+    token = create_token(expires_in=3600)
+    auth_claims_cache.put(token, {"oid": "OID_X"})
+    assert auth_claims_cache.get(token) == {"oid": "OID_X"}
+    auth_claims_cache._entries[AuthClaimsCache._key(token)] = (time.time() - 1, {"oid": "OID_X"})
+    assert auth_claims_cache.get(token) is None
+
+
+def test_auth_claims_cache_is_bounded():
+    auth_claims_cache = AuthClaimsCache(max_entries=2)
+    tokens = [create_token(expires_in=3600, oid=f"OID_{i}") for i in range(3)]
+    for token in tokens:
+        auth_claims_cache.put(token, {"oid": token})
+    assert auth_claims_cache.get(tokens[0]) is None
+    assert auth_claims_cache.get(tokens[1]) is not None
+    assert auth_claims_cache.get(tokens[2]) is not None
+
+
 @pytest.mark.asyncio
 async def test_get_auth_claims_unauthorized(mock_confidential_client_unauthorized, mock_validate_token_success):
     helper = create_authentication_helper()
@@ -74,6 +164,47 @@ async def test_get_auth_claims_overage_unauthorized(
     assert len(auth_claims.keys()) == 0
 
 
+@pytest.mark.asyncio
+async def test_groups_cache_single_flight(monkeypatch):
+    calls = []
+
+    async def mock_list_groups(graph_resource_access_token, session=None):
+        calls.append(graph_resource_access_token["access_token"])
+        await asyncio.sleep(0.01)
+        return ["GROUP_Y"]
+
+    monkeypatch.setattr(AuthenticationHelper, "list_groups", mock_list_groups)
+    cache = GroupMembershipCache(ttl=60)
+    results = await asyncio.gather(
+        cache.get_groups("OID_X", {"access_token": "Token1"}), cache.get_groups("OID_X", {"access_token": "Token2"})
+    )
+    assert results == [["GROUP_Y"], ["GROUP_Y"]]
+    # A new access token for the same user still hits the cache
+    assert await cache.get_groups("OID_X", {"access_token": "Token3"}) == ["GROUP_Y"]
+    assert calls == ["Token1"]
+
+    await cache.get_groups("OID_W", {"access_token": "Token4"})
+    assert calls == ["Token1", "Token4"]
+    await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_groups_cache_expiry(monkeypatch):
+    calls = []
+
+    async def mock_list_groups(graph_resource_access_token, session=None):
+        calls.append(graph_resource_access_token["access_token"])
+        return ["GROUP_Y"]
+
+    monkeypatch.setattr(AuthenticationHelper, "list_groups", mock_list_groups)
+    cache = GroupMembershipCache(ttl=60)
+    await cache.get_groups("OID_X", {"access_token": "Token1"})
+    monkeypatch.setattr(time, "monotonic", lambda: time.time() + 3600 * 24 * 365)
+    await cache.get_groups("OID_X", {"access_token": "Token2"})
+    assert calls == ["Token1", "Token2"]
+    await cache.close()
+
+
 @pytest.mark.asyncio
 async def test_list_groups_success(mock_list_groups_success, mock_validate_token_success):
     groups = await AuthenticationHelper.list_groups(graph_resource_access_token={"access_token": "MockToken"})
@@ -229,6 +360,38 @@ def test_build_security_filters(mock_confidential_client_success, mock_validate_
     )
 
 
+def test_build_security_filters_cached(mock_confidential_client_success, mock_validate_token_success):
+    auth_helper = create_authentication_helper(require_access_control=True)
+    auth_helper.max_security_filters = 2
+    auth_claims = {"oid": "OID_X", "groups": ["GROUP_Y", "GROUP_Z"]}
+    security_filter = auth_helper.build_security_filters(overrides={}, auth_claims=auth_claims)
+    assert auth_helper.build_security_filters(overrides={}, auth_claims=dict(auth_claims)) is security_filter
+    assert (
+        auth_helper.build_security_filters(overrides={}, auth_claims={"oid": "OID_X", "groups": ["GROUP_Y"]})
+        == "(oids/any(g:search.in(g, 'OID_X')) or groups/any(g:search.in(g, 'GROUP_Y')))"
+    )
+    auth_helper.build_security_filters(overrides={}, auth_claims={"oid": "OID_W"})
+    assert len(auth_helper._security_filters) == 2
+
+
+def test_build_security_filters_group_aliases(mock_confidential_client_success, mock_validate_token_success):
+    auth_helper = create_authentication_helper(require_access_control=True)
+    auth_helper.group_aliases = GroupAliases(
+        {"ALIAS_ENG": ["GROUP_A", "GROUP_B", "GROUP_C"], "ALIAS_SALES": ["GROUP_D", "GROUP_OTHER"]}, min_groups=3
+    )
+    assert (
+        auth_helper.build_security_filters(
+            overrides={}, auth_claims={"oid": "OID_X", "groups": ["GROUP_A", "GROUP_B", "GROUP_C", "GROUP_D"]}
+        )
+        == "(oids/any(g:search.in(g, 'OID_X')) or groups/any(g:search.in(g, 'ALIAS_ENG, GROUP_D')))"
+    )
+    # Small group sets are left as they are
+    assert (
+        auth_helper.build_security_filters(overrides={}, auth_claims={"oid": "OID_X", "groups": ["GROUP_A", "GROUP_B"]})
+        == "(oids/any(g:search.in(g, 'OID_X')) or groups/any(g:search.in(g, 'GROUP_A, GROUP_B')))"
+    )
+
+
 @pytest.mark.asyncio
 async def test_check_path_auth_denied(monkeypatch, mock_confidential_client_success, mock_validate_token_success):
     auth_helper_require_access_control = create_authentication_helper(require_access_control=True)
@@ -255,6 +418,42 @@ async def test_check_path_auth_denied(monkeypatch, mock_confidential_client_succ
     )
 
 
+@pytest.mark.asyncio
+async def test_check_path_auth_acl_map(monkeypatch, mock_confidential_client_success, mock_validate_token_success):
+    auth_helper_require_access_control = create_authentication_helper(require_access_control=True)
+    filters = []
+
+    async def mock_search(self, *args, **kwargs):
+        filters.append(kwargs.get("filter"))
+        if kwargs.get("select"):
+            return MockAsyncPageIterator(
+                data=[{"id": "1", "sourcefile": "Benefit_Options.pdf", "oids": [], "groups": ["GROUP_Y"]}]
+            )
+        return MockAsyncPageIterator(data=[])
+
+    monkeypatch.setattr(SearchClient, "search", mock_search)
+    acl_map = DocumentAclMap(create_search_client())
+    await acl_map.refresh()
+    filters.clear()
+
+    assert await auth_helper_require_access_control.check_path_auth(
+        path="Benefit_Options.pdf#page=2",
+        auth_claims={"oid": "OID_X", "groups": ["GROUP_Y", "GROUP_Z"]},
+        search_client=create_search_client(),
+        acl_map=acl_map,
+    )
+    assert filters == []
+
+    # Denials are confirmed by the index, access may have been granted since the map was loaded
+    assert not await auth_helper_require_access_control.check_path_auth(
+        path="Benefit_Options.pdf",
+        auth_claims={"oid": "OID_X", "groups": ["GROUP_Z"]},
+        search_client=create_search_client(),
+        acl_map=acl_map,
+    )
+    assert len(filters) == 1
+
+
 @pytest.mark.asyncio
 async def test_check_path_auth_allowed_sourcepage(
     monkeypatch, mock_confidential_client_success, mock_validate_token_success
@@ -479,3 +678,88 @@ async def test_check_path_auth_allowed_public_without_access_control(
     )
     assert filter is None
     assert called_search is False
+
+
+def mock_jwks_endpoint(monkeypatch, key_sets):
+    """Serves the given key sets in order, one per request, and returns the list of requested URLs."""
+    requested_urls = []
+
+    def mock_get(self, url, **kwargs):
+        requested_urls.append(url)
+        return MockResponse(
+            text=json.dumps({"keys": key_sets[min(len(requested_urls), len(key_sets)) - 1]}), status=200
+        )
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", mock_get)
+    return requested_urls
+
+
+@pytest.mark.asyncio
+async def test_jwks_cache_reuses_keys(monkeypatch):
+    requested_urls = mock_jwks_endpoint(monkeypatch, [[{"kid": "KEY_1"}]])
+    jwks_cache = JwksCache("https://keys")
+
+    assert await jwks_cache.get_key("KEY_1") == {"kid": "KEY_1"}
+    assert await jwks_cache.get_key("KEY_1") == {"kid": "KEY_1"}
+    assert requested_urls == ["https://keys"]
+
+
+@pytest.mark.asyncio
+async def test_jwks_cache_refreshes_on_unknown_kid(monkeypatch):
+    requested_urls = mock_jwks_endpoint(monkeypatch, [[{"kid": "KEY_1"}], [{"kid": "KEY_1"}, {"kid": "KEY_2"}]])
+    jwks_cache = JwksCache("https://keys", min_refresh_interval=0)
+
+    await jwks_cache.get_key("KEY_1")
+    assert await jwks_cache.get_key("KEY_2") == {"kid": "KEY_2"}
+    assert len(requested_urls) == 2
+
+
+@pytest.mark.asyncio
+async def test_jwks_cache_limits_unknown_kid_refreshes(monkeypatch):
+    requested_urls = mock_jwks_endpoint(monkeypatch, [[{"kid": "KEY_1"}]])
+    jwks_cache = JwksCache("https://keys", min_refresh_interval=300)
+
+    await jwks_cache.get_key("KEY_1")
+    assert await jwks_cache.get_key("FORGED_KEY") is None
+    assert len(requested_urls) == 1
+
+
+@pytest.mark.asyncio
+async def test_jwks_cache_serves_stale_keys_while_refreshing(monkeypatch):
+    requested_urls = mock_jwks_endpoint(monkeypatch, [[{"kid": "KEY_1"}], [{"kid": "KEY_2"}]])
+    jwks_cache = JwksCache("https://keys", ttl=0)
+
+    await jwks_cache.get_key("KEY_1")
+    # The TTL has passed, the stale key is returned and a refresh starts in the background
+    assert await jwks_cache.get_key("KEY_1") == {"kid": "KEY_1"}
+    await jwks_cache._refresh_task
+    assert len(requested_urls) == 2
+    assert await jwks_cache.get_key("KEY_2") == {"kid": "KEY_2"}
+    assert len(requested_urls) == 2
+
+
+@pytest.mark.asyncio
+async def test_jwks_cache_doesnt_retry_on_the_request_path(monkeypatch):
+    requested_urls = mock_jwks_endpoint(monkeypatch, [[{"kid": "KEY_1"}]])
+    jwks_cache = JwksCache("https://keys", min_refresh_interval=0)
+    await jwks_cache.get_key("KEY_1")
+
+    def mock_get_failing(self, url, **kwargs):
+        requested_urls.append(url)
+        return MockResponse(text="Service unavailable", status=503)
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", mock_get_failing)
+    background_fetches = []
+    monkeypatch.setattr(JwksCache, "_fetch", lambda self: background_fetches.append(1) or asyncio.sleep(0))
+    # A single attempt, then the request goes on with the stale keys and the retries happen in the background
+    assert await jwks_cache.get_key("KEY_2") is None
+    assert await jwks_cache.get_key("KEY_1") == {"kid": "KEY_1"}
+    assert len(requested_urls) == 2
+    await jwks_cache._refresh_task
+    assert background_fetches == [1]
+
+
+def test_jwks_cache_is_shared_per_key_url(mock_confidential_client_success):
+    helper = create_authentication_helper()
+    assert helper.jwks_cache is create_authentication_helper().jwks_cache
+    assert helper.jwks_cache.key_url == "https://login.microsoftonline.com/TENANT_ID/discovery/v2.0/keys"
@@ -0,0 +1,75 @@
+import base64
+from datetime import timedelta
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from azure.storage.blob import UserDelegationKey
+from azure.storage.blob.aio import BlobServiceClient
+
+from core.blobsas import BlobSasUrlGenerator
+
+from .mocks import MockAzureCredential
+
+
+def create_user_delegation_key(*args, **kwargs):
+    user_delegation_key = UserDelegationKey()
+    user_delegation_key.signed_oid = "OID"
+    user_delegation_key.signed_tid = "TID"
+    user_delegation_key.signed_start = "2024-01-01T00:00:00Z"
+    user_delegation_key.signed_expiry = "2024-01-01T01:00:00Z"
+    user_delegation_key.signed_service = "b"
+    user_delegation_key.signed_version = "2021-08-06"
+    user_delegation_key.value = base64.b64encode(b"secret").decode()
+    return user_delegation_key
+
+
+@pytest.fixture
+def mock_user_delegation_key(monkeypatch):
+    requested_keys = []
+
+    async def mock_get_user_delegation_key(self, key_start_time, key_expiry_time, **kwargs):
+        requested_keys.append((key_start_time, key_expiry_time))
+        return create_user_delegation_key()
+
+    monkeypatch.setattr(BlobServiceClient, "get_user_delegation_key", mock_get_user_delegation_key)
+    return requested_keys
+
+
+@pytest.mark.asyncio
+async def test_get_url(mock_user_delegation_key):
+    blob_service_client = BlobServiceClient("https://account.blob.core.windows.net", credential=MockAzureCredential())
+    generator = BlobSasUrlGenerator(blob_service_client, "content", sas_ttl=timedelta(minutes=5))
+
+    url = await generator.get_url("Benefit Options.pdf")
+    parsed_url = urlparse(url)
+    assert parsed_url.netloc == "account.blob.core.windows.net"
+    assert parsed_url.path == "/content/Benefit%20Options.pdf"
+    query = parse_qs(parsed_url.query)
+    assert query["sp"] == ["r"]
+    assert query["rsct"] == ["application/pdf"]
+    assert query["rscd"] == ["inline"]
+    assert "sig" in query
+
+    # The user delegation key is reused for further URLs
+    await generator.get_url("Northwind.pdf")
+    assert len(mock_user_delegation_key) == 1
+
+
+@pytest.mark.asyncio
+async def test_get_url_refreshes_expiring_key(mock_user_delegation_key):
+    blob_service_client = BlobServiceClient("https://account.blob.core.windows.net", credential=MockAzureCredential())
+    generator = BlobSasUrlGenerator(
+        blob_service_client, "content", sas_ttl=timedelta(minutes=5), key_ttl=timedelta(minutes=6)
+    )
+    await generator.get_url("Northwind.pdf")
+    # Pretend the key was requested a few minutes ago, so it would expire before the next SAS
+    generator._key_expiry -= timedelta(minutes=2)
+    await generator.get_url("Northwind.pdf")
+    assert len(mock_user_delegation_key) == 2
+
+
+def test_sas_must_expire_before_key():
+    with pytest.raises(ValueError):
+        BlobSasUrlGenerator(
+            BlobServiceClient("https://account.blob.core.windows.net"), "content", sas_ttl=timedelta(hours=2)
+        )
@@ -1,11 +1,15 @@
+import asyncio
 import json
 
 import pytest
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents.aio import SearchClient
+from azure.search.documents.models import VectorizedQuery
 from openai.types.chat import ChatCompletion
 
+from approaches.chatapproach import ChatApproach, coalesce_deltas, delta_event
 from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
+from core.authentication import AuthenticationHelper
 
 from .mocks import (
     MOCK_EMBEDDING_DIMENSIONS,
@@ -196,3 +200,203 @@ async def test_search_results_filtering_by_scores(
     assert (
         len(filtered_results) == expected_result_count
     ), f"Expected {expected_result_count} results with minimum_search_score={minimum_search_score} and minimum_reranker_score={minimum_reranker_score}"
+
+
+@pytest.mark.asyncio
+async def test_search_select_fields(monkeypatch):
+    chat_approach = ChatReadRetrieveReadApproach(
+        search_client=SearchClient(endpoint="", index_name="", credential=AzureKeyCredential("")),
+        auth_helper=None,
+        openai_client=None,
+        chatgpt_model="gpt-35-turbo",
+        chatgpt_deployment="chat",
+        embedding_deployment="embeddings",
+        embedding_model=MOCK_EMBEDDING_MODEL_NAME,
+        embedding_dimensions=MOCK_EMBEDDING_DIMENSIONS,
+        sourcepage_field="",
+        content_field="",
+        query_language="en-us",
+        query_speller="lexicon",
+    )
+    selects = []
+
+    async def mock_search_select(*args, **kwargs):
+        selects.append(kwargs.get("select"))
+        return await mock_search(*args, **kwargs)
+
+    monkeypatch.setattr(SearchClient, "search", mock_search_select)
+    vectors = [VectorizedQuery(vector=[0.1, 0.2], k_nearest_neighbors=50, fields="embedding")]
+    search_args = dict(
+        top=10,
+        query_text="test query",
+        filter=None,
+        vectors=vectors,
+        use_semantic_ranker=False,
+        use_semantic_captions=False,
+        minimum_search_score=None,
+        minimum_reranker_score=None,
+    )
+    await chat_approach.search(**search_args)
+    await chat_approach.search(**search_args, include_vectors=True)
+
+    assert selects == [
+        ["id", "content", "category", "sourcepage", "sourcefile"],
+        ["id", "content", "category", "sourcepage", "sourcefile", "embedding"],
+    ]
+
+
+class MockChatCompletions:
+    def __init__(self):
+        self.chat = self
+        self.completions = self
+        self.calls = 0
+
+    async def create(self, *args, **kwargs):
+        self.calls += 1
+        return ChatCompletion.model_validate(
+            {
+                "id": "test",
+                "object": "chat.completion",
+                "created": 0,
+                "model": "gpt-35-turbo",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": "health plans"},
+                    }
+                ],
+            }
+        )
+
+
+@pytest.mark.asyncio
+async def test_query_rewrite_cached_and_skipped(monkeypatch):
+    openai_client = MockChatCompletions()
+    chat_approach = ChatReadRetrieveReadApproach(
+        search_client=SearchClient(endpoint="", index_name="", credential=AzureKeyCredential("")),
+        auth_helper=AuthenticationHelper(
+            search_index=None,
+            use_authentication=False,
+            server_app_id=None,
+            server_app_secret=None,
+            client_app_id=None,
+            tenant_id=None,
+        ),
+        openai_client=openai_client,
+        chatgpt_model="gpt-35-turbo",
+        chatgpt_deployment="chat",
+        embedding_deployment="embeddings",
+        embedding_model=MOCK_EMBEDDING_MODEL_NAME,
+        embedding_dimensions=MOCK_EMBEDDING_DIMENSIONS,
+        sourcepage_field="",
+        content_field="",
+        query_language="en-us",
+        query_speller="lexicon",
+    )
+    monkeypatch.setattr(SearchClient, "search", mock_search)
+    overrides = {"retrieval_mode": "text", "include_thoughts": True}
+
+    async def search_query(messages):
+        extra_info, chat_coroutine = await chat_approach.run_until_final_call(messages, overrides, {})
+        chat_coroutine.close()
+        return extra_info["thoughts"][1].description, extra_info["thoughts"][0].props.get("query_rewrite")
+
+    question = {"role": "user", "content": "What health plans are available?"}
+    assert await search_query([question]) == ("health plans", None)
+    assert await search_query([{"role": "user", "content": "what  health plans are available? "}]) == (
+        "health plans",
+        "cached",
+    )
+    assert openai_client.calls == 1
+
+    follow_up = [question, {"role": "assistant", "content": "Northwind Standard"}, question]
+    assert await search_query(follow_up) == ("health plans", None)
+    assert openai_client.calls == 2
+
+    monkeypatch.setattr(ChatReadRetrieveReadApproach, "skip_query_rewrite_without_history", True)
+    assert await search_query([{"role": "user", "content": "Is dental covered?"}]) == ("Is dental covered?", "skipped")
+    assert await search_query(follow_up) == ("health plans", "cached")
+    assert openai_client.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_speculative_retrieval(monkeypatch):
+    chat_approach = ChatReadRetrieveReadApproach(
+        search_client=SearchClient(endpoint="", index_name="", credential=AzureKeyCredential("")),
+        auth_helper=AuthenticationHelper(
+            search_index=None,
+            use_authentication=False,
+            server_app_id=None,
+            server_app_secret=None,
+            client_app_id=None,
+            tenant_id=None,
+        ),
+        openai_client=MockChatCompletions(),
+        chatgpt_model="gpt-35-turbo",
+        chatgpt_deployment="chat",
+        embedding_deployment="embeddings",
+        embedding_model=MOCK_EMBEDDING_MODEL_NAME,
+        embedding_dimensions=MOCK_EMBEDDING_DIMENSIONS,
+        sourcepage_field="",
+        content_field="",
+        query_language="en-us",
+        query_speller="lexicon",
+    )
+    monkeypatch.setattr(ChatApproach, "speculative_retrieval", True)
+    searches = []
+
+    async def mock_search_recorded(*args, **kwargs):
+        searches.append(kwargs.get("search_text"))
+        return await mock_search(*args, **kwargs)
+
+    monkeypatch.setattr(SearchClient, "search", mock_search_recorded)
+    query_vectors = {"health plans": [1.0, 0.0], "Health  Plans": [1.0, 0.0], "Tell me about health plans": [0.98, 0.1]}
+
+    async def mock_compute_text_embedding(q):
+        return VectorizedQuery(vector=query_vectors.get(q, [0.0, 1.0]), k_nearest_neighbors=50, fields="embedding")
+
+    monkeypatch.setattr(chat_approach, "compute_text_embedding", mock_compute_text_embedding)
+
+    async def search_query(question):
+        extra_info, chat_coroutine = await chat_approach.run_until_final_call(
+            [{"role": "user", "content": question}], {"include_thoughts": True}, {}
+        )
+        chat_coroutine.close()
+        return extra_info["thoughts"][1].description, extra_info["thoughts"][1].props.get("speculative")
+
+    # Same query once normalized
+    assert await search_query("Health  Plans") == ("Health  Plans", True)
+    assert searches == ["Health  Plans"]
+    # Close enough by cosine similarity of the query vectors
+    assert await search_query("Tell me about health plans") == ("Tell me about health plans", True)
+    assert searches == ["Health  Plans", "Tell me about health plans"]
+    # Too different, searched again with the generated query
+    searches.clear()
+    assert await search_query("Which benefits do I get?") == ("health plans", None)
+    assert searches[-1] == "health plans"
+
+
+@pytest.mark.asyncio
+async def test_coalesce_deltas():
+    async def events():
+        yield {"choices": [{"delta": {"role": "assistant"}, "context": {}, "index": 0}]}
+        yield delta_event(None, None)
+        for content in ["The ", "capital ", "is "]:
+            yield delta_event(content, None)
+        await asyncio.sleep(0.1)
+        yield delta_event("Paris.", None)
+        yield delta_event(None, "stop")
+        yield {"choices": [{"delta": {"role": "assistant"}, "context": {"followup_questions": []}, "index": 0}]}
+
+    coalesced = [event async for event in coalesce_deltas(events(), 0.02)]
+    assert [event["choices"][0]["delta"].get("content") for event in coalesced] == [
+        None,
+        None,
+        "The capital is ",
+        "Paris.",
+        None,
+        None,
+    ]
+    assert coalesced[4]["choices"][0]["finish_reason"] == "stop"
+    assert "context" in coalesced[5]["choices"][0]
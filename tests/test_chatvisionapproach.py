@@ -7,6 +7,7 @@ from azure.search.documents.models import (
 )
 from openai.types.chat import ChatCompletion
 
+from approaches.approach import Approach
 from approaches.chatreadretrievereadvision import ChatReadRetrieveReadVisionApproach
 from core.authentication import AuthenticationHelper
 
@@ -69,6 +70,13 @@ def test_build_filter(chat_approach):
     assert result == "category ne 'test_category'"
 
 
+def test_get_image_detail(chat_approach, monkeypatch):
+    assert chat_approach.get_image_detail({}) == "auto"
+    assert chat_approach.get_image_detail({"gpt4v_image_detail": "low"}) == "low"
+    monkeypatch.setattr(Approach, "image_detail", "high")
+    assert chat_approach.get_image_detail({"gpt4v_image_detail": "huge"}) == "high"
+
+
 def test_get_search_query(chat_approach):
     payload = """
     {
@@ -146,3 +154,22 @@ async def test_compute_text_embedding(chat_approach, openai_client, mock_openai_
     assert result.vector == [0.0023064255, -0.009327292, -0.0028842222]
     assert result.k_nearest_neighbors == 50
     assert result.fields == "embedding"
+
+
+@pytest.mark.asyncio
+async def test_compute_embeddings_cached(monkeypatch, chat_approach, openai_client, mock_openai_embedding):
+    mock_openai_embedding(openai_client)
+    await chat_approach.compute_text_embedding("test query")
+
+    async def mock_create_not_called(*args, **kwargs):
+        raise AssertionError("The query vector should come from the cache")
+
+    monkeypatch.setattr(openai_client.embeddings, "create", mock_create_not_called)
+    result = await chat_approach.compute_text_embedding("  test   query ")
+    assert result.vector == [0.0023064255, -0.009327292, -0.0028842222]
+    assert (Approach.embedding_cache.hits, Approach.embedding_cache.misses) == (1, 1)
+
+    Approach.embedding_cache.put(("image", "endpoint", "test query"), [0.1, 0.2])
+    result = await chat_approach.compute_image_embedding("test query")
+    assert result.vector == [0.1, 0.2]
+    assert result.fields == "imageEmbedding"
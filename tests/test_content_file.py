@@ -3,16 +3,19 @@ import os
 import aiohttp
 import azure.storage.blob.aio
 import azure.storage.filedatalake.aio
+import fitz  # type: ignore
 import pytest
-from azure.core.exceptions import ResourceNotFoundError
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
 from azure.core.pipeline.transport import (
     AioHttpTransportResponse,
     AsyncHttpTransport,
     HttpRequest,
 )
+from azure.storage.blob import BlobProperties
 from azure.storage.blob.aio import BlobServiceClient
 
 import app
+from core.contentcache import ContentCache
 
 from .mocks import MockAzureCredential, MockBlob
 
@@ -101,7 +104,7 @@ async def test_content_file(monkeypatch, mock_env, mock_acs_search):
 async def test_content_file_useruploaded_found(monkeypatch, auth_client, mock_blob_container_client):
 
     class MockBlobClient:
-        async def download_blob(self):
+        async def download_blob(self, *args, **kwargs):
             raise ResourceNotFoundError(MockAiohttpClientResponse404("userdoc.pdf", b""))
 
     monkeypatch.setattr(
@@ -110,7 +113,7 @@ async def test_content_file_useruploaded_found(monkeypatch, auth_client, mock_bl
 
     downloaded_files = []
 
-    async def mock_download_file(self):
+    async def mock_download_file(self, *args, **kwargs):
         downloaded_files.append(self.path_name)
         return MockBlob()
 
@@ -125,17 +128,288 @@ async def test_content_file_useruploaded_found(monkeypatch, auth_client, mock_bl
 async def test_content_file_useruploaded_notfound(monkeypatch, auth_client, mock_blob_container_client):
 
     class MockBlobClient:
-        async def download_blob(self):
+        async def download_blob(self, *args, **kwargs):
             raise ResourceNotFoundError(MockAiohttpClientResponse404("userdoc.pdf", b""))
 
     monkeypatch.setattr(
         azure.storage.blob.aio.ContainerClient, "get_blob_client", lambda *args, **kwargs: MockBlobClient()
     )
 
-    async def mock_download_file(self):
+    async def mock_download_file(self, *args, **kwargs):
         raise ResourceNotFoundError(MockAiohttpClientResponse404("userdoc.pdf", b""))
 
     monkeypatch.setattr(azure.storage.filedatalake.aio.DataLakeFileClient, "download_file", mock_download_file)
 
     response = await auth_client.get("/content/userdoc.pdf", headers={"Authorization": "Bearer test"})
     assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_content_file_range(monkeypatch, mock_env, mock_acs_search):
+    content = b"0123456789abcdefghij"
+
+    class MockTransport(AsyncHttpTransport):
+        async def send(self, request: HttpRequest, **kwargs) -> AioHttpTransportResponse:
+            start, end = 0, len(content) - 1
+            if range_header := request.headers.get("x-ms-range"):
+                start_text, end_text = range_header.removeprefix("bytes=").split("-")
+                start, end = int(start_text), min(int(end_text or end), end)
+            if start >= len(content):
+                response = MockAiohttpClientResponse(request.url, b"", {"Content-Length": "0"})
+                response.status = 416
+                response.reason = "Range Not Satisfiable"
+                return AioHttpTransportResponse(request, response)
+            return AioHttpTransportResponse(
+                request,
+                MockAiohttpClientResponse(
+                    request.url,
+                    content[start : end + 1],
+                    {
+                        "Content-Type": "application/pdf",
+                        "Content-Range": f"bytes {start}-{end}/{len(content)}",
+                        "Content-Length": str(end - start + 1),
+                    },
+                ),
+            )
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *args):
+            pass
+
+        async def open(self):
+            pass
+
+        async def close(self):
+            pass
+
+    blob_client = BlobServiceClient(
+        f"https://{os.environ['AZURE_STORAGE_ACCOUNT']}.blob.core.windows.net",
+        credential=MockAzureCredential(),
+        transport=MockTransport(),
+        retry_total=0,
+    )
+    blob_container_client = blob_client.get_container_client(os.environ["AZURE_STORAGE_CONTAINER"])
+
+    quart_app = app.create_app()
+    async with quart_app.test_app() as test_app:
+        quart_app.config.update({"blob_container_client": blob_container_client})
+        client = test_app.test_client()
+
+        response = await client.get("/content/manual.pdf")
+        assert response.status_code == 200
+        assert response.headers["Accept-Ranges"] == "bytes"
+        assert await response.get_data() == content
+
+        response = await client.get("/content/manual.pdf", headers={"Range": "bytes=5-9"})
+        assert response.status_code == 206
+        assert response.headers["Content-Range"] == "bytes 5-9/20"
+        assert response.headers["Content-Length"] == "5"
+        assert await response.get_data() == b"56789"
+
+        response = await client.get("/content/manual.pdf", headers={"Range": "bytes=15-"})
+        assert response.status_code == 206
+        assert response.headers["Content-Range"] == "bytes 15-19/20"
+        assert await response.get_data() == b"fghij"
+
+        # Suffix ranges are not supported and fall back to the whole file
+        response = await client.get("/content/manual.pdf", headers={"Range": "bytes=-5"})
+        assert response.status_code == 200
+        assert await response.get_data() == content
+
+        response = await client.get("/content/manual.pdf", headers={"Range": "bytes=50-60"})
+        assert response.status_code == 416
+
+
+@pytest.mark.asyncio
+async def test_content_file_cached(monkeypatch, mock_env, mock_acs_search):
+    content = b"%PDF-1.4 cached content"
+    requests_sent = []
+
+    class MockTransport(AsyncHttpTransport):
+        async def send(self, request: HttpRequest, **kwargs) -> AioHttpTransportResponse:
+            requests_sent.append(request)
+            if request.headers.get("If-None-Match") == '"0x1"':
+                response = MockAiohttpClientResponse(request.url, b"", {"Content-Length": "0"})
+                response.status = 304
+                response.reason = "Not Modified"
+                return AioHttpTransportResponse(request, response)
+            return AioHttpTransportResponse(
+                request,
+                MockAiohttpClientResponse(
+                    request.url,
+                    content,
+                    {
+                        "Content-Type": "application/pdf",
+                        "Content-Range": f"bytes 0-{len(content) - 1}/{len(content)}",
+                        "Content-Length": str(len(content)),
+                        "ETag": '"0x1"',
+                        "Last-Modified": "Wed, 01 May 2024 10:00:00 GMT",
+                    },
+                ),
+            )
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *args):
+            pass
+
+        async def open(self):
+            pass
+
+        async def close(self):
+            pass
+
+    blob_client = BlobServiceClient(
+        f"https://{os.environ['AZURE_STORAGE_ACCOUNT']}.blob.core.windows.net",
+        credential=MockAzureCredential(),
+        transport=MockTransport(),
+        retry_total=0,
+    )
+    blob_container_client = blob_client.get_container_client(os.environ["AZURE_STORAGE_CONTAINER"])
+
+    quart_app = app.create_app()
+    async with quart_app.test_app() as test_app:
+        quart_app.config.update({"blob_container_client": blob_container_client})
+        client = test_app.test_client()
+
+        response = await client.get("/content/policy.pdf")
+        assert response.status_code == 200
+        assert response.headers["ETag"] == '"0x1"'
+        assert response.headers["Last-Modified"] == "Wed, 01 May 2024 10:00:00 GMT"
+        assert await response.get_data() == content
+        assert "If-None-Match" not in requests_sent[-1].headers
+
+        # The second request only revalidates the ETag with storage and is served from disk
+        response = await client.get("/content/policy.pdf")
+        assert response.status_code == 200
+        assert requests_sent[-1].headers["If-None-Match"] == '"0x1"'
+        assert response.headers["ETag"] == '"0x1"'
+        assert await response.get_data() == content
+
+        response = await client.get("/content/policy.pdf", headers={"Range": "bytes=0-3"})
+        assert response.status_code == 206
+        assert await response.get_data() == b"%PDF"
+
+        response = await client.get("/content/policy.pdf", headers={"If-None-Match": '"0x1"'})
+        assert response.status_code == 304
+        assert await response.get_data() == b""
+
+        # Another worker evicted the file after storage confirmed it was current, it is downloaded again
+        monkeypatch.setattr(ContentCache, "open", lambda self, entry: None)
+        response = await client.get("/content/policy.pdf")
+        assert response.status_code == 200
+        assert "If-None-Match" not in requests_sent[-1].headers
+        assert await response.get_data() == content
+
+
+@pytest.mark.asyncio
+async def test_content_file_not_modified_without_cache(monkeypatch, mock_env, mock_acs_search):
+    monkeypatch.setenv("CONTENT_CACHE_MAX_MB", "0")
+
+    class MockBlobClient:
+        async def download_blob(self, *args, **kwargs):
+            assert kwargs["etag"] == '"0x1"'
+            error = HttpResponseError("Not Modified")
+            error.status_code = 304
+            raise error
+
+    monkeypatch.setattr(
+        azure.storage.blob.aio.ContainerClient, "get_blob_client", lambda *args, **kwargs: MockBlobClient()
+    )
+
+    quart_app = app.create_app()
+    async with quart_app.test_app() as test_app:
+        client = test_app.test_client()
+        response = await client.get("/content/policy.pdf", headers={"If-None-Match": '"0x1"'})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == '"0x1"'
+
+
+@pytest.mark.asyncio
+async def test_content_file_sas_redirect(monkeypatch, mock_env, mock_acs_search):
+    monkeypatch.setenv("USE_CONTENT_SAS_REDIRECT", "true")
+
+    async def mock_get_url(self, blob_name: str):
+        return f"https://test-storage-account.blob.core.windows.net/test-storage-container/{blob_name}?sig=SIG"
+
+    monkeypatch.setattr(app.BlobSasUrlGenerator, "get_url", mock_get_url)
+
+    quart_app = app.create_app()
+    async with quart_app.test_app() as test_app:
+        client = test_app.test_client()
+        response = await client.get("/content/role_library.pdf")
+        assert response.status_code == 302
+        assert (
+            response.headers["Location"]
+            == "https://test-storage-account.blob.core.windows.net/test-storage-container/role_library.pdf?sig=SIG"
+        )
+        assert response.headers["Cache-Control"] == "no-store"
+
+
+@pytest.mark.asyncio
+async def test_content_page(monkeypatch, mock_env, mock_acs_search):
+    with fitz.open() as document:
+        for page_number in range(1, 4):
+            document.new_page().insert_text((72, 72), f"Page {page_number}")
+        pdf = document.tobytes()
+    downloads = []
+
+    class MockPdfBlob:
+        def __init__(self):
+            self.properties = BlobProperties(
+                name="manual.pdf", content_settings={"content_type": "application/pdf"}, ETag='"0x1"'
+            )
+
+        async def readall(self):
+            return pdf
+
+    class MockBlobClient:
+        async def download_blob(self, *args, **kwargs):
+            downloads.append(kwargs)
+            if kwargs.get("etag") == '"0x1"':
+                error = HttpResponseError("Not Modified")
+                error.status_code = 304
+                raise error
+            return MockPdfBlob()
+
+    monkeypatch.setattr(
+        azure.storage.blob.aio.ContainerClient, "get_blob_client", lambda *args, **kwargs: MockBlobClient()
+    )
+
+    quart_app = app.create_app()
+    async with quart_app.test_app() as test_app:
+        client = test_app.test_client()
+
+        response = await client.get("/content/manual.pdf/page/2")
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == "application/pdf"
+        assert response.headers["ETag"] == '"0x1"'
+        with fitz.open(stream=await response.get_data(), filetype="pdf") as page_document:
+            assert page_document.page_count == 1
+            assert page_document[0].get_text().strip() == "Page 2"
+
+        # Other pages are extracted from the cached file, and extracted pages are served from the cache
+        response = await client.get("/content/manual.pdf/page/3?format=png")
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == "image/png"
+        response = await client.get("/content/manual.pdf/page/2")
+        assert response.status_code == 200
+        assert [download.get("etag") for download in downloads] == [None, '"0x1"', '"0x1"']
+
+        response = await client.get("/content/manual.pdf/page/2", headers={"If-None-Match": '"0x1"'})
+        assert response.status_code == 304
+
+        response = await client.get("/content/manual.pdf/page/4")
+        assert response.status_code == 404
+
+        response = await client.get("/content/manual.pdf/page/1?format=gif")
+        assert response.status_code == 400
+
+        # Files evicted by another worker after storage confirmed they were current are downloaded again
+        monkeypatch.setattr(ContentCache, "open", lambda self, entry: None)
+        response = await client.get("/content/manual.pdf/page/1")
+        assert response.status_code == 200
+        assert downloads[-1].get("etag") is None
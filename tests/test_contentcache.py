@@ -0,0 +1,99 @@
+import os
+from datetime import datetime, timezone
+
+from core.contentcache import ContentCache
+
+LAST_MODIFIED = datetime(2024, 5, 1, 10, 0, tzinfo=timezone.utc)
+
+
+def cache_blob(cache: ContentCache, blob_name: str, etag: str, content: bytes):
+    writer = cache.writer(blob_name, etag, "application/pdf", len(content), LAST_MODIFIED)
+    assert writer is not None
+    writer.write(content)
+    writer.commit()
+    writer.discard()
+
+
+def test_cache_hit_and_new_version(tmp_path):
+    cache = ContentCache(str(tmp_path), max_size=100)
+    assert cache.get("a.pdf") is None
+
+    cache_blob(cache, "a.pdf", '"0x1"', b"version 1")
+    cached = cache.get("a.pdf")
+    assert cached is not None
+    assert cached.etag == '"0x1"'
+    assert cached.last_modified == LAST_MODIFIED
+    assert cache.read(cached) == b"version 1"
+
+    cache_blob(cache, "a.pdf", '"0x2"', b"version 2!")
+    cached_v2 = cache.get("a.pdf")
+    assert cached_v2 is not None and cached_v2.etag == '"0x2"'
+    assert not os.path.exists(cached.file_path)
+    assert cache.read(cached) is None
+    assert cache.usage() == len(b"version 2!")
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = ContentCache(str(tmp_path), max_size=20, max_entry_size=20)
+    cache_blob(cache, "a.pdf", '"a"', b"a" * 8)
+    cache_blob(cache, "b.pdf", '"b"', b"b" * 8)
+    cached_a, cached_b = cache.get("a.pdf"), cache.get("b.pdf")
+    assert cached_a is not None and cached_b is not None
+    os.utime(cached_a.file_path, (1000, 1000))
+    os.utime(cached_b.file_path, (2000, 2000))
+    # Opening a file makes it the most recently used
+    cache.read(cached_a)
+    cache_blob(cache, "c.pdf", '"c"', b"c" * 8)
+
+    assert cache.get("b.pdf") is None
+    assert cache.get("a.pdf") is not None
+    assert cache.get("c.pdf") is not None
+    assert cache.usage() == 16
+
+
+def test_cache_skips_large_and_incomplete_files(tmp_path):
+    cache = ContentCache(str(tmp_path), max_size=100)
+    assert cache.writer("big.pdf", '"0x1"', "application/pdf", 26, None) is None
+
+    writer = cache.writer("partial.pdf", '"0x1"', "application/pdf", 10, None)
+    assert writer is not None
+    writer.write(b"12345")
+    # The client disconnected before the whole file was streamed
+    writer.discard()
+    assert cache.get("partial.pdf") is None
+    assert os.listdir(tmp_path) == []
+
+    writer = cache.writer("short.pdf", '"0x1"', "application/pdf", 10, None)
+    assert writer is not None
+    writer.write(b"12345")
+    writer.commit()
+    assert cache.get("short.pdf") is None
+
+
+def test_cache_is_shared_between_workers(tmp_path):
+    worker1 = ContentCache(str(tmp_path), max_size=20, max_entry_size=20)
+    worker2 = ContentCache(str(tmp_path), max_size=20, max_entry_size=20)
+    cache_blob(worker1, "a.pdf", '"0x1"', b"a" * 8)
+
+    cached = worker2.get("a.pdf")
+    assert cached is not None
+    assert cached.etag == '"0x1"'
+    assert cached.last_modified == LAST_MODIFIED
+
+    # The size limit holds for the files of both workers together
+    os.utime(cached.file_path, (1000, 1000))
+    cache_blob(worker2, "b.pdf", '"0x1"', b"b" * 8)
+    cache_blob(worker2, "c.pdf", '"0x1"', b"c" * 8)
+    assert worker1.get("a.pdf") is None
+    assert worker1.usage() == 16
+
+    # A file evicted by another worker is a miss, one that was already open can still be read
+    cached_b = worker1.get("b.pdf")
+    assert cached_b is not None
+    opened = worker1.open(cached_b)
+    assert opened is not None
+    os.remove(cached_b.file_path)
+    assert worker1.get("b.pdf") is None
+    assert worker1.open(cached_b) is None
+    with opened:
+        assert opened.read() == b"b" * 8
@@ -0,0 +1,169 @@
+import os
+import time
+
+import pytest
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents.aio import SearchClient
+from azure.search.documents.indexes.aio import SearchIndexClient
+from azure.search.documents.indexes.models import SearchIndex, SimpleField
+
+from core.documentacl import DocumentAclMap
+from prepdocslib.searchmanager import SearchManager
+from prepdocslib.strategy import SearchInfo
+
+from .mocks import MockAsyncPageIterator
+
+DOCUMENTS = [
+    {"id": "1", "sourcefile": "a.pdf", "sourcepage": "a-1.png", "oids": ["OID_X"], "groups": []},
+    {"id": "2", "sourcefile": "b.pdf", "sourcepage": "b-1.png", "oids": [], "groups": ["GROUP_Y"]},
+    {"id": "3", "sourcefile": "public.pdf", "sourcepage": "public-1.png", "oids": [], "groups": []},
+]
+
+
+def mock_search_documents(monkeypatch, documents: list[dict], key_field: str = "id"):
+    calls = []
+
+    async def mock_search(self, *args, **kwargs):
+        calls.append(kwargs)
+        last_key = kwargs["filter"].split("'")[1] if kwargs.get("filter") else ""
+        page = [document for document in documents if document[key_field] > last_key][: kwargs["top"]]
+        return MockAsyncPageIterator(data=page)
+
+    monkeypatch.setattr(SearchClient, "search", mock_search)
+    return calls
+
+
+def create_acl_map(**kwargs) -> DocumentAclMap:
+    return DocumentAclMap(SearchClient(endpoint="", index_name="", credential=AzureKeyCredential("")), **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_acl_map_pages_by_key_field_of_index(monkeypatch):
+    documents = [{**document, "chunk_id": document.pop("id")} for document in map(dict, DOCUMENTS)]
+    calls = mock_search_documents(monkeypatch, documents, key_field="chunk_id")
+    acl_map = create_acl_map(key_field="chunk_id", page_size=2)
+    await acl_map.refresh()
+
+    assert [call["filter"] for call in calls] == [None, "chunk_id gt '2'"]
+    assert calls[0]["order_by"] == ["chunk_id asc"]
+    assert acl_map.allows("a.pdf", "OID_X", [], allow_global_documents=False)
+
+
+@pytest.mark.asyncio
+async def test_acl_map_shared_between_workers(monkeypatch, tmp_path):
+    calls = mock_search_documents(monkeypatch, DOCUMENTS)
+    snapshot_path = str(tmp_path / "acls.json")
+    worker1 = create_acl_map(refresh_interval=60, snapshot_path=snapshot_path)
+    worker2 = create_acl_map(refresh_interval=60, snapshot_path=snapshot_path)
+
+    await worker1.refresh()
+    await worker2.refresh()
+    # Only the first worker searched the index, the second loaded its snapshot
+    assert len(calls) == 1
+    assert worker2.allows("b-1.png", "OID_W", ["GROUP_Y"], allow_global_documents=False)
+    assert worker2.allows("public.pdf", "OID_W", [], allow_global_documents=True)
+    assert not worker2.allows("a.pdf", "OID_W", [], allow_global_documents=False)
+
+    # While a worker rebuilds the map the others keep what they have and check back later
+    os.utime(snapshot_path, (0, 0))
+    open(f"{snapshot_path}.lock", "w").close()
+    await worker2.refresh()
+    assert len(calls) == 1
+    assert worker2._retry_at > time.monotonic()
+
+    os.remove(f"{snapshot_path}.lock")
+    await worker2.refresh()
+    assert len(calls) == 2
+    assert not os.path.exists(f"{snapshot_path}.lock")
+
+
+@pytest.mark.asyncio
+async def test_acl_map_pages_by_key(monkeypatch):
+    calls = mock_search_documents(monkeypatch, DOCUMENTS)
+    acl_map = create_acl_map(page_size=2)
+    await acl_map.refresh()
+
+    assert [call["filter"] for call in calls] == [None, "id gt '2'"]
+    assert acl_map.allows("a.pdf", "OID_X", [], allow_global_documents=False)
+    assert acl_map.allows("b-1.png", "OID_W", ["GROUP_Y"], allow_global_documents=False)
+    assert not acl_map.allows("a.pdf", "OID_W", ["GROUP_Y"], allow_global_documents=False)
+    assert not acl_map.allows("public.pdf", "OID_W", [], allow_global_documents=False)
+    assert acl_map.allows("public.pdf", "OID_W", [], allow_global_documents=True)
+    assert not acl_map.allows("new.pdf", "OID_X", ["GROUP_Y"], allow_global_documents=True)
+
+
+@pytest.mark.asyncio
+async def test_acl_map_stale_or_not_loaded(monkeypatch):
+    calls = mock_search_documents(monkeypatch, DOCUMENTS)
+    acl_map = create_acl_map(refresh_interval=60)
+    # Not loaded yet, starts loading in the background
+    assert not acl_map.allows("a.pdf", "OID_X", [], allow_global_documents=False)
+    await acl_map.start_refresh()
+    assert acl_map.allows("a.pdf", "OID_X", [], allow_global_documents=False)
+    assert len(calls) == 1
+
+    later = time.monotonic() + 3600
+    monkeypatch.setattr(time, "monotonic", lambda: later)
+    assert not acl_map.allows("a.pdf", "OID_X", [], allow_global_documents=False)
+    await acl_map.start_refresh()
+    assert len(calls) == 2
+    await acl_map.close()
+
+
+@pytest.mark.asyncio
+async def test_acl_map_backs_off_after_failed_refresh(monkeypatch):
+    calls = []
+
+    async def mock_search_failing(self, *args, **kwargs):
+        calls.append(kwargs)
+        raise ValueError("The field 'id' is not sortable")
+
+    monkeypatch.setattr(SearchClient, "search", mock_search_failing)
+    acl_map = create_acl_map(refresh_interval=300, retry_interval=30)
+    assert not acl_map.allows("a.pdf", "OID_X", [], allow_global_documents=False)
+    with pytest.raises(ValueError):
+        await acl_map.start_refresh()
+    # Requests within the retry interval don't start another refresh
+    assert not acl_map.allows("a.pdf", "OID_X", [], allow_global_documents=False)
+    assert acl_map._refresh_task.done()
+    assert len(calls) == 1
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 31)
+    assert not acl_map.allows("a.pdf", "OID_X", [], allow_global_documents=False)
+    with pytest.raises(ValueError):
+        await acl_map._refresh_task
+    assert len(calls) == 2
+    # The retry interval doubles
+    monkeypatch.setattr(time, "monotonic", lambda: now + 62)
+    assert not acl_map.allows("a.pdf", "OID_X", [], allow_global_documents=False)
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_acls", [True, False])
+async def test_acl_map_supports_created_index(monkeypatch, use_acls):
+    indexes = []
+
+    async def mock_create_index(self, index):
+        indexes.append(index)
+
+    async def mock_list_index_names(self):
+        for index in []:
+            yield index
+
+    monkeypatch.setattr(SearchIndexClient, "create_index", mock_create_index)
+    monkeypatch.setattr(SearchIndexClient, "list_index_names", mock_list_index_names)
+    search_info = SearchInfo(
+        endpoint="https://testsearchclient.blob.core.windows.net",
+        credential=AzureKeyCredential("test"),
+        index_name_list=["test"],
+    )
+    await SearchManager(search_info, use_acls=use_acls).create_index()
+
+    assert DocumentAclMap.key_field(indexes[0]) == "id"
+
+
+def test_acl_map_doesnt_support_unsortable_key():
+    search_index = SearchIndex(name="test", fields=[SimpleField(name="id", type="Edm.String", key=True)])
+    assert DocumentAclMap.key_field(search_index) is None
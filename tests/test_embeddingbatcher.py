@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+from openai.types import CreateEmbeddingResponse, Embedding
+from openai.types.create_embedding_response import Usage
+
+from core.embeddingbatcher import EmbeddingBatcher
+
+
+class MockEmbeddingsClient:
+    def __init__(self):
+        self.embeddings = self
+        self.calls = []
+
+    async def create(self, *args, **kwargs):
+        self.calls.append(kwargs)
+        if "fail" in kwargs["input"]:
+            raise ValueError("Embedding failed")
+        return CreateEmbeddingResponse(
+            object="list",
+            # Returned out of order to check the results are matched by index
+            data=[
+                Embedding(embedding=[float(len(text))], index=index, object="embedding")
+                for index, text in reversed(list(enumerate(kwargs["input"])))
+            ],
+            model="text-embedding-ada-002",
+            usage=Usage(prompt_tokens=8, total_tokens=8),
+        )
+
+
+@pytest.mark.asyncio
+async def test_batches_concurrent_queries():
+    openai_client = MockEmbeddingsClient()
+    batcher = EmbeddingBatcher(max_batch_size=3, max_wait=0.01)
+    vectors = await asyncio.gather(
+        *[batcher.embed(openai_client, "ada", None, text) for text in ["a", "bb", "a", "ccc", "dddd"]]
+    )
+    assert vectors == [[1.0], [2.0], [1.0], [3.0], [4.0]]
+    # The first batch is sent once full, the second after the wait, duplicate texts are embedded once
+    assert [call["input"] for call in openai_client.calls] == [["a", "bb"], ["ccc", "dddd"]]
+    assert "dimensions" not in openai_client.calls[0]
+
+
+@pytest.mark.asyncio
+async def test_batch_failure_only_fails_the_bad_input():
+    openai_client = MockEmbeddingsClient()
+    batcher = EmbeddingBatcher(max_batch_size=8, max_wait=0.01)
+    results = await asyncio.gather(
+        batcher.embed(openai_client, "text-embedding-3-small", 256, "ok"),
+        batcher.embed(openai_client, "text-embedding-3-small", 256, "fail"),
+        batcher.embed(openai_client, "text-embedding-3-small", 256, "fine"),
+        return_exceptions=True,
+    )
+    assert results[0] == [2.0]
+    assert isinstance(results[1], ValueError)
+    assert results[2] == [4.0]
+    # The failed batch is retried one text at a time
+    assert [call["input"] for call in openai_client.calls] == [["ok", "fail", "fine"], ["ok"], ["fail"], ["fine"]]
+    assert all(call["dimensions"] == 256 for call in openai_client.calls)
+
+
+@pytest.mark.asyncio
+async def test_batching_disabled():
+    openai_client = MockEmbeddingsClient()
+    batcher = EmbeddingBatcher(max_batch_size=1)
+    assert await batcher.embed(openai_client, "ada", None, "abc") == [3.0]
+    assert [call["input"] for call in openai_client.calls] == [["abc"]]
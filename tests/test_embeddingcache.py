@@ -0,0 +1,18 @@
+import time
+
+from core.embeddingcache import EmbeddingCache
+
+
+def test_embedding_cache_bounded_and_expiring(monkeypatch):
+    cache = EmbeddingCache(max_entries=2, ttl=60)
+    cache.put("a", [1.0])
+    cache.put("b", [2.0])
+    cache.get("a")
+    cache.put("c", [3.0])
+    assert cache.get("b") is None
+    assert cache.get("a") == [1.0]
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+    assert cache.get("c") is None
+    assert len(cache) == 1
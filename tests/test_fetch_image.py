@@ -1,3 +1,6 @@
+import asyncio
+import base64
+import io
 import os
 
 import aiohttp
@@ -9,9 +12,12 @@ from azure.core.pipeline.transport import (
     HttpRequest,
 )
 from azure.storage.blob.aio import BlobServiceClient
+from PIL import Image
 
+import core.imageshelper
 from approaches.approach import Document
-from core.imageshelper import fetch_image
+from core.imageshelper import fetch_image, fetch_images
+from core.pageimagecache import PageImageCache, resize_image
 
 from .mocks import MockAzureCredential
 
@@ -99,3 +105,132 @@ async def test_content_file(monkeypatch, mock_env, mock_acs_search):
     test_document.sourcepage = ""
     image_url = await fetch_image(blob_container_client, test_document)
     assert image_url is None
+
+
+@pytest.mark.asyncio
+async def test_fetch_images_concurrently(monkeypatch):
+    running = 0
+    max_running = 0
+    fetched = []
+
+    async def mock_fetch_image(blob_container_client, result, page_image_cache=None, detail="auto"):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        fetched.append(result.sourcepage)
+        # Two source pages of the same page image
+        url = f"data:{result.sourcepage.replace('.jpg', '.png')}"
+        return {"url": url, "detail": detail} if result.sourcepage else None
+
+    monkeypatch.setattr(core.imageshelper, "fetch_image", mock_fetch_image)
+    sourcepages = ["a-1.png", "b-1.png", "a-1.png", "", "c-1.png", "d-1.png", "c-1.jpg"]
+    results = [
+        Document(
+            id=str(index),
+            content="",
+            embedding=None,
+            image_embedding=None,
+            oids=[],
+            groups=[],
+            captions=[],
+            category="",
+            sourcefile="",
+            sourcepage=sourcepage,
+        )
+        for index, sourcepage in enumerate(sourcepages)
+    ]
+    image_urls = await fetch_images(None, results, max_concurrency=2, detail="low")
+
+    # Each image is sent once, in the order it is first cited
+    assert image_urls == [
+        {"url": "data:a-1.png", "detail": "low"},
+        {"url": "data:b-1.png", "detail": "low"},
+        {"url": "data:c-1.png", "detail": "low"},
+        {"url": "data:d-1.png", "detail": "low"},
+    ]
+    # Each page is downloaded once, at most two at a time
+    assert sorted(fetched) == ["", "a-1.png", "b-1.png", "c-1.jpg", "c-1.png", "d-1.png"]
+    assert max_running == 2
+
+
+def page_image(size: tuple[int, int]) -> bytes:
+    output = io.BytesIO()
+    Image.effect_noise(size, 64).convert("RGB").save(output, format="PNG")
+    return output.getvalue()
+
+
+@pytest.mark.asyncio
+async def test_page_image_cache():
+    image = page_image((20, 10))
+    expected_data_url = f"data:image/png;base64,{base64.b64encode(image).decode('utf-8')}"
+    cache = PageImageCache(max_size=len(expected_data_url) + 100)
+    assert cache.get("a-1.png") is None
+    data_url = await cache.put("a-1.png", image)
+    assert data_url == expected_data_url
+    assert cache.get("a-1.png") == data_url
+    # Without resizing the detail level doesn't matter
+    assert cache.get("a-1.png", "low") == data_url
+
+    # Bounded by the size of the data URLs, least recently used first
+    await cache.put("b-1.png", image)
+    assert cache.get("a-1.png") is None
+    assert cache.get("b-1.png") is not None
+    assert cache.size == len(data_url)
+    assert cache.hits == 3 and cache.misses == 2
+
+
+@pytest.mark.parametrize(
+    "detail, expected_size",
+    [("low", (512, 256)), ("high", (1536, 768)), ("auto", (1536, 768))],
+)
+def test_resize_image(detail, expected_size):
+    image, mime_type = resize_image(page_image((2000, 1000)), detail)
+    assert mime_type == "image/jpeg"
+    assert Image.open(io.BytesIO(image)).size == expected_size
+
+
+@pytest.mark.asyncio
+async def test_fetch_image_cached(monkeypatch):
+    downloads = []
+    image = page_image((1700, 2200))
+
+    class MockBlob:
+        properties = {"name": "a-1.png"}
+
+        async def readall(self):
+            return image
+
+    class MockBlobClient:
+        def __init__(self, blob_name):
+            self.blob_name = blob_name
+
+        async def download_blob(self):
+            downloads.append(self.blob_name)
+            return MockBlob()
+
+    class MockContainerClient:
+        def get_blob_client(self, blob_name):
+            return MockBlobClient(blob_name)
+
+    document = Document(
+        id="1",
+        content="",
+        embedding=None,
+        image_embedding=None,
+        oids=[],
+        groups=[],
+        captions=[],
+        category="",
+        sourcefile="a.pdf",
+        sourcepage="a-1.pdf",
+    )
+    cache = PageImageCache(resize=True)
+    first = await fetch_image(MockContainerClient(), document, cache)
+    second = await fetch_image(MockContainerClient(), document, cache)
+    assert downloads == ["a-1.png"]
+    assert first == second
+    assert first["url"].startswith("data:image/jpeg;base64,")
+    resized = Image.open(io.BytesIO(base64.b64decode(first["url"].split(",", 1)[1])))
+    assert resized.size == (768, 994)
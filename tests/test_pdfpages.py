@@ -0,0 +1,44 @@
+import fitz  # type: ignore
+import pytest
+
+from core.pdfpages import PageNotFoundError, extract_pdf_page
+
+
+def create_pdf(page_count: int) -> bytes:
+    with fitz.open() as document:
+        for page_number in range(1, page_count + 1):
+            page = document.new_page()
+            page.insert_text((72, 72), f"Page {page_number}")
+        return document.tobytes()
+
+
+def test_extract_pdf_page():
+    page_pdf = extract_pdf_page(create_pdf(5), 3)
+    with fitz.open(stream=page_pdf, filetype="pdf") as document:
+        assert document.page_count == 1
+        assert document[0].get_text().strip() == "Page 3"
+
+
+def test_extract_pdf_page_from_path(tmp_path):
+    pdf_path = tmp_path / "manual.pdf"
+    pdf_path.write_bytes(create_pdf(2))
+    page_pdf = extract_pdf_page(str(pdf_path), 2)
+    with fitz.open(stream=page_pdf, filetype="pdf") as document:
+        assert document[0].get_text().strip() == "Page 2"
+
+
+def test_extract_pdf_page_as_png():
+    page_png = extract_pdf_page(create_pdf(2), 1, "png")
+    assert page_png.startswith(b"\x89PNG")
+
+
+def test_extract_pdf_page_out_of_range():
+    with pytest.raises(PageNotFoundError):
+        extract_pdf_page(create_pdf(2), 3)
+    with pytest.raises(PageNotFoundError):
+        extract_pdf_page(create_pdf(2), 0)
+
+
+def test_extract_pdf_page_not_a_pdf():
+    with pytest.raises(ValueError):
+        extract_pdf_page(b"just some text", 1)
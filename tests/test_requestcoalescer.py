@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from core.requestcoalescer import RequestCoalescer
+
+
+def answer(content: str, session_state=None) -> dict:
+    return {
+        "choices": [{"message": {"content": content}, "context": {"thoughts_id": "T"}, "session_state": session_state}]
+    }
+
+
+@pytest.mark.asyncio
+async def test_coalesce_answers():
+    coalescer = RequestCoalescer()
+    runs = []
+
+    async def run():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return answer("Paris", "first")
+
+    results = await asyncio.gather(
+        coalescer.run("key", run, stream=False, session_state="first"),
+        coalescer.run("key", run, stream=False, session_state="second"),
+    )
+    assert len(runs) == 1
+    assert results[0]["choices"][0]["session_state"] == "first"
+    assert results[0]["choices"][0]["context"] == {"thoughts_id": "T"}
+    assert results[1]["choices"][0]["session_state"] == "second"
+    assert results[1]["choices"][0]["context"] == {}
+
+    # Once answered, the next request runs again
+    await coalescer.run("key", run, stream=False)
+    assert len(runs) == 2
+
+
+@pytest.mark.asyncio
+async def test_coalesce_streams():
+    coalescer = RequestCoalescer()
+    runs = []
+    started = asyncio.Event()
+    proceed = asyncio.Event()
+
+    async def events():
+        yield {"choices": [{"delta": {"role": "assistant"}, "context": {}, "session_state": "first"}]}
+        started.set()
+        await proceed.wait()
+        yield {"choices": [{"delta": {"content": "Paris"}}]}
+
+    async def run():
+        runs.append(1)
+        return events()
+
+    async def consume(session_state):
+        return [event async for event in await coalescer.run("key", run, stream=True, session_state=session_state)]
+
+    first = asyncio.create_task(consume("first"))
+    await started.wait()
+    # Joins late, gets the events streamed so far first
+    second = asyncio.create_task(consume("second"))
+    await asyncio.sleep(0)
+    proceed.set()
+    first_events, second_events = await asyncio.gather(first, second)
+
+    assert len(runs) == 1
+    assert first_events[0]["choices"][0]["session_state"] == "first"
+    assert second_events[0]["choices"][0]["session_state"] == "second"
+    assert [event["choices"][0]["delta"].get("content") for event in second_events] == [None, "Paris"]
+
+
+@pytest.mark.asyncio
+async def test_coalesced_stream_stops_without_subscribers():
+    coalescer = RequestCoalescer()
+    cancelled = asyncio.Event()
+
+    async def events():
+        yield {"choices": [{"delta": {"content": "The"}}]}
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        yield {"choices": [{"delta": {"content": " end"}}]}
+
+    async def run():
+        return events()
+
+    stream = await coalescer.run("key", run, stream=True)
+    assert (await stream.__anext__())["choices"][0]["delta"]["content"] == "The"
+    await stream.aclose()
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
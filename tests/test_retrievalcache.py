@@ -0,0 +1,131 @@
+import io
+import time
+
+import pytest
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents.aio import SearchClient
+from azure.search.documents.models import VectorizableTextQuery, VectorizedQuery
+
+from approaches.approach import Approach
+from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
+from core.retrievalcache import RetrievalCache
+from prepdocslib.listfilestrategy import File
+from prepdocslib.searchmanager import SearchManager, Section
+from prepdocslib.strategy import SearchInfo
+from prepdocslib.textsplitter import SplitPage
+
+from .mocks import (
+    MOCK_EMBEDDING_DIMENSIONS,
+    MOCK_EMBEDDING_MODEL_NAME,
+    MockAsyncSearchResultsIterator,
+)
+
+
+def test_retrieval_cache_key():
+    vectors = [VectorizedQuery(vector=[0.1, 0.2], k_nearest_neighbors=50, fields="embedding")]
+    key = RetrievalCache.key("index", "policy", None, vectors, [3])
+    assert key == RetrievalCache.key(
+        "index", "policy", None, [VectorizedQuery(vector=[0.1, 0.2], k_nearest_neighbors=50, fields="embedding")], [3]
+    )
+    assert key != RetrievalCache.key(
+        "index", "policy", None, [VectorizedQuery(vector=[0.1, 0.3], k_nearest_neighbors=50, fields="embedding")], [3]
+    )
+    assert key != RetrievalCache.key("index", "policy", "oids/any", vectors, [3])
+    assert key != RetrievalCache.key("index", "policy", None, vectors, [5])
+    assert key != RetrievalCache.key("other", "policy", None, vectors, [3])
+    assert key != RetrievalCache.key("index", "policy", None, [], [3])
+    assert RetrievalCache.key(
+        "index", "policy", None, [VectorizableTextQuery(text="policy", k_nearest_neighbors=50, fields="embedding")], [3]
+    ) != RetrievalCache.key(
+        "index", "policy", None, [VectorizableTextQuery(text="plans", k_nearest_neighbors=50, fields="embedding")], [3]
+    )
+
+
+def test_retrieval_cache_get_put_invalidate(monkeypatch):
+    cache = RetrievalCache(max_entries=2, ttl=60)
+    cache.put("k1", "index1", ["a"])
+    cache.put("k2", "index2", ["b"])
+    assert cache.get("k1") == ["a"]
+    assert cache.get("k3") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # The least recently used entry makes room
+    cache.put("k3", "index1", ["c"])
+    assert cache.get("k2") is None
+    assert len(cache) == 2
+
+    cache.invalidate("index1")
+    assert cache.get("k1") is None
+    assert cache.get("k3") is None
+    assert len(cache) == 0
+
+    cache.put("k1", "index1", ["a"])
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+    assert cache.get("k1") is None
+    assert len(cache) == 0
+
+
+def test_retrieval_cache_disabled():
+    cache = RetrievalCache(max_entries=0)
+    cache.put("k1", "index1", ["a"])
+    assert cache.get("k1") is None
+
+
+@pytest.mark.asyncio
+async def test_search_cached(monkeypatch):
+    chat_approach = ChatReadRetrieveReadApproach(
+        search_client=SearchClient(endpoint="", index_name="test", credential=AzureKeyCredential("")),
+        auth_helper=None,
+        openai_client=None,
+        chatgpt_model="gpt-35-turbo",
+        chatgpt_deployment="chat",
+        embedding_deployment="embeddings",
+        embedding_model=MOCK_EMBEDDING_MODEL_NAME,
+        embedding_dimensions=MOCK_EMBEDDING_DIMENSIONS,
+        sourcepage_field="",
+        content_field="",
+        query_language="en-us",
+        query_speller="lexicon",
+    )
+    searches = []
+
+    async def mock_search(*args, **kwargs):
+        searches.append(kwargs.get("filter"))
+        return MockAsyncSearchResultsIterator(kwargs.get("search_text"), kwargs.get("vector_queries"))
+
+    monkeypatch.setattr(SearchClient, "search", mock_search)
+    search_args = dict(
+        top=10,
+        query_text="test query",
+        vectors=[VectorizedQuery(vector=[0.1, 0.2], k_nearest_neighbors=50, fields="embedding")],
+        use_semantic_ranker=False,
+        use_semantic_captions=False,
+        minimum_search_score=None,
+        minimum_reranker_score=None,
+    )
+    results = await chat_approach.search(filter=None, **search_args)
+    assert await chat_approach.search(filter=None, **search_args) == results
+    await chat_approach.search(filter="oids/any(g:search.in(g, 'OID_X'))", **search_args)
+    assert searches == [None, "oids/any(g:search.in(g, 'OID_X'))"]
+
+    # Adding documents to the index drops its results
+    async def mock_upload_documents(self, documents):
+        pass
+
+    monkeypatch.setattr(SearchClient, "upload_documents", mock_upload_documents)
+    monkeypatch.setattr(SearchManager, "on_content_changed", Approach.retrieval_cache.invalidate)
+    manager = SearchManager(
+        SearchInfo(
+            endpoint="https://testsearchclient.blob.core.windows.net",
+            credential=AzureKeyCredential("test"),
+            index_name_list=["test"],
+        )
+    )
+    test_io = io.BytesIO(b"test content")
+    test_io.name = "test/foo.pdf"
+    await manager.update_content(
+        "test", [Section(split_page=SplitPage(page_num=0, text="test content"), content=File(test_io))]
+    )
+    await chat_approach.search(filter=None, **search_args)
+    assert searches == [None, "oids/any(g:search.in(g, 'OID_X'))", None]
@@ -0,0 +1,89 @@
+import json
+from unittest import mock
+
+import pytest
+from azure.core.exceptions import ResourceNotFoundError
+from azure.search.documents.indexes.models import SearchField, SearchIndex
+
+from core.searchindexcache import SearchIndexSchemaCache
+
+
+def create_search_index_client():
+    async def mock_get_index(index_name: str):
+        if index_name == "missing":
+            raise ResourceNotFoundError("Index not found")
+        return SearchIndex(
+            name=index_name,
+            fields=[
+                SearchField(name="id", type="Edm.String"),
+                SearchField(name="oids", type="Collection(Edm.String)"),
+            ],
+        )
+
+    search_index_client = mock.Mock()
+    search_index_client.get_index = mock.AsyncMock(side_effect=mock_get_index)
+    return search_index_client
+
+
+@pytest.mark.asyncio
+async def test_get_index_caches_in_memory(tmp_path):
+    search_index_client = create_search_index_client()
+    cache = SearchIndexSchemaCache(search_index_client, snapshot_path=str(tmp_path / "schemas.json"))
+
+    await cache.get_index("index-a")
+    search_index = await cache.get_index("index-a")
+    assert [field.name for field in search_index.fields] == ["id", "oids"]
+    assert search_index_client.get_index.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_snapshot_is_reused_by_new_worker(tmp_path):
+    snapshot_path = str(tmp_path / "schemas.json")
+    await SearchIndexSchemaCache(create_search_index_client(), snapshot_path=snapshot_path).get_index("index-a")
+    await SearchIndexSchemaCache(create_search_index_client(), snapshot_path=snapshot_path).get_index("index-b")
+    with open(snapshot_path) as snapshot_file:
+        assert set(json.load(snapshot_file).keys()) == {"index-a", "index-b"}
+
+    search_index_client = create_search_index_client()
+    cache = SearchIndexSchemaCache(search_index_client, snapshot_path=snapshot_path)
+    search_index = await cache.get_index("index-b")
+    assert search_index.name == "index-b"
+    assert [(field.name, field.type) for field in search_index.fields] == [
+        ("id", "Edm.String"),
+        ("oids", "Collection(Edm.String)"),
+    ]
+    search_index_client.get_index.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_expired_snapshot_is_refreshed(tmp_path):
+    snapshot_path = tmp_path / "schemas.json"
+    snapshot_path.write_text(json.dumps({"index-a": {"fetched_at": 0, "fields": []}}))
+
+    search_index_client = create_search_index_client()
+    cache = SearchIndexSchemaCache(search_index_client, snapshot_path=str(snapshot_path), ttl=60)
+    search_index = await cache.get_index("index-a")
+    assert len(search_index.fields) == 2
+    search_index_client.get_index.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_unreadable_snapshot_is_ignored(tmp_path):
+    snapshot_path = tmp_path / "schemas.json"
+    snapshot_path.write_text("{not json")
+
+    cache = SearchIndexSchemaCache(create_search_index_client(), snapshot_path=str(snapshot_path))
+    assert (await cache.get_index("index-a")).name == "index-a"
+
+
+@pytest.mark.asyncio
+async def test_prefetch_fetches_all_and_tolerates_missing(tmp_path):
+    search_index_client = create_search_index_client()
+    cache = SearchIndexSchemaCache(search_index_client, snapshot_path=str(tmp_path / "schemas.json"))
+
+    await cache.prefetch(["index-a", "missing", "index-b"])
+    assert search_index_client.get_index.await_count == 3
+    await cache.get_index("index-b")
+    assert search_index_client.get_index.await_count == 3
+    with pytest.raises(ResourceNotFoundError):
+        await cache.get_index("missing")
@@ -0,0 +1,87 @@
+import time
+
+from core.semanticcache import SemanticAnswerCache
+
+
+def answer(content: str) -> dict:
+    return {
+        "choices": [
+            {
+                "message": {"role": "assistant", "content": content},
+                "context": {"thoughts_id": "THOUGHTS"},
+                "session_state": None,
+            }
+        ]
+    }
+
+
+def test_semantic_cache_answers_similar_questions():
+    cache = SemanticAnswerCache(threshold=0.95)
+    scope = SemanticAnswerCache.scope("index", "Chat", None, {})
+    assert cache.get(scope, [1.0, 0.0, 0.0]) is None
+    cache.put(scope, "index", [1.0, 0.0, 0.0], answer("Paris"))
+
+    cached = cache.get(scope, [0.99, 0.05, 0.0], session_state="state")
+    assert cached["choices"][0]["message"]["content"] == "Paris"
+    assert cached["choices"][0]["session_state"] == "state"
+    assert "thoughts_id" not in cached["choices"][0]["context"]
+    # Too far off, or asked with another filter
+    assert cache.get(scope, [0.7, 0.7, 0.0]) is None
+    assert cache.get(SemanticAnswerCache.scope("index", "Chat", "oids/any", {}), [1.0, 0.0, 0.0]) is None
+    assert cache.hits == 1 and cache.misses == 3
+    assert cache.hit_rate == 0.25
+
+
+def test_semantic_cache_evicts_least_recently_used(monkeypatch):
+    cache = SemanticAnswerCache(threshold=0.99, max_entries=2, ttl=60)
+    scope = SemanticAnswerCache.scope("index", "Chat", None, {})
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+    cache.put(scope, "index", [1.0, 0.0], answer("first"))
+    now += 1
+    cache.put(scope, "index", [0.0, 1.0], answer("second"))
+    now += 1
+    assert cache.get(scope, [1.0, 0.0]) is not None
+    now += 1
+    cache.put(scope, "index", [1.0, 1.0], answer("third"))
+    assert len(cache) == 2
+    assert cache.get(scope, [0.0, 1.0]) is None
+    assert cache.get(scope, [1.0, 0.0]) is not None
+
+    now += 61
+    assert cache.get(scope, [1.0, 1.0]) is None
+
+    cache.put(scope, "index", [1.0, 0.0], answer("first"))
+    cache.invalidate("index")
+    assert len(cache) == 0
+
+
+def test_semantic_cache_memory_bounded_with_many_scopes():
+    cache = SemanticAnswerCache(threshold=0.95, max_entries=256, max_scopes=1000, max_rows=64)
+    for user in range(100):
+        scope = SemanticAnswerCache.scope("index", "Chat", f"oids/any(g:search.in(g, 'OID_{user}'))", {})
+        for question in range(3):
+            cache.put(scope, "index", [1.0, float(user), float(question)], answer(f"{user}-{question}"))
+
+    scopes = list(cache._scopes.values())
+    # Scopes only allocate rows for the questions they hold, the least recently used ones make room
+    assert sum(scope.vectors.shape[0] for scope in scopes) <= 64
+    assert all(scope.vectors.shape[0] == 8 for scope in scopes)
+    assert len(scopes) == 8
+    assert len(cache) == 24
+    latest = SemanticAnswerCache.scope("index", "Chat", "oids/any(g:search.in(g, 'OID_99'))", {})
+    assert cache.get(latest, [1.0, 99.0, 2.0])["choices"][0]["message"]["content"] == "99-2"
+    first = SemanticAnswerCache.scope("index", "Chat", "oids/any(g:search.in(g, 'OID_0'))", {})
+    assert cache.get(first, [1.0, 0.0, 0.0]) is None
+
+
+def test_semantic_cache_scope_grows_up_to_max_entries():
+    cache = SemanticAnswerCache(threshold=0.999, max_entries=20)
+    scope = SemanticAnswerCache.scope("index", "Chat", None, {})
+    for question in range(30):
+        cache.put(scope, "index", [1.0, float(question)], answer(str(question)))
+    assert cache._scopes[scope].vectors.shape[0] == 20
+    assert len(cache) == 20
+    assert cache.get(scope, [1.0, 29.0])["choices"][0]["message"]["content"] == "29"
+    cache.invalidate("index")
+    assert cache._rows == 0
@@ -0,0 +1,101 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from core.tenantregistry import (
+    Tenant,
+    TenantRegistry,
+    index_name_for_tenant,
+    is_valid_tenant_name,
+)
+
+
+def create_tenant(tenant_name: str) -> Tenant:
+    search_client = mock.Mock()
+    search_client.close = mock.AsyncMock()
+    return Tenant(
+        name=tenant_name,
+        index_name=f"index-{tenant_name}",
+        search_client=search_client,
+        auth_helper=mock.Mock(),
+        chat_approach=mock.Mock(),
+    )
+
+
+def test_index_name_for_tenant():
+    assert index_name_for_tenant("Phelps", "gptkbindex") == "gptkbindex-phelps"
+    assert index_name_for_tenant("Smith & Sons, Inc.", "gptkbindex") == "gptkbindex-smith-sons-inc"
+    assert index_name_for_tenant("T1", "gptkbindex", {"T1": "legacy-index"}) == "legacy-index"
+    with pytest.raises(ValueError):
+        index_name_for_tenant("___", "gptkbindex")
+
+
+def test_is_valid_tenant_name():
+    assert is_valid_tenant_name("Phelps")
+    assert is_valid_tenant_name("Smith Sons-2024")
+    assert not is_valid_tenant_name("")
+    assert not is_valid_tenant_name("../secrets")
+    assert not is_valid_tenant_name("a" * 200)
+
+
+@pytest.mark.asyncio
+async def test_registry_builds_lazily_and_caches():
+    build_tenant = mock.AsyncMock(side_effect=create_tenant)
+    registry = TenantRegistry(build_tenant)
+    assert "Phelps" not in registry
+
+    tenant = await registry.get("Phelps")
+    assert tenant.index_name == "index-Phelps"
+    assert await registry.get("Phelps") is tenant
+    assert build_tenant.await_count == 1
+    assert len(registry) == 1
+
+
+@pytest.mark.asyncio
+async def test_registry_single_flight():
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def build_tenant(tenant_name: str) -> Tenant:
+        started.set()
+        await release.wait()
+        return create_tenant(tenant_name)
+
+    registry = TenantRegistry(build_tenant)
+    first = asyncio.create_task(registry.get("Phelps"))
+    second = asyncio.create_task(registry.get("Phelps"))
+    await started.wait()
+    release.set()
+    assert await first is await second
+
+
+@pytest.mark.asyncio
+async def test_registry_failed_build_is_retried():
+    build_tenant = mock.AsyncMock(side_effect=[Exception("index missing"), create_tenant("Phelps")])
+    registry = TenantRegistry(build_tenant)
+    with pytest.raises(Exception, match="index missing"):
+        await registry.get("Phelps")
+    assert "Phelps" not in registry
+    assert (await registry.get("Phelps")).name == "Phelps"
+
+
+@pytest.mark.asyncio
+async def test_registry_evicts_least_recently_used():
+    registry = TenantRegistry(mock.AsyncMock(side_effect=create_tenant), max_tenants=2, close_delay=0)
+    first = await registry.get("A")
+    second = await registry.get("B")
+    # Touching A makes B the least recently used tenant
+    await registry.get("A")
+    await registry.get("C")
+
+    assert "B" not in registry
+    assert "A" in registry and "C" in registry
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    second.search_client.close.assert_awaited_once()
+    first.search_client.close.assert_not_awaited()
+
+    await registry.close()
+    assert len(registry) == 0
+    first.search_client.close.assert_awaited_once()
@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+from approaches.approach import ThoughtStep
+from core.thoughtsstore import ThoughtsStore
+
+
+def test_thoughts_built_once_for_the_same_user(monkeypatch):
+    builds = []
+
+    def build_thoughts():
+        builds.append(1)
+        return ["thought"]
+
+    store = ThoughtsStore(ttl=60)
+    thoughts_id = store.put(build_thoughts, "OID_X")
+    assert builds == []
+    assert store.get(thoughts_id, "OID_Y") is None
+    assert store.get(thoughts_id, "OID_X") == ["thought"]
+    assert store.get(thoughts_id, "OID_X") == ["thought"]
+    assert len(builds) == 1
+
+    later = time.monotonic() + 61
+    monkeypatch.setattr(time, "monotonic", lambda: later)
+    assert store.get(thoughts_id, "OID_X") is None
+    assert len(store) == 0
+
+
+def test_thoughts_store_bounded():
+    store = ThoughtsStore(max_entries=2)
+    first = store.put(lambda: ["first"], None)
+    store.put(lambda: ["second"], None)
+    store.put(lambda: ["third"], None)
+    assert store.get(first, None) is None
+    assert len(store) == 2
+    assert ThoughtsStore(max_entries=0).put(lambda: [], None) is None
+
+
+@pytest.mark.asyncio
+async def test_thoughts_shared_between_workers(tmp_path, monkeypatch):
+    directory = str(tmp_path / "thoughts")
+    worker1 = ThoughtsStore(ttl=60, directory=directory)
+    worker2 = ThoughtsStore(ttl=60, directory=directory)
+
+    thoughts_id = worker1.put(lambda: [ThoughtStep("Search query", "dress code", props={"top": 3})], "OID_X")
+    # Written in the background
+    for _ in range(100):
+        if (tmp_path / "thoughts" / f"{thoughts_id}.json").exists():
+            break
+        time.sleep(0.01)
+
+    assert await worker2.fetch(thoughts_id, "OID_X") == [
+        {"title": "Search query", "description": "dress code", "props": {"top": 3}}
+    ]
+    assert await worker2.fetch(thoughts_id, "OID_Y") is None
+    assert await worker2.fetch("../thoughts", "OID_X") is None
+    assert await worker2.fetch("0" * 32, "OID_X") is None
+
+    later = time.time() + 61
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert await worker2.fetch(thoughts_id, "OID_X") is None